@@ -0,0 +1,210 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Discovers a whole MCC tree with a single streamed customer_client query.
+
+The top MCC query returns every direct and indirect client together with its level (distance
+from the top MCC) and its manager flag, but not its parent. A client of level L has an ancestor
+at every level above it, so a manager alone at its level is an ancestor of every client below
+it. The tree is built from the levels: the parent of a client is known when the level above it
+has a single manager; below a level with several managers, a client is attached to its nearest
+known ancestor (the closest manager alone at its level, or the top MCC), and its hierarchy skips
+the levels in between.
+
+With resolve_parents, the exact parents of these clients are found by expanding the managers
+above them (their direct children, level = 1), in parallel: one request per manager but the last
+one of each such level, which owns whatever the others did not claim.
+
+Parents known from a previous discovery (see hierarchy_cache.py) are reused for the levels whose
+membership did not change: the same clients, below the same managers. A level with a new, gone or
+moved client, or whose managers changed, is resolved again, so a refresh only expands the levels
+that changed. A client moved between two managers of the same level, with no other change of
+these levels, is not detected: it keeps its previous parent until a full discovery.
+"""
+from collections import defaultdict
+from concurrent import futures
+
+_DEFAULT_MAX_WORKERS = 8
+
+
+class AccountTree:
+    """The clients (id, is_manager, level) of a top account and the parent of each client (or its
+    nearest known ancestor, see AccountTreeDiscovery)"""
+
+    @property
+    def top_id(self):
+        return self._top_id
+
+    @property
+    def clients(self):
+        return self._clients
+
+    @property
+    def parents(self):
+        return self._parents
+
+    def __init__(self, top_id, clients, parents):
+        self._top_id = top_id
+        self._clients = clients
+        self._parents = parents
+
+    def flat_accounts(self, top_hierarchy=None):
+        """Returns a list {id, hierarchy} for the top account and all its descendant accounts"""
+        top_hierarchy = self._top_id if top_hierarchy is None else top_hierarchy
+        hierarchies = {self._top_id: top_hierarchy}
+        accounts = [{"account_id": self._top_id, "hierarchy": top_hierarchy}]
+        for client_id, _, _ in sorted(self._clients, key=lambda client: client[2]):
+            hierarchy = hierarchies[self._parents[client_id]] + '_' + client_id
+            hierarchies[client_id] = hierarchy
+            accounts.append({"account_id": client_id, "hierarchy": hierarchy})
+        return accounts
+
+    def to_json(self):
+        return {"top_id": self._top_id,
+                "clients": [[client_id, is_manager, level, self._parents[client_id]] for
+                            client_id, is_manager, level in self._clients]}
+
+    @classmethod
+    def from_json(cls, tree_json):
+        clients = [(client_id, is_manager, level) for client_id, is_manager, level, _ in
+                   tree_json["clients"]]
+        parents = {client[0]: client[3] for client in tree_json["clients"]}
+        return cls(tree_json["top_id"], clients, parents)
+
+
+class AccountTreeDiscovery:
+    """Flattens an MCC tree into a list of {account_id, hierarchy}"""
+
+    @property
+    def requests_count(self):
+        return self._requests_count
+
+    def __init__(self, gads_service_wrapper, max_workers=_DEFAULT_MAX_WORKERS,
+                 resolve_parents=False):
+        """With {resolve_parents}, the managers of the levels with several managers are expanded
+        to find the parent of every client, instead of the nearest known ancestor"""
+        self._gads_service_wrapper = gads_service_wrapper
+        self._max_workers = max_workers
+        self._expand_managers = resolve_parents
+        self._requests_count = 0
+
+    def discover(self, top_id, top_hierarchy=None):
+        """Returns a list {id, hierarchy} for the top account and all its descendant accounts"""
+        return self.discover_tree(top_id).flat_accounts(top_hierarchy)
+
+    def discover_tree(self, top_id, known_tree=None):
+        """Returns the AccountTree of top_id. The parents of known_tree (a previous AccountTree of
+        top_id) are trusted for the levels whose membership did not change"""
+        top_id = str(top_id)
+        clients = [client for client in self._gads_service_wrapper.get_customer_clients(top_id)
+                   if client[0] != top_id]
+        self._requests_count += 1
+
+        levels = defaultdict(list)
+        managers_per_level = defaultdict(list)
+        for client_id, is_manager, level in clients:
+            levels[level].append(client_id)
+            if is_manager:
+                managers_per_level[level].append(client_id)
+
+        known_parents = self._get_unchanged_parents(levels, managers_per_level, known_tree)
+        parents = self._resolve_parents(top_id, levels, managers_per_level, known_parents)
+        return AccountTree(top_id, clients, parents)
+
+    @staticmethod
+    def _get_unchanged_parents(levels, managers_per_level, known_tree):
+        """Returns the {client_id: parent_id} of known_tree for the clients of the levels with the
+        same clients and the same managers above them as in known_tree"""
+        if known_tree is None:
+            return {}
+        known_levels = defaultdict(set)
+        known_managers_per_level = defaultdict(set)
+        for client_id, is_manager, level in known_tree.clients:
+            known_levels[level].add(client_id)
+            if is_manager:
+                known_managers_per_level[level].add(client_id)
+        known_parents = {}
+        for level, client_ids in levels.items():
+            if set(client_ids) == known_levels[level] and \
+                    set(managers_per_level.get(level - 1, [])) == \
+                    known_managers_per_level[level - 1]:
+                known_parents.update((client_id, known_tree.parents.get(client_id)) for
+                                     client_id in client_ids)
+        return known_parents
+
+    def _resolve_parents(self, top_id, levels, managers_per_level, known_parents):
+        """Returns a {client_id: parent_id} map. A client below several managers gets its known
+        parent, else the parent found by expanding these managers (with resolve_parents), else its
+        nearest known ancestor"""
+        parents = {client_id: top_id for client_id in levels.get(1, [])}
+        unresolved_levels = {}
+        for level in levels:
+            if level <= 1:
+                continue
+            candidates = managers_per_level.get(level - 1, [])
+            candidates_set = set(candidates)
+            unresolved = []
+            for client_id in levels[level]:
+                parent_id = known_parents.get(client_id)
+                if parent_id in candidates_set:
+                    parents[client_id] = parent_id
+                else:
+                    unresolved.append(client_id)
+            if unresolved:
+                unresolved_levels[level] = unresolved
+
+        if not self._expand_managers:
+            for level, unresolved in unresolved_levels.items():
+                ancestor_id = _get_nearest_known_ancestor(top_id, level, managers_per_level)
+                parents.update((client_id, ancestor_id) for client_id in unresolved)
+            return parents
+
+        managers_to_expand = []
+        for level in unresolved_levels:
+            candidates = managers_per_level.get(level - 1, [])
+            managers_to_expand.extend(candidates[:-1])
+
+        expanded_children = {}
+        if managers_to_expand:
+            with futures.ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                results = executor.map(
+                    lambda manager_id: self._gads_service_wrapper.get_customer_clients(
+                        manager_id, level=1), managers_to_expand)
+                for manager_id, children in zip(managers_to_expand, results):
+                    expanded_children[manager_id] = children
+            self._requests_count += len(managers_to_expand)
+
+        for level, unresolved in unresolved_levels.items():
+            candidates = managers_per_level.get(level - 1, [])
+            unresolved_set = set(unresolved)
+            for manager_id in candidates[:-1]:
+                for child_id, _, _ in expanded_children[manager_id]:
+                    if child_id in unresolved_set and child_id not in parents:
+                        parents[child_id] = manager_id
+            # The last manager owns every client the expanded managers did not claim. A level
+            # without any manager above it should not happen; attach its clients to the top.
+            fallback_parent = candidates[-1] if candidates else top_id
+            for client_id in unresolved:
+                parents.setdefault(client_id, fallback_parent)
+        return parents
+
+
+def _get_nearest_known_ancestor(top_id, level, managers_per_level):
+    """Returns the closest manager alone at its level above {level}, an ancestor of every client
+    of {level}, or top_id if there is none"""
+    for ancestor_level in range(level - 1, 0, -1):
+        managers = managers_per_level.get(ancestor_level, [])
+        if len(managers) == 1:
+            return managers[0]
+    return top_id
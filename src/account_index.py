@@ -0,0 +1,50 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A shared index of the accounts of several top MCCs, so that every account is audited once.
+
+An account linked under several top MCCs is assigned to the first of them (in the given order)
+that has it, and keeps the hierarchy paths of all its links. Its ads are then scanned, removed
+and counted only once, in the summary of the top MCC it is assigned to.
+"""
+
+
+class AccountIndex:
+    """Assigns each customer id to a single top MCC and collects all its hierarchy paths"""
+
+    @property
+    def duplicates_count(self):
+        """The number of links to accounts already assigned to a top MCC"""
+        return self._duplicates_count
+
+    def __init__(self):
+        self._accounts = {}
+        self._duplicates_count = 0
+
+    def add_accounts(self, top_id, accounts):
+        """Adds the flattened accounts ({account_id, hierarchy, ...}) of a top MCC"""
+        for account in accounts:
+            indexed_account = self._accounts.get(account["account_id"])
+            if indexed_account is None:
+                indexed_account = dict(account, top_id=top_id, hierarchies=[])
+                self._accounts[account["account_id"]] = indexed_account
+            else:
+                self._duplicates_count += 1
+            if account["hierarchy"] not in indexed_account["hierarchies"]:
+                indexed_account["hierarchies"].append(account["hierarchy"])
+
+    def get_accounts(self):
+        """Returns every account once, with its top_id and all its hierarchies, in the order they
+        were added"""
+        return list(self._accounts.values())
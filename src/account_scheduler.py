@@ -0,0 +1,130 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs account tasks on a thread pool whose effective concurrency adapts to the API.
+
+The pool has {max_workers} threads, but only {limit} tasks may run at once, starting from half of
+the threads. The limit follows an AIMD policy driven by the API requests of the tasks, as
+reported by the API client (see GAdsServiceWrapper.set_listener). It is halved (down to
+{min_workers}) whenever a request fails with a quota error; the API client retries the request
+itself, so a task is never run twice (it may have written part of its results). After every round
+of {limit} successful requests the limit grows by one as long as the latency of every kind of
+request (exponentially averaged) stays within {latency_tolerance} times the best average seen so
+far for that kind, and shrinks by one otherwise. The duration of the tasks is not used: it depends
+on the size of the accounts much more than on the health of the API.
+"""
+import logging
+import threading
+import time
+from concurrent import futures
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_MAX_WORKERS = 16
+_DEFAULT_MIN_WORKERS = 1
+_LATENCY_TOLERANCE = 2.0
+_LATENCY_SMOOTHING = 0.2
+
+
+class AdaptiveScheduler:
+    """A ThreadPoolExecutor.map replacement with an adaptive concurrency limit"""
+
+    @property
+    def limit(self):
+        return self._limit
+
+    def __init__(self, max_workers=_DEFAULT_MAX_WORKERS, min_workers=_DEFAULT_MIN_WORKERS,
+                 initial_workers=None, latency_tolerance=_LATENCY_TOLERANCE):
+        self._max_workers = max(1, max_workers)
+        self._min_workers = max(1, min(min_workers, self._max_workers))
+        if initial_workers is None:
+            initial_workers = self._max_workers // 2
+        self._limit = max(self._min_workers, min(initial_workers, self._max_workers))
+        self._latency_tolerance = latency_tolerance
+        self._active = 0
+        self._successes_since_change = 0
+        self._last_decrease = None
+        self._latency_averages = {}
+        self._best_latency_averages = {}
+        self._condition = threading.Condition()
+
+    def map(self, fn, items, return_exceptions=False):
+        """Returns [fn(item) for item in items], computed concurrently. Raises the first
+        exception, or returns it in place of the item's result if {return_exceptions}"""
+        with futures.ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            results = [executor.submit(self._run, fn, item) for item in items]
+            if not return_exceptions:
+                return [result.result() for result in results]
+            return [result.exception() or result.result() for result in results]
+
+    def on_quota_error(self, started):
+        """Halves the limit, unless it was already lowered after the failed request was sent at
+        {started} (time.monotonic()): requests sent together tend to hit the quota together"""
+        with self._condition:
+            if self._last_decrease is not None and started < self._last_decrease:
+                return
+            self._last_decrease = time.monotonic()
+            new_limit = max(self._min_workers, self._limit // 2)
+            if new_limit != self._limit:
+                logger.warning("Quota error, lowering concurrency from %d to %d", self._limit,
+                               new_limit)
+            self._set_limit(new_limit)
+
+    def on_request_latency(self, kind, latency_seconds):
+        """Updates the latency average of a kind of request and, after every round of {limit}
+        requests, grows or shrinks the limit"""
+        with self._condition:
+            latency_average = self._latency_averages.get(kind)
+            if latency_average is None:
+                latency_average = latency_seconds
+            else:
+                latency_average += _LATENCY_SMOOTHING * (latency_seconds - latency_average)
+            self._latency_averages[kind] = latency_average
+            best_latency_average = self._best_latency_averages.get(kind)
+            if best_latency_average is None or latency_average < best_latency_average:
+                self._best_latency_averages[kind] = latency_average
+
+            self._successes_since_change += 1
+            if self._successes_since_change < self._limit:
+                return
+            if any(average > self._best_latency_averages[kind] * self._latency_tolerance for
+                   kind, average in self._latency_averages.items()):
+                self._set_limit(max(self._min_workers, self._limit - 1))
+            else:
+                self._set_limit(min(self._max_workers, self._limit + 1))
+
+    def _run(self, fn, item):
+        self._acquire_slot()
+        try:
+            return fn(item)
+        finally:
+            self._release_slot()
+
+    def _acquire_slot(self):
+        with self._condition:
+            while self._active >= self._limit:
+                self._condition.wait()
+            self._active += 1
+
+    def _release_slot(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def _set_limit(self, limit):
+        """Must be called with the condition held"""
+        if limit != self._limit:
+            self._limit = limit
+            self._condition.notify_all()
+        self._successes_since_change = 0
@@ -0,0 +1,60 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Deterministic partitioning of the accounts of a top MCC into shards, for several nodes or
+worker processes.
+
+Shard K of N (K from 1 to N) holds the accounts whose id hashes (crc32) to K - 1 modulo N. Every
+node computes the same shards from the same account list, whatever its order, and an account stays
+in its shard across sessions as long as N does not change, so resumed sessions and per shard state
+(journals, change watermarks) stay consistent.
+
+The worker process shards of a node shard hash the ids with a salt: within node shard K of N, every
+id already hashes to K - 1 modulo N, so the same hash would put all the accounts in one process
+whenever the process count shares a factor with N.
+"""
+import zlib
+
+
+def parse_shard(text):
+    """Parses a "K/N" shard into (K, N)"""
+    try:
+        shard_index, shards_count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {text}, expected K/N") from None
+    if not 1 <= shard_index <= shards_count:
+        raise ValueError(f"Invalid shard {text}, K must be between 1 and N")
+    return shard_index, shards_count
+
+
+PROCESS_SHARD_SALT = ":proc"
+
+
+def get_shard_index(account_id, shards_count, salt=""):
+    """Returns the shard (from 1 to shards_count) of an account, hashing its id with {salt}"""
+    return zlib.crc32(f"{account_id}{salt}".encode()) % shards_count + 1
+
+
+def select_shard(accounts, shard_index, shards_count, salt=""):
+    """Returns the accounts of shard {shard_index} of {shards_count} (hashed with {salt}), in
+    their original order"""
+    return [account for account in accounts if
+            get_shard_index(account["account_id"], shards_count, salt) == shard_index]
+
+
+def get_shard_suffix(*shards):
+    """Returns the file name suffix of nested shards, e.g. "_2of4" for (2, 4); None shards (not
+    sharded) are skipped"""
+    return "".join(f"_{shard_index}of{shards_count}" for shard_index, shards_count in
+                   (shard for shard in shards if shard is not None))
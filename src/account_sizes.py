@@ -0,0 +1,155 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-account size estimates, for the scheduling of the accounts, one file per top MCC id.
+
+The size of an account is the number of disapproved ads (streamed rows) its last full scan found.
+Accounts are dispatched largest first, so a large account does not start last and leave the
+other workers idle until it completes, and an account larger than a threshold is split into
+parts (contiguous ranges of its campaign ids) which are audited in parallel.
+"""
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+
+
+class AccountPart:
+    """A range of the campaign ids of an account (None = open), audited as a task of its own"""
+
+    @property
+    def account(self):
+        return self._split_account.account
+
+    @property
+    def split_account(self):
+        return self._split_account
+
+    @property
+    def campaign_range(self):
+        return self._campaign_range
+
+    def __init__(self, split_account, campaign_range):
+        self._split_account = split_account
+        self._campaign_range = campaign_range
+        self.seconds = 0.0  # The time spent auditing the part
+
+
+class SplitAccount:
+    """An account audited in parts, to be completed as soon as its last part is done"""
+
+    @property
+    def account(self):
+        return self._account
+
+    @property
+    def parts(self):
+        return self._parts
+
+    def __init__(self, account, campaign_ranges):
+        self._account = account
+        self._parts = [AccountPart(self, campaign_range) for campaign_range in campaign_ranges]
+        self._part_results = []
+        self._lock = threading.Lock()
+        self.result = None  # The result of the account, once completed
+
+    def add_part_result(self, part, result):
+        """Records the result (or exception) of a part, from any thread. Returns the (part,
+        result) of all the parts when it is the last one, else None"""
+        with self._lock:
+            self._part_results.append((part, result))
+            if len(self._part_results) < len(self._parts):
+                return None
+            return list(self._part_results)
+
+
+class AccountSizes:
+    """Loads, updates (from any thread) and stores the size estimates of a top MCC"""
+
+    def __init__(self, cache_path, top_id, shard_suffix=""):
+        """The sizes of a shard of the accounts (see account_sharding) are kept in their own
+        file, with {shard_suffix}"""
+        self._cache_path = cache_path
+        self._top_id = top_id
+        self._shard_suffix = shard_suffix
+        self._lock = threading.Lock()
+        self._sizes = self.load().get("accounts", {})
+        # The rows of the parts of the accounts scanned in this session, by account and part
+        self._scanned_parts = {}
+
+    def get(self, account_id):
+        """Returns the estimated size of an account, or None if it is not known"""
+        with self._lock:
+            return self._sizes.get(account_id)
+
+    def record(self, account_id, rows_count, campaign_range=None):
+        """Records the rows of a full scan of an account, or of one of its parts"""
+        with self._lock:
+            parts = self._scanned_parts.setdefault(account_id, {})
+            parts[campaign_range] = rows_count
+            self._sizes[account_id] = sum(parts.values())
+
+    def load(self):
+        """Returns the stored sizes json, empty if there is none"""
+        try:
+            with open(self.get_sizes_file(), encoding='utf-8') as file_object:
+                return json.load(file_object)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        """Stores the sizes"""
+        Path(self._cache_path).mkdir(parents=True, exist_ok=True)
+        sizes_file = self.get_sizes_file()
+        temp_file = sizes_file.with_suffix(".tmp")
+        with self._lock:
+            sizes_json = {"updated": time.time(), "accounts": dict(self._sizes)}
+        with open(temp_file, 'w', encoding='utf-8') as file_object:
+            json.dump(sizes_json, file_object)
+        os.replace(temp_file, sizes_file)
+
+    def get_sizes_file(self):
+        """Returns the sizes file of the top MCC (or of its shard)"""
+        return Path(self._cache_path) / f"account_sizes_{self._top_id}{self._shard_suffix}.json"
+
+
+def get_parts_count(size, split_size, max_parts):
+    """Returns the number of parts of an account of {size} (None = unknown) to split into parts of
+    about {split_size} (0 = never split), at most {max_parts}"""
+    if not size or split_size <= 0:
+        return 1
+    return max(1, min(max_parts, math.ceil(size / split_size)))
+
+
+def split_campaign_ids(campaign_ids, parts_count):
+    """Returns {parts_count} (or fewer, with fewer campaigns) contiguous (min, max) ranges of
+    campaign ids, of about as many campaigns each. Together they cover every id: the first range
+    is open below, the last one open above"""
+    campaign_ids = sorted(set(campaign_ids))
+    parts_count = min(parts_count, len(campaign_ids))
+    if parts_count <= 1:
+        return [(None, None)]
+    bounds = [campaign_ids[len(campaign_ids) * index // parts_count] for index in
+              range(1, parts_count)]
+    return [(None if index == 0 else bounds[index - 1],
+             None if index == len(bounds) else bounds[index] - 1) for index in
+            range(parts_count)]
+
+
+def order_largest_first(tasks, get_size):
+    """Returns the tasks by decreasing estimated size, those of unknown size ({get_size} returns
+    None) first, in their original order otherwise"""
+    return sorted(tasks, key=lambda task: -math.inf if get_size(task) is None else -get_size(task))
@@ -23,11 +23,14 @@ def split(arr, size):
     return arrays
 
 
-def take_out_elements(list_object, indices):
-    """Removes elements from list in specified indices"""
-    removed_elements = []
-    indices = sorted(indices, reverse=True)
-    for idx in indices:
-        if idx < len(list_object):
-            removed_elements.append(list_object.pop(idx))
-    return removed_elements
+def chunked(iterable, size):
+    """Yields lists of up to size items of an iterable, without materializing it"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
@@ -0,0 +1,74 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Queue-backed logging: the threads that log only put their records on a queue, and a single
+background thread formats and writes them.
+
+The account workers used to print to a shared stdout, so every line serialized them on the
+terminal or pipe I/O. Records are not even formatted in the logging thread: the message and its
+arguments are formatted by the background thread (the arguments must not change after the log
+call, which holds for the strings and numbers logged here). Per ad lines are logged at DEBUG, so
+they cost a level check unless enabled.
+"""
+import atexit
+import logging
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+
+_FORMAT = '[%(asctime)s - %(levelname)s] %(message).5000s'
+
+_listener = None
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """Queues the records as they are, leaving their formatting to the listener thread"""
+
+    def prepare(self, record):
+        return record
+
+
+def start_async_logging(level=logging.INFO, stream=None):
+    """(Re)configures the root logger: records of {level} and above are written to stream
+    (default: the current sys.stdout) by a background thread"""
+    global _listener
+    stop_async_logging()
+    handler = logging.StreamHandler(stream if stream is not None else sys.stdout)
+    handler.setFormatter(logging.Formatter(_FORMAT))
+    root_logger = logging.getLogger()
+    for root_handler in root_logger.handlers[:]:
+        root_logger.removeHandler(root_handler)
+    queue = SimpleQueue()
+    root_logger.addHandler(_DeferredQueueHandler(queue))
+    root_logger.setLevel(level)
+    _listener = QueueListener(queue, handler)
+    _listener.start()
+
+
+def stop_async_logging():
+    """Writes the queued records and stops the background thread; records are then written
+    directly"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    root_logger = logging.getLogger()
+    for root_handler in root_logger.handlers[:]:
+        root_logger.removeHandler(root_handler)
+    for handler in _listener.handlers:
+        root_logger.addHandler(handler)
+    _listener = None
+
+
+atexit.register(stop_async_logging)
@@ -0,0 +1,91 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares the recursive MCC tree discovery with the single query AccountTreeDiscovery, with and
+without resolving the exact parents of the levels below several managers.
+
+Run from the src folder:
+    python3 -m benchmarks.discovery_benchmark --latency_ms 20 [--recursive]
+"""
+import argparse
+import sys
+import time
+
+from account_discovery import AccountTreeDiscovery
+from benchmarks.synthetic import FakeGAdsTreeService, deep_tree, wide_tree
+
+
+def recursive_flat_all_accounts(service, account_id, hierarchy):
+    """The recursive discovery AccountTreeDiscovery replaced: two queries per manager"""
+    accounts = service.get_sub_accounts(False, account_id, hierarchy)
+    accounts.append({"account_id": account_id, "hierarchy": hierarchy})
+    sub_mccs = service.get_sub_accounts(True, account_id, hierarchy)
+    for sub_mcc in sub_mccs:
+        accounts = accounts + recursive_flat_all_accounts(service, sub_mcc["account_id"],
+                                                          sub_mcc["hierarchy"])
+    return accounts
+
+
+def run_recursive(tree, latency_seconds):
+    service = FakeGAdsTreeService(tree, latency_seconds)
+    accounts = recursive_flat_all_accounts(service, tree.top_id, tree.top_id)
+    return accounts, service.requests_count
+
+
+def run_single_query(tree, latency_seconds):
+    service = FakeGAdsTreeService(tree, latency_seconds)
+    accounts = AccountTreeDiscovery(service).discover(tree.top_id)
+    return accounts, service.requests_count
+
+
+def run_resolved_parents(tree, latency_seconds):
+    service = FakeGAdsTreeService(tree, latency_seconds)
+    accounts = AccountTreeDiscovery(service, resolve_parents=True).discover(tree.top_id)
+    return accounts, service.requests_count
+
+
+def measure(name, runner, tree, latency_seconds):
+    start = time.perf_counter()
+    accounts, requests_count = runner(tree, latency_seconds)
+    elapsed = time.perf_counter() - start
+    print(f"\t{name:<16} rows={len(accounts):<8} requests={requests_count:<6} "
+          f"seconds={elapsed:.3f}")
+    return requests_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MCC tree discovery benchmark")
+    parser.add_argument("--latency_ms", type=float, default=20.0,
+                        help="Simulated latency of a single customer_client request.")
+    parser.add_argument("--recursive", action="store_true",
+                        help="Also run the recursive discovery (minutes on the wide tree).")
+    args = parser.parse_args()
+    latency_seconds = args.latency_ms / 1000.0
+    sys.setrecursionlimit(10000)
+
+    # customer_client returns indirect clients too, so the recursive discovery visits a manager
+    # once per subset of its ancestors (2^depth); keep the deep tree small for it.
+    trees = {"deep (6 levels x 400 leaves)": deep_tree(6, 400),
+             "wide (3 levels x 20 managers x 5 leaves)": wide_tree(20, 3, 5),
+             "flat (1 manager x 40000 leaves)": wide_tree(0, 1, 40000)}
+    for tree_name, tree in trees.items():
+        print(f"{tree_name}: {tree.accounts_count()} accounts")
+        if args.recursive:
+            measure("recursive", run_recursive, tree, latency_seconds)
+        measure("single query", run_single_query, tree, latency_seconds)
+        measure("resolved parents", run_resolved_parents, tree, latency_seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs main.main end to end against the fake Google Ads and BigQuery backends.
+
+Every scenario (sequential / parallel mode, with or without BQ) runs in a fresh process, so its
+peak RSS is its own. Appending the results to a file (--results_file) with a label per version
+tracks accounts/sec, ads/sec and peak RSS across versions. With --large_accounts, the last
+accounts of the tree hold many more ads than the others, to measure the tail of a session.
+
+The accounts and ads are counted from the output of the session (its PerAccountSummary and
+AdsToRemove rows), not from the attempts, and checked against the fake tree: every account
+summarized once, every ad scanned (and removed) once, and the ads of the accounts that did not fail
+are those of the fake backend with a relevant topic.
+
+Run from the src folder:
+    python3 -m benchmarks.e2e_benchmark --ads_per_account 2000 --latency_ms 20 -rm
+"""
+import argparse
+import contextlib
+import gzip
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from benchmarks.synthetic import wide_tree
+
+_MODES = {"sequential": ["-seq"], "parallel": []}
+_BQ_MODES = {"none": [], "streaming": ["-bq"], "load": ["-bq", "-bq_ingestion", "load"]}
+
+
+def run_scenario(scenario):
+    """Runs a session in this process and returns its throughput and peak RSS"""
+    # Imported here, as every scenario runs in a fresh process
+    # pylint: disable=import-outside-toplevel
+    import main
+    from async_logging import stop_async_logging
+    from bq_connector import BqServiceWrapper
+    from fakes.bigquery_client import FakeBigQueryClient
+    from fakes.google_ads import FakeGoogleAdsClient
+    from gads_connector import GAdsServiceWrapper
+    from mutate_pipeline import MutatePipeline
+
+    tree = wide_tree(scenario["managers_per_level"], scenario["levels"],
+                     scenario["leaves_per_manager"])
+    large_account_ids = get_large_account_ids(tree, scenario["large_accounts"])
+    fake_client = FakeGoogleAdsClient(tree, lambda account_id: scenario["large_account_ads"] if
+                                      account_id in large_account_ids else
+                                      scenario["ads_per_account"],
+                                      latency_seconds=scenario["latency_seconds"],
+                                      transient_error_rate=scenario["transient_error_rate"],
+                                      quota_error_rate=scenario["quota_error_rate"],
+                                      batch_rows=scenario["batch_rows"],
+                                      batch_latency_seconds=scenario["batch_latency_seconds"])
+    # The per account and per ad output of the tool goes to /dev/null (but is still formatted),
+    # unless a console file is given
+    with tempfile.TemporaryDirectory() as output_path, \
+            open(scenario["console_file"], 'a', encoding='utf-8') as console, \
+            contextlib.redirect_stdout(console):
+        args = main.parse_args(["-id", tree.top_id] + scenario["flags"])
+        main.configure(args)
+        main._OUTPUT_PATH = f"{output_path}/"  # pylint: disable=protected-access
+        main._STAGING_PATH = f"{output_path}/staging/"  # pylint: disable=protected-access
+        main._JOURNAL_PATH = f"{output_path}/journal/"  # pylint: disable=protected-access
+        main._CACHE_PATH = f"{output_path}/cache/"  # pylint: disable=protected-access
+        main.create_results_folder(main._OUTPUT_PATH)  # pylint: disable=protected-access
+        main.gAdsServiceWrapper = GAdsServiceWrapper(tree.top_id, max_retries=args.max_retries,
+                                                     channels=args.grpc_channels,
+                                                     client=fake_client)
+        main.bqServiceWrapper = BqServiceWrapper(main._DS_ID,  # pylint: disable=protected-access
+                                                 client=FakeBigQueryClient(keep_rows=False))
+        main.mutatePipeline = MutatePipeline(main.send_bulk_mutate_request,
+                                             args.mutate_concurrency)
+        start = time.perf_counter()
+        main.main(args.top_id)
+        elapsed_seconds = time.perf_counter() - start
+        main.mutatePipeline.shutdown()
+        stop_async_logging()  # Writes the queued output before the console file is closed
+        work = count_completed_work(output_path, tree, fake_client,
+                                    main._TOPIC_MATCHER)  # pylint: disable=protected-access
+    snapshot = main.metrics.snapshot()
+    accounts_count = work["accounts"]
+    ads_count = work["ads"]
+    # ru_maxrss is in KB on Linux (bytes on macOS)
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"name": scenario["name"], "accounts": accounts_count, "ads": ads_count,
+            "removed_ads": work["removed_ads"], "failed_accounts": work["failed_accounts"],
+            "account_attempts": snapshot["histograms"].get("account_seconds", {}).get("count", 0),
+            "streamed_rows": snapshot["counters"].get("stream_rows", 0),
+            "seconds": elapsed_seconds, "accounts_per_second": accounts_count / elapsed_seconds,
+            "max_account_seconds": snapshot["histograms"].get("account_seconds", {}).get("max", 0),
+            "ads_per_second": ads_count / elapsed_seconds, "peak_rss_mb": peak_rss_kb / 1024,
+            "requests": fake_client.requests_count}
+
+
+def read_output_rows(output_path, table_id):
+    """Yields the rows of the output files of a table (all their parts and shards)"""
+    for file_path in sorted(Path(output_path).glob(f"{table_id}_*.jsonl*")):
+        open_file = gzip.open if file_path.suffix == ".gz" else open
+        with open_file(file_path, 'rt', encoding='utf-8') as file_object:
+            for line in file_object:
+                yield json.loads(line)
+
+
+def count_completed_work(output_path, tree, fake_client, topic_matcher):
+    """Returns the accounts, ads, removed ads and failed accounts of the output of a session,
+    raising an AssertionError if it does not match the fake tree"""
+    summaries = {}
+    for summary in read_output_rows(output_path, "PerAccountSummary"):
+        if summary["account_id"] in summaries:
+            raise AssertionError(f"Account {summary['account_id']} summarized twice")
+        summaries[summary["account_id"]] = summary
+    account_ids = {client_id for client_id, _, _ in tree.clients_with_levels(tree.top_id)}
+    if set(summaries) != account_ids:
+        raise AssertionError(f"{len(summaries)} accounts summarized, the tree has "
+                             f"{len(account_ids)}")
+    rows_per_status = {}
+    for row in read_output_rows(output_path, "AdsToRemove"):
+        rows_per_status.setdefault(row["bowling_status"], []).append((row["account_id"],
+                                                                      row["ad_id"]))
+    for status, ad_keys in rows_per_status.items():
+        duplicates_count = len(ad_keys) - len(set(ad_keys))
+        if duplicates_count:
+            raise AssertionError(f"{duplicates_count} ads written twice as {status}")
+    failed_ids = {account_id for account_id, summary in summaries.items() if "error" in summary}
+    ads_count = sum(summary["ads_to_remove_count"] for summary in summaries.values())
+    expected_ads_count = sum(sum(topic_matcher.has_included_topic([topic.lower()]) for topic in
+                                 fake_client.get_ad_topics(account_id)) for
+                             account_id in account_ids - failed_ids)
+    if ads_count != expected_ads_count:
+        raise AssertionError(f"{ads_count} ads found, the accounts which did not fail have "
+                             f"{expected_ads_count}")
+    return {"accounts": len(summaries) - len(failed_ids), "ads": ads_count,
+            "removed_ads": len(rows_per_status.get("REMOVED", [])),
+            "failed_accounts": len(failed_ids)}
+
+
+def get_large_account_ids(tree, large_accounts):
+    """The ids of the last {large_accounts} client accounts of the tree"""
+    client_ids = sorted(str(client_id) for client_id, is_manager, _ in
+                        tree.clients_with_levels(tree.top_id) if not is_manager)
+    return set(client_ids[len(client_ids) - large_accounts:]) if large_accounts else set()
+
+
+def run_in_fresh_process(scenario):
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_scenario, scenario).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End to end benchmark on fake backends")
+    parser.add_argument("--managers_per_level", type=int, default=4,
+                        help="Sub managers of every manager of the synthetic tree.")
+    parser.add_argument("--levels", type=int, default=2,
+                        help="Levels of managers of the synthetic tree.")
+    parser.add_argument("--leaves_per_manager", type=int, default=10,
+                        help="Client accounts of every manager of the synthetic tree.")
+    parser.add_argument("--ads_per_account", type=int, default=1000,
+                        help="Disapproved ads of every account.")
+    parser.add_argument("--large_accounts", type=int, default=0,
+                        help="Client accounts (the last ones of the tree) with "
+                             "--large_account_ads disapproved ads instead.")
+    parser.add_argument("--large_account_ads", type=int, default=100000,
+                        help="Disapproved ads of every large account.")
+    parser.add_argument("--batch_rows", type=int, default=10000,
+                        help="Rows per search_stream batch.")
+    parser.add_argument("--latency_ms", type=float, default=20.0,
+                        help="Simulated latency of every Google Ads request.")
+    parser.add_argument("--batch_latency_ms", type=float, default=0.0,
+                        help="Simulated latency of every streamed ads batch (the streaming rate "
+                             "of the API).")
+    parser.add_argument("--transient_error_rate", type=float, default=0.0,
+                        help="Share of the requests failing with UNAVAILABLE.")
+    parser.add_argument("--quota_error_rate", type=float, default=0.0,
+                        help="Share of the requests failing with RESOURCE_EXHAUSTED.")
+    parser.add_argument("--modes", nargs="+", choices=list(_MODES), default=list(_MODES),
+                        help="Scheduling modes to run.")
+    parser.add_argument("--bq_modes", nargs="+", choices=list(_BQ_MODES), default=["none"],
+                        help="BigQuery ingestion modes to run (none = output files only).")
+    parser.add_argument("-rm", "--remove_ads", action="store_true",
+                        help="Remove the disapproved ads too.")
+    parser.add_argument("--flags", type=str, default="",
+                        help="Extra main.py flags for all the scenarios, e.g. \"-stream\".")
+    parser.add_argument("--console_file", type=str, default=os.devnull,
+                        help="Appends the console output of the sessions to this file (default: "
+                             "discarded), e.g. to include its I/O cost.")
+    parser.add_argument("--results_file", type=str,
+                        help="Appends the results as json lines to this file.")
+    parser.add_argument("--label", type=str, default="",
+                        help="Label of the results, e.g. the version or the commit.")
+    args = parser.parse_args()
+
+    tree = wide_tree(args.managers_per_level, args.levels, args.leaves_per_manager)
+    print(f"Tree: {tree.accounts_count()} accounts, {args.ads_per_account} ads per account "
+          f"({args.large_accounts} with {args.large_account_ads}), {args.latency_ms} ms latency")
+    for mode in args.modes:
+        for bq_mode in args.bq_modes:
+            flags = _MODES[mode] + _BQ_MODES[bq_mode] + (["-rm"] if args.remove_ads else []) + \
+                    args.flags.split()
+            scenario = {"name": f"{mode}/bq={bq_mode}", "flags": flags,
+                        "managers_per_level": args.managers_per_level, "levels": args.levels,
+                        "leaves_per_manager": args.leaves_per_manager,
+                        "ads_per_account": args.ads_per_account, "batch_rows": args.batch_rows,
+                        "large_accounts": args.large_accounts,
+                        "large_account_ads": args.large_account_ads,
+                        "latency_seconds": args.latency_ms / 1000.0,
+                        "batch_latency_seconds": args.batch_latency_ms / 1000.0,
+                        "transient_error_rate": args.transient_error_rate,
+                        "quota_error_rate": args.quota_error_rate,
+                        "console_file": args.console_file}
+            result = run_in_fresh_process(scenario)
+            print(f"\t{result['name']:<22} accounts={result['accounts']:<6} "
+                  f"ads={result['ads']:<9} failed={result['failed_accounts']:<4} "
+                  f"seconds={result['seconds']:<8.2f} "
+                  f"accounts/s={result['accounts_per_second']:<8.1f} "
+                  f"ads/s={result['ads_per_second']:<10.0f} "
+                  f"max_account_s={result['max_account_seconds']:<7.2f} "
+                  f"peak_rss_mb={result['peak_rss_mb']:.0f}")
+            if args.results_file:
+                with open(Path(args.results_file), 'a', encoding='utf-8') as results_file:
+                    results_file.write(json.dumps(dict(result, label=args.label,
+                                                       time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                                                       flags=flags)) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rows/sec of the disapproved ad rows to AdsToRemove rows conversion: the per row proto-plus
+functions AdRecordExtractor replaced vs AdRecordExtractor.
+
+Runs on synthetic search_stream responses (of the projection_benchmark), with every ad relevant,
+and checks that both produce the same rows. The console output of the tool is left out of both.
+Needs the google-ads library, but no API access.
+
+Run from the src folder:
+    python3 -m benchmarks.extraction_benchmark --rows 20000
+"""
+import argparse
+import gc
+import re
+import time
+
+from google.ads.googleads.client import GoogleAdsClient
+
+from ad_records import AdRecordExtractor
+from benchmarks.projection_benchmark import build_response
+from gads_connector import get_disapproved_ads_fields
+from topic_matcher import TopicMatcher
+
+_ACCOUNT = {"account_id": "1234567890", "hierarchy": "1000000000_1234567890"}
+
+
+def legacy_get_ad_to_remove(topic_matcher, account, row, ids_only=False):
+    """The per row conversion AdRecordExtractor replaced (without its prints)"""
+    ad_group_ad = row.ad_group_ad
+    campaign_id = row.campaign.id
+    ad = ad_group_ad.ad
+    policy_summary = ad_group_ad.policy_summary
+    current_topics = [entry.topic.lower() for entry in policy_summary.policy_topic_entries]
+    if not topic_matcher.has_included_topic(current_topics):
+        return None
+    match_groups = re.match(r"customers/(\w+)/adGroups/(\w+)", ad_group_ad.ad_group)
+    ad_group_id = match_groups.group(2) if match_groups is not None else ad_group_ad.ad_group
+    ad_json = {"hierarchy": account["hierarchy"], "account_id": account["account_id"],
+               "campaign_id": campaign_id, "ad_group_id": ad_group_id, "ad_id": ad.id,
+               "ad_type": ad.type_.name, "final_urls": ', '.join(ad_group_ad.ad.final_urls)}
+    ad_json["policy_topics"] = str(current_topics)
+    evidence_array = []
+    for entry in policy_summary.policy_topic_entries:
+        evidence_array_per_entry = []
+        for evidence in entry.evidences:
+            for index, text in enumerate(evidence.text_list.texts):
+                evidence_array_per_entry.append(f"\t\tevidence text[{index}]: {text}")
+        evidence_array.append(
+            {"topic": entry.topic, "type": entry.type_.name, "array": evidence_array_per_entry})
+    ad_json["evidences"] = str(evidence_array)
+    if ids_only:
+        mandatory_data = {"type": ad.type_.name.upper()}
+    elif ad.type_.name.upper() == "TEXT_AD":
+        mandatory_data = {"ad.text_ad.headline": ad.text_ad.headline,
+                          "desc1": ad.text_ad.description1, "desc2": ad.text_ad.description2}
+    elif ad.type_.name.upper() == "EXPANDED_TEXT_AD":
+        mandatory_data = {
+            'ad_group_ad.ad.expanded_text_ad.description': ad.expanded_text_ad.description,
+            'ad_group_ad.ad.expanded_text_ad.description2': ad.expanded_text_ad.description2,
+            'ad_group_ad.ad.expanded_text_ad.headline_part1': ad.expanded_text_ad.headline_part1,
+            'ad_group_ad.ad.expanded_text_ad.headline_part2': ad.expanded_text_ad.headline_part2,
+            'ad_group_ad.ad.expanded_text_ad.headline_part3': ad.expanded_text_ad.headline_part3}
+    elif ad.type_.name.upper() == "RESPONSIVE_SEARCH_AD":
+        mandatory_data = {
+            "ad_group_ad.ad.responsive_search_ad.headlines": legacy_extract_text_from_proto(
+                ad.responsive_search_ad.headlines),
+            "ad_group_ad.ad.responsive_search_ad.descriptions": legacy_extract_text_from_proto(
+                ad.responsive_search_ad.descriptions),
+            "ad_group_ad.ad.responsive_search_ad.path1": ad.responsive_search_ad.path1,
+            "ad_group_ad.ad.responsive_search_ad.path2": ad.responsive_search_ad.path2}
+    else:
+        mandatory_data = {"type": ad.type_.name.upper()}
+    ad_json["mandatory_data"] = str(mandatory_data)
+    return ad_json
+
+
+def legacy_extract_text_from_proto(proto_list):
+    values = []
+    for item in proto_list:
+        if item.pinned_field:
+            values.append("%s: %s" % (item.pinned_field, item.text))
+        else:
+            values.append("%s" % item.text)
+    return values
+
+
+def legacy_convert(topic_matcher, batch, ids_only):
+    ads_json = (legacy_get_ad_to_remove(topic_matcher, _ACCOUNT, row, ids_only) for row in
+                batch.results)
+    return [ad_json for ad_json in ads_json if ad_json is not None]
+
+
+def extract(extractor, batch):
+    return [ad_record.to_row() for ad_record in extractor.extract(batch, _ACCOUNT)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ad rows extraction benchmark")
+    parser.add_argument("--rows", type=int, default=20000, help="Rows per response.")
+    parser.add_argument("--repeat", type=int, default=3, help="Measurements per variant.")
+    args = parser.parse_args()
+    client = GoogleAdsClient(None, "benchmark", use_proto_plus=True)
+    # No substrings: every topic is relevant, so every row is converted
+    topic_matcher = TopicMatcher([], [])
+    for name, ids_only in (("all ad types", False), ("ids only", True)):
+        fields = get_disapproved_ads_fields(ids_only=ids_only)
+        batch = build_response(client, fields, args.rows)
+        extractor = AdRecordExtractor(topic_matcher, ids_only)
+        if legacy_convert(topic_matcher, batch, ids_only) != extract(extractor, batch):
+            raise AssertionError(f"{name}: the extracted rows differ from the legacy ones")
+        legacy_seconds = min(_timed(legacy_convert, topic_matcher, batch, ids_only) for _ in
+                             range(args.repeat))
+        extract_seconds = min(_timed(extract, extractor, batch) for _ in range(args.repeat))
+        print(f"{name:<14} legacy={args.rows / legacy_seconds:>9.0f} rows/s "
+              f"extractor={args.rows / extract_seconds:>9.0f} rows/s "
+              f"speedup={legacy_seconds / extract_seconds:>5.1f}x")
+
+
+def _timed(function, *args):
+    """Like timeit, runs with the garbage collector disabled"""
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        function(*args)
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+if __name__ == "__main__":
+    main()
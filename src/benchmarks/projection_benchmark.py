@@ -0,0 +1,182 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Stream bytes and decode cost per row of the disapproved ads query projections.
+
+Builds synthetic search_stream responses holding only the fields each projection selects (as the
+API would; creative fields of another ad type come back empty), checks that their rows hold no
+other field, then measures their serialized size, the time to parse them and the time to read
+the ids and topics of every row of a freshly parsed response. Reading is the same work for every
+projection, so it should cost about the same: the projections differ by their bytes and parse
+time. The projections are measured in turns, after a warm-up turn, and the median of the turns is
+reported. Needs the google-ads library, but no API access.
+
+Run from the src folder:
+    python3 -m benchmarks.projection_benchmark --rows 10000
+"""
+import argparse
+import gc
+import statistics
+import time
+
+from google.ads.googleads.client import GoogleAdsClient
+
+from gads_connector import get_disapproved_ads_fields
+
+_LEGACY_FIELDS = ["customer.id", "ad_group_ad.policy_summary.approval_status"] + \
+                 get_disapproved_ads_fields()
+_AD_TYPES = ["TEXT_AD", "EXPANDED_TEXT_AD", "RESPONSIVE_SEARCH_AD"]
+_CREATIVE_FIELDS = [ad_type.lower() for ad_type in _AD_TYPES]
+
+
+def field_values(client, index):
+    """Returns {field: value} of a synthetic, fully populated disapproved ad row"""
+    ad_text_asset = client.get_type("AdTextAsset")
+    ad_text_asset.text = f"Headline number {index} with a typical length"
+    topic_entry = client.get_type("PolicyTopicEntry")
+    topic_entry.topic = "DESTINATION_NOT_WORKING"
+    evidence = client.get_type("PolicyTopicEvidence")
+    evidence.text_list.texts.append(f"https://www.example.com/landing/{index}")
+    topic_entry.evidences.append(evidence)
+    text = f"Some creative text {index}, long enough to look like a real description"
+    return {"customer.id": 1234567890,
+            "campaign.id": 100000 + index % 50,
+            "ad_group_ad.ad.id": 500000000 + index,
+            "ad_group_ad.ad.type": _AD_TYPES[index % len(_AD_TYPES)],
+            "ad_group_ad.ad_group": f"customers/1234567890/adGroups/{200000 + index % 500}",
+            "ad_group_ad.policy_summary.approval_status": "DISAPPROVED",
+            "ad_group_ad.policy_summary.policy_topic_entries": [topic_entry],
+            "ad_group_ad.ad.final_urls": [f"https://www.example.com/landing/{index}"],
+            "ad_group_ad.ad.text_ad.headline": text[:25],
+            "ad_group_ad.ad.text_ad.description1": text,
+            "ad_group_ad.ad.text_ad.description2": text,
+            "ad_group_ad.ad.expanded_text_ad.description": text,
+            "ad_group_ad.ad.expanded_text_ad.description2": text,
+            "ad_group_ad.ad.expanded_text_ad.headline_part1": text[:30],
+            "ad_group_ad.ad.expanded_text_ad.headline_part2": text[:30],
+            "ad_group_ad.ad.expanded_text_ad.headline_part3": text[:30],
+            "ad_group_ad.ad.responsive_search_ad.headlines": [ad_text_asset] * 10,
+            "ad_group_ad.ad.responsive_search_ad.descriptions": [ad_text_asset] * 4,
+            "ad_group_ad.ad.responsive_search_ad.path1": "path-one",
+            "ad_group_ad.ad.responsive_search_ad.path2": "path-two"}
+
+
+def build_response(client, fields, rows_count):
+    response = client.get_type("SearchGoogleAdsStreamResponse")
+    for index in range(rows_count):
+        row = client.get_type("GoogleAdsRow")
+        values = field_values(client, index)
+        ad_type = values["ad_group_ad.ad.type"]
+        for field in fields:
+            if field.startswith("ad_group_ad.ad.") and field.split(".")[2] in _CREATIVE_FIELDS \
+                    and field.split(".")[2] != ad_type.lower():
+                continue
+            *path, name = field.split(".")
+            message = row
+            for part in path:
+                message = getattr(message, part)
+            setattr(message, name, values[field])
+        response.results.append(row)
+    return response
+
+
+def get_populated_fields(response):
+    """Returns the paths of the fields set in the rows of a response (e.g. campaign.id)"""
+    populated_fields = set()
+    for row in response.results:
+        _add_populated_fields(type(row).pb(row), "", populated_fields)
+    return populated_fields
+
+
+def _add_populated_fields(message, prefix, populated_fields):
+    for field, value in message.ListFields():
+        # The google-ads protos rename the fields named after Python keywords (type_)
+        path = prefix + field.name.rstrip("_")
+        if hasattr(value, "ListFields"):  # A message, not a repeated field
+            _add_populated_fields(value, path + ".", populated_fields)
+        else:
+            populated_fields.add(path)
+
+
+def check_projection(response, fields):
+    """Raises AssertionError if the rows hold a field the projection does not select"""
+    unselected_fields = sorted(
+        path for path in get_populated_fields(response) if
+        not any(path == field or path.startswith(field + ".") for field in fields))
+    if unselected_fields:
+        raise AssertionError(f"Fields not selected by the projection: {unselected_fields}")
+
+
+def parse(response_type, payload):
+    return response_type.deserialize(payload)
+
+
+def read(response):
+    for row in response.results:
+        _ = row.ad_group_ad.ad.id, row.campaign.id, row.ad_group_ad.ad_group
+        _ = [entry.topic for entry in row.ad_group_ad.policy_summary.policy_topic_entries]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Disapproved ads query projection benchmark")
+    parser.add_argument("--rows", type=int, default=10000, help="Rows per response.")
+    parser.add_argument("--repeat", type=int, default=7,
+                        help="Measurements per projection (the median is reported).")
+    args = parser.parse_args()
+    client = GoogleAdsClient(None, "benchmark", use_proto_plus=True)
+    projections = {"legacy": _LEGACY_FIELDS,
+                   "all ad types": get_disapproved_ads_fields(),
+                   "RSA only": get_disapproved_ads_fields(["RESPONSIVE_SEARCH_AD"]),
+                   "ids only": get_disapproved_ads_fields(ids_only=True)}
+    payloads = {}
+    for name, fields in projections.items():
+        response = build_response(client, fields, args.rows)
+        check_projection(response, fields)
+        payloads[name] = type(response), type(response).serialize(response)
+        del response
+    parse_seconds = {name: [] for name in projections}
+    read_seconds = {name: [] for name in projections}
+    # In turns, so that a drift of the machine affects every projection alike, starting with
+    # another projection every turn; the first turn warms up
+    names = list(projections)
+    for turn in range(args.repeat + 1):
+        for name in names[turn % len(names):] + names[:turn % len(names)]:
+            response_type, payload = payloads[name]
+            parse_time, parsed = _timed(parse, response_type, payload)
+            read_time, _ = _timed(read, parsed)
+            if turn > 0:
+                parse_seconds[name].append(parse_time)
+                read_seconds[name].append(read_time)
+            del parsed
+            gc.collect()
+    for name, fields in projections.items():
+        print(f"{name:<14} fields={len(fields):<3} "
+              f"bytes/row={len(payloads[name][1]) / args.rows:>7.1f} "
+              f"parse={statistics.median(parse_seconds[name]) / args.rows * 1e6:>6.2f} us/row "
+              f"read={statistics.median(read_seconds[name]) / args.rows * 1e6:>6.2f} us/row")
+
+
+def _timed(function, *args):
+    """Like timeit, runs with the garbage collector disabled. Returns the seconds and the result"""
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        result = function(*args)
+        return time.perf_counter() - start, result
+    finally:
+        gc.enable()
+
+
+if __name__ == "__main__":
+    main()
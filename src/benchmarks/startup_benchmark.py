@@ -0,0 +1,140 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Startup latency of main.py per mode: the time until a session can start (the imports, the
+configuration, the Google Ads client and the BQ tables check) or, for a BQ maintenance run, until
+the maintenance can start.
+
+Every scenario runs in a fresh process, so the imports are cold. The network requests are
+simulated: GoogleAdsClient.load_from_storage (which refreshes the OAuth token) sleeps
+--oauth_latency_ms and returns a FakeGoogleAdsClient, and the BQ client is a FakeBigQueryClient
+waiting --bq_latency_ms per request. The libraries are still imported by the scenarios which use
+them. The -bq scenarios run twice in the same cache folder: without and then with the schema
+marker.
+
+Every phase is reported: import (main.py), ads_import (the Google Ads library, imported by the
+benchmark to fake the OAuth, by create_services in a real run), services (create_services: the
+Google Ads client and its services, while the BQ bootstrap runs in the background), bq (the BQ
+bootstrap itself, in its thread: the BQ library import, the BQ client and the tables check) and
+bq_wait (the time left waiting for the bootstrap once the services are created).
+ready = import + ads_import + services + bq_wait.
+
+Run from the src folder:
+    python3 -m benchmarks.startup_benchmark --oauth_latency_ms 300 --bq_latency_ms 150
+"""
+import argparse
+import multiprocessing
+import statistics
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+_TOP_ID = "1000000000"
+_MODES = {"audit": [], "audit -bq": ["-bq"], "replay": ["-replay"],
+          "maintenance": ["-bq", "-bq_maintenance", "-clean_bq"]}
+
+
+def run_scenario(scenario):
+    """Starts main.py in this process and returns the time of each startup phase"""
+    start = time.perf_counter()
+    # Imported here, as every scenario runs in a fresh process
+    # pylint: disable=import-outside-toplevel
+    import main
+    import_seconds = time.perf_counter() - start
+    ads_import_seconds = 0.0
+    if "-replay" not in scenario["flags"] and "-bq_maintenance" not in scenario["flags"]:
+        ads_import_start = time.perf_counter()
+        from google.ads.googleads.client import GoogleAdsClient
+        ads_import_seconds = time.perf_counter() - ads_import_start
+        from benchmarks.synthetic import wide_tree
+        from fakes.google_ads import FakeGoogleAdsClient
+
+        def load_from_storage(_=None):
+            time.sleep(scenario["oauth_latency_seconds"])
+            return FakeGoogleAdsClient(wide_tree(1, 1, 1))
+        GoogleAdsClient.load_from_storage = load_from_storage
+    bootstrap_seconds = []
+    bootstrap_bq = main.bootstrap_bq
+
+    def timed_bootstrap_bq(delete_db=False):
+        """Fakes the BQ client from the bootstrap thread, which imports the BQ library like in
+        a real run"""
+        bootstrap_start = time.perf_counter()
+        from google.cloud import bigquery
+        from fakes.bigquery_client import FakeBigQueryClient
+        bigquery.Client = lambda: FakeBigQueryClient(
+            keep_rows=False, latency_seconds=scenario["bq_latency_seconds"])
+        try:
+            bootstrap_bq(delete_db)
+        finally:
+            bootstrap_seconds.append(time.perf_counter() - bootstrap_start)
+    main.bootstrap_bq = timed_bootstrap_bq
+    args = main.parse_args(["-id", _TOP_ID, "-log_level", "WARNING"] + scenario["flags"])
+    main.configure(args)
+    main._CACHE_PATH = scenario["cache_path"]  # pylint: disable=protected-access
+    services_start = time.perf_counter()
+    main.create_services(args, bootstrap_bq_tables=True)
+    services_seconds = time.perf_counter() - services_start
+    wait_start = time.perf_counter()
+    if main._WRITE_TO_BQ:  # pylint: disable=protected-access
+        main.wait_for_bq_bootstrap()
+    bq_wait_seconds = time.perf_counter() - wait_start
+    main.mutatePipeline.shutdown()
+    return {"import_seconds": import_seconds, "ads_import_seconds": ads_import_seconds,
+            "services_seconds": services_seconds, "bq_seconds": sum(bootstrap_seconds),
+            "bq_wait_seconds": bq_wait_seconds,
+            "ready_seconds": import_seconds + ads_import_seconds + services_seconds +
+                             bq_wait_seconds}
+
+
+def run_in_fresh_process(scenario):
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_scenario, scenario).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup latency benchmark")
+    parser.add_argument("--oauth_latency_ms", type=float, default=300.0,
+                        help="Simulated latency of the Google Ads client creation (token "
+                             "refresh).")
+    parser.add_argument("--bq_latency_ms", type=float, default=150.0,
+                        help="Simulated latency of every BQ request.")
+    parser.add_argument("--modes", nargs="+", choices=list(_MODES), default=list(_MODES),
+                        help="Modes to run.")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Runs per scenario (the median of every phase is reported).")
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        flags = _MODES[mode]
+        marker_states = ["no marker", "marker"] if "-bq" in flags else [""]
+        results = {marker_state: [] for marker_state in marker_states}
+        for _ in range(args.repeat):
+            with tempfile.TemporaryDirectory() as cache_path:
+                for marker_state in marker_states:
+                    scenario = {"flags": flags, "cache_path": f"{cache_path}/",
+                                "oauth_latency_seconds": args.oauth_latency_ms / 1000.0,
+                                "bq_latency_seconds": args.bq_latency_ms / 1000.0}
+                    results[marker_state].append(run_in_fresh_process(scenario))
+        for marker_state, runs in results.items():
+            name = f"{mode} ({marker_state})" if marker_state else mode
+            phases = " ".join(
+                f"{phase}={statistics.median(run[f'{phase}_seconds'] for run in runs) * 1000:>5.0f}"
+                f" ms" for phase in ("import", "ads_import", "services", "bq", "bq_wait", "ready"))
+            print(f"{name:<24} {phases}")
+
+
+if __name__ == "__main__":
+    main()
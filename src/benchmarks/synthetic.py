@@ -0,0 +1,139 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Synthetic MCC trees and a fake customer_client backend for offline benchmarks"""
+import threading
+import time
+from collections import deque
+
+_FIRST_ID = 1000000000
+
+
+class SyntheticMccTree:
+    """An MCC tree held as a {manager_id: [child_id, ...]} map"""
+
+    @property
+    def top_id(self):
+        return self._top_id
+
+    @property
+    def children(self):
+        return self._children
+
+    def __init__(self):
+        self._next_id = _FIRST_ID
+        self._children = {}
+        self._top_id = self.add_manager(None)
+
+    def add_manager(self, parent_id):
+        manager_id = self._add(parent_id)
+        self._children[manager_id] = []
+        return manager_id
+
+    def add_leaf(self, parent_id):
+        return self._add(parent_id)
+
+    def is_manager(self, customer_id):
+        return customer_id in self._children
+
+    def accounts_count(self):
+        return self._next_id - _FIRST_ID
+
+    def clients_with_levels(self, customer_id):
+        """Returns (id, is_manager, level) for all the clients under customer_id, like
+        customer_client does (each client once, at its shortest distance)"""
+        levels = {customer_id: 0}
+        queue = deque([customer_id])
+        clients = []
+        while queue:
+            current_id = queue.popleft()
+            clients.append((current_id, self.is_manager(current_id), levels[current_id]))
+            for child_id in self._children.get(current_id, []):
+                if child_id not in levels:
+                    levels[child_id] = levels[current_id] + 1
+                    queue.append(child_id)
+        return clients
+
+    def _add(self, parent_id):
+        customer_id = str(self._next_id)
+        self._next_id += 1
+        if parent_id is not None:
+            self._children[parent_id].append(customer_id)
+        return customer_id
+
+
+def deep_tree(depth, leaves_per_manager):
+    """A chain of {depth} managers, each one with {leaves_per_manager} leaves"""
+    tree = SyntheticMccTree()
+    manager_id = tree.top_id
+    for _ in range(depth):
+        for _ in range(leaves_per_manager):
+            tree.add_leaf(manager_id)
+        manager_id = tree.add_manager(manager_id)
+    return tree
+
+
+def wide_tree(managers_per_level, levels, leaves_per_manager):
+    """{levels} levels of managers, where each manager has {managers_per_level} sub managers and
+    {leaves_per_manager} leaves"""
+    tree = SyntheticMccTree()
+    current_level = [tree.top_id]
+    for _ in range(levels):
+        next_level = []
+        for manager_id in current_level:
+            for _ in range(leaves_per_manager):
+                tree.add_leaf(manager_id)
+            for _ in range(managers_per_level):
+                next_level.append(tree.add_manager(manager_id))
+        current_level = next_level
+    return tree
+
+
+class FakeGAdsTreeService:
+    """Serves customer_client queries of a SyntheticMccTree with a simulated per request
+    latency. Implements the GAdsServiceWrapper methods used by the account discovery"""
+
+    @property
+    def requests_count(self):
+        return self._requests_count
+
+    def __init__(self, tree, latency_seconds=0.0):
+        self._tree = tree
+        self._latency_seconds = latency_seconds
+        self._requests_count = 0
+        self._lock = threading.Lock()
+
+    def get_customer_clients(self, customer_id, level=None):
+        self._on_request()
+        clients = self._tree.clients_with_levels(customer_id)
+        if level is None:
+            return clients
+        return [client for client in clients if client[2] == level]
+
+    def get_sub_accounts(self, is_mcc, customer_id, hierarchy):
+        """The customer_client query of the former recursive discovery: the {id, hierarchy} of
+        all the descendants of customer_id which are managers = {is_mcc}"""
+        self._on_request()
+        accounts = []
+        for client_id, is_manager, _ in self._tree.clients_with_levels(customer_id):
+            if is_manager == is_mcc and not client_id == customer_id:
+                accounts.append({"account_id": client_id,
+                                 "hierarchy": hierarchy + '_' + client_id})
+        return accounts
+
+    def _on_request(self):
+        with self._lock:
+            self._requests_count += 1
+        if self._latency_seconds:
+            time.sleep(self._latency_seconds)
@@ -0,0 +1,94 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-row cost of the topic check: substring loop vs compiled regex vs compiled + memoized.
+
+Run from the src folder:
+    python3 -m benchmarks.topic_matcher_benchmark --rows 200000
+"""
+import argparse
+import random
+import string
+import time
+
+from topic_matcher import TopicMatcher
+
+_POLICY_TOPICS = ["destination_not_working", "destination_mismatch", "healthcare_and_medicines",
+                  "unapproved_pharmaceuticals", "alcohol", "gambling_and_games",
+                  "trademarks_in_ad_text", "capitalization", "punctuation", "font",
+                  "webmaster_guidelines", "misleading_content", "dangerous_products",
+                  "counterfeit_goods", "adult_content", "political_content",
+                  "financial_services", "unreliable_claims", "clickbait", "unavailable_offers"]
+
+
+def legacy_has_included_topic(current_topics, inclusion_topics_substrings,
+                              exclusion_topics_substrings):
+    """The nested substring loop TopicMatcher replaced"""
+    for current_topic in current_topics:
+        if legacy_is_included_topic(current_topic, inclusion_topics_substrings, True) or \
+                legacy_is_included_topic(current_topic, exclusion_topics_substrings, False):
+            return True
+    return False
+
+
+def legacy_is_included_topic(current_topic, topics_substrings, is_inclusion_list):
+    for topic_substring in topics_substrings:
+        if topic_substring in current_topic:
+            return is_inclusion_list
+    return not is_inclusion_list
+
+
+def random_substrings(count, rand):
+    """{count} substrings: the real exclusion list, then random words that never match"""
+    substrings = ["destination", "font", "capitalization", "webmaster"]
+    while len(substrings) < count:
+        substrings.append("".join(rand.choice(string.ascii_lowercase) for _ in range(8)))
+    return substrings[:count]
+
+
+def random_rows(count, rand):
+    return [[rand.choice(_POLICY_TOPICS) for _ in range(rand.randint(1, 3))] for _ in
+            range(count)]
+
+
+def measure(name, check, rows):
+    start = time.perf_counter()
+    verdicts = [check(row) for row in rows]
+    elapsed = time.perf_counter() - start
+    print(f"\t{name:<18} {elapsed / len(rows) * 1e9:>9.0f} ns/row")
+    return verdicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Topic matcher benchmark")
+    parser.add_argument("--rows", type=int, default=200000, help="Rows per measurement.")
+    parser.add_argument("--seed", type=int, default=7, help="Random seed.")
+    args = parser.parse_args()
+    rand = random.Random(args.seed)
+    rows = random_rows(args.rows, rand)
+
+    for substrings_count in (4, 50, 200, 800):
+        exclusion_substrings = random_substrings(substrings_count, rand)
+        print(f"{substrings_count} exclusion substrings:")
+        legacy = measure("substring loop", lambda row: legacy_has_included_topic(
+            row, [], exclusion_substrings), rows)
+        uncached = TopicMatcher([], exclusion_substrings, cache_size=0)
+        compiled = measure("compiled regex", uncached.has_included_topic, rows)
+        memoized = measure("compiled + memo", TopicMatcher([], exclusion_substrings)
+                           .has_included_topic, rows)
+        assert legacy == compiled == memoized
+
+
+if __name__ == "__main__":
+    main()
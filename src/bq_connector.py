@@ -12,21 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from enum import Enum
+import logging
+from datetime import timedelta
 
 from google.api_core.exceptions import NotFound
 from google.cloud import bigquery
 
-from array_utils import split
+logger = logging.getLogger(__name__)
 
-_BQ_CHUNK_SIZE = 1000
 _BQ_QUERY_TIMEOUT = 10.0 * 60.0
-_BQ_MAX_ROW_TO_DELETE = 2000
-
-class BowlingStatus(Enum):
-    SCANNED = 1
-    REMOVED = 2
-    FAILED_TO_REMOVE = 3
+# Rows of the latest status table are re-merged from that long before its newest row, to catch
+# rows streamed late (e.g. by another shard) with an earlier timestamp
+_LATEST_STATUS_OVERLAP = timedelta(hours=6)
 
 
 class BqServiceWrapper:
@@ -35,11 +32,17 @@ class BqServiceWrapper:
     def client(self):
         return self._client
 
-    def __init__(self, ds_id):
-        self._client = bigquery.Client()
+    @property
+    def dataset_full_name(self):
+        return self._ds_full_name
+
+    def __init__(self, ds_id, client=None, check_dataset=True):
+        """Uses a default bigquery.Client unless a client (e.g. a FakeBigQueryClient) is given.
+        Creates the dataset if it does not exist, unless not {check_dataset}"""
+        self._client = client if client is not None else bigquery.Client()
         self._ds_id = ds_id
         self._ds_full_name = f"{self.client.project}.{self._ds_id}"
-        self._ds = self.create_dataset(self._ds_full_name)
+        self._ds = self.create_dataset(self._ds_full_name) if check_dataset else None
 
     def create_dataset(self, dataset_id):
         """Creates dataset"""
@@ -49,19 +52,48 @@ class BqServiceWrapper:
         dataset = bigquery.Dataset(dataset_id)
         dataset.location = "EU"
         dataset = self.client.create_dataset(dataset, timeout=30)  # Make an API request.
-        print("Created dataset {}.{}".format(self.client.project, dataset.dataset_id))
+        logger.info("Created dataset %s.%s", self.client.project, dataset.dataset_id)
         return dataset
 
-    def create_table(self, table_id, schema):
-        """Creates table"""
+    def create_table(self, table_id, schema, partition_field=None, clustering_fields=None):
+        """Creates table, partitioned by day on the partition_field (a TIMESTAMP) and clustered on
+        the clustering_fields"""
         table_full_name = self.get_table_full_name(table_id)
         table = self.get_table(table_full_name)
         if table is not None:
+            self.add_missing_fields(table, schema)
+            self.update_table_layout(table, partition_field, clustering_fields)
             return  # self.client.delete_table(table_full_name, not_found_ok=True)  # Make an API
-            # request.  # print("Deleted table '{}'.".format(table_full_name))
+            # request.  # logger.info("Deleted table '%s'.", table_full_name)
         table = bigquery.Table(table_full_name, schema=schema)
+        if partition_field is not None:
+            table.time_partitioning = bigquery.TimePartitioning(
+                type_=bigquery.TimePartitioningType.DAY, field=partition_field)
+        table.clustering_fields = clustering_fields
         table = self.client.create_table(table)  # Make an API request.
-        print("Created table {}.{}.{}".format(table.project, table.dataset_id, table.table_id))
+        logger.info("Created table %s.%s.%s", table.project, table.dataset_id, table.table_id)
+
+    def add_missing_fields(self, table, schema):
+        """Adds the fields of schema (new fields must be NULLABLE) which an existing table lacks"""
+        table_fields = {field.name.lower() for field in table.schema}
+        missing_fields = [field for field in schema if field.name.lower() not in table_fields]
+        if not missing_fields:
+            return
+        table.schema = list(table.schema) + missing_fields
+        self.client.update_table(table, ["schema"])  # Make an API request.
+        logger.info("Added fields %s to table %s", [field.name for field in missing_fields],
+                    table.table_id)
+
+    def update_table_layout(self, table, partition_field, clustering_fields):
+        """Sets the clustering of an existing table (applies to the rows written from now on).
+        BQ can not partition an existing table: it has to be recreated (see the README)"""
+        if partition_field is not None and table.time_partitioning is None:
+            logger.warning("Table %s is not partitioned: recreate it to partition it by %s",
+                           table.table_id, partition_field)
+        if clustering_fields and table.clustering_fields != clustering_fields:
+            table.clustering_fields = clustering_fields
+            self.client.update_table(table, ["clustering_fields"])  # Make an API request.
+            logger.info("Clustered table %s on %s", table.table_id, clustering_fields)
 
     def delete_table(self, table_id):
         """Deletes dataset"""
@@ -69,16 +101,16 @@ class BqServiceWrapper:
         table = self.get_table(table_full_name)
         if table is not None:
             self.client.delete_table(table_full_name, not_found_ok=True)  # Make an API request.
-            print("Deleted table '{}'.".format(table_full_name))
+            logger.info("Deleted table '%s'.", table_full_name)
 
     def get_dataset(self, dataset_full_name):
         """Returns dataset by name"""
         dataset = None
         try:
             dataset = self.client.get_dataset(dataset_full_name)  # Make an API request.
-            print("Dataset {} already exists".format(dataset_full_name))
+            logger.info("Dataset %s already exists", dataset_full_name)
         except NotFound:
-            print("Dataset {} is not found".format(dataset_full_name))
+            logger.info("Dataset %s is not found", dataset_full_name)
         return dataset
 
     def get_table(self, table_full_name):
@@ -86,39 +118,150 @@ class BqServiceWrapper:
         table = None
         try:
             table = self.client.get_table(table_full_name)  # Make an API request.
-            print("Table {} already exists".format(table_full_name))
+            logger.info("Table %s already exists", table_full_name)
         except NotFound:
-            print("Table {} is not found".format(table_full_name))
+            logger.info("Table %s is not found", table_full_name)
         return table
 
     def get_table_full_name(self, table_id):
         """Returns table full name"""
         return self._ds_full_name + f".{table_id}"
 
-    def upload_rows_to_bq(self, table_id, rows_to_insert):
-        """Inserts rows to BQ"""
-        table_full_name = self.get_table_full_name(table_id)
-        for ads_chunk in split(rows_to_insert, _BQ_CHUNK_SIZE):
-            errors = self.client.insert_rows_json(table_full_name, ads_chunk, row_ids=[None] * len(
-                rows_to_insert))  # Make an API request.
-            if not errors:
-                print("New rows have been added.")
-            else:
-                print("Encountered errors while inserting rows: {}".format(errors))
-
-
-    def remove_outdated_scanned_rows(self, table_id):
-        """Removes rows with outdated status scanned"""
-        affected_rows = 0
-        table_full_name = self.get_table_full_name(table_id)
-        query_text = f""" DELETE TOP {_BQ_MAX_ROW_TO_DELETE} FROM {table_full_name} o
-                            WHERE timestamp < TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 120 
-                            MINUTE) AND timestamp not in ( 
-                                                SELECT MAX(timestamp) 
-                                                FROM  {table_full_name}  i 
-                                                WHERE i.ad_id=o.ad_id 
-                                                GROUP  BY ad_id) """
+    def insert_rows(self, table_id, rows):
+        """Inserts rows in a single request and returns the row errors"""
+        return self.client.insert_rows_json(self.get_table_full_name(table_id), rows,
+                                            row_ids=[None] * len(rows))  # Make an API request.
+
+    def load_rows_from_file(self, table_id, file_object):
+        """Appends the newline delimited json rows of a file to a table with a load job and
+        returns the number of loaded rows"""
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND)
+        load_job = self.client.load_table_from_file(file_object,
+                                                    self.get_table_full_name(table_id),
+                                                    job_config=job_config)  # Make an API request.
+        load_job.result(timeout=_BQ_QUERY_TIMEOUT)  # Wait for load job to finish.
+        logger.info("Loaded %d rows to %s.", load_job.output_rows, table_id)
+        return load_job.output_rows
+
+    def get_max_timestamp(self, table_id):
+        """Returns the newest timestamp of a table, or None if it is empty"""
+        query_text = f"SELECT MAX(timestamp) AS max_timestamp " \
+                     f"FROM `{self.get_table_full_name(table_id)}`"
         query_job = self.client.query(query_text, timeout=_BQ_QUERY_TIMEOUT)
+        rows = list(query_job.result())  # Wait for query job to finish.
+        return rows[0].max_timestamp if rows else None
+
+    def update_latest_status(self, table_id, latest_table_id, key_fields):
+        """Merges the newest row of every key (e.g. of every ad) of table_id into latest_table_id,
+        which has the same schema. Only the partitions written since the previous update are
+        read, and the merge is idempotent. Returns the number of merged rows"""
+        since = self.get_max_timestamp(latest_table_id)
+        if since is not None:
+            since -= _LATEST_STATUS_OVERLAP
+        field_names = [field.name for field in
+                       self.client.get_table(self.get_table_full_name(latest_table_id)).schema]
+        keys = ", ".join(key_fields)
+        # A constant filter on the partitioning column, so that BQ prunes the older partitions
+        since_filter = "TRUE" if since is None else "timestamp >= @since"
+        query_text = f"""MERGE `{self.get_table_full_name(latest_table_id)}` latest
+            USING (SELECT * FROM `{self.get_table_full_name(table_id)}`
+                   WHERE {since_filter}
+                   QUALIFY ROW_NUMBER() OVER (PARTITION BY {keys} ORDER BY timestamp DESC) = 1
+                  ) new
+            ON {" AND ".join(f"latest.{key} = new.{key}" for key in key_fields)}
+            WHEN MATCHED AND new.timestamp > latest.timestamp THEN
+                UPDATE SET {", ".join(f"{name} = new.{name}" for name in field_names)}
+            WHEN NOT MATCHED THEN
+                INSERT ({", ".join(field_names)})
+                VALUES ({", ".join(f"new.{name}" for name in field_names)})"""
+        return self._run_dml(query_text, [] if since is None else [
+            bigquery.ScalarQueryParameter("since", "TIMESTAMP", since)])
+
+    def compact_outdated_rows(self, table_id, latest_table_id, key_fields, status, since, until):
+        """Deletes, in one pass over the partitions of table_id from since to until, the rows
+        with that bowling_status which a newer row of the same key (in latest_table_id)
+        supersedes. Returns the number of deleted rows"""
+        query_text = f"""MERGE `{self.get_table_full_name(table_id)}` history
+            USING `{self.get_table_full_name(latest_table_id)}` latest
+            ON {" AND ".join(f"history.{key} = latest.{key}" for key in key_fields)}
+                AND history.timestamp >= @since AND history.timestamp < @until
+                AND history.timestamp < latest.timestamp
+            WHEN MATCHED AND history.bowling_status = @status THEN DELETE"""
+        return self._run_dml(query_text, [
+            bigquery.ScalarQueryParameter("since", "TIMESTAMP", since),
+            bigquery.ScalarQueryParameter("until", "TIMESTAMP", until),
+            bigquery.ScalarQueryParameter("status", "STRING", status.name)])
+
+    def merge_account_rollup(self, rollup_table_id, all_accounts_table_id, ads_table_id,
+                             summary_table_id, session_id, since):
+        """Rolls the rows of a session up into a row per account (the latest one of every
+        account) of rollup_table_id. Only the partitions since {since} are read"""
+        query_text = f"""MERGE `{self.get_table_full_name(rollup_table_id)}` rollup
+            USING (
+                SELECT accounts.account_id, accounts.top_id, accounts.hierarchy,
+                       @session_id AS session_id, CURRENT_TIMESTAMP() AS timestamp,
+                       IFNULL(ads.ads_to_remove, 0) AS ads_to_remove,
+                       IFNULL(ads.removed_ads, 0) AS removed_ads,
+                       IFNULL(ads.failed_to_remove_ads, 0) AS failed_to_remove_ads,
+                       summaries.error
+                FROM (SELECT account_id, ANY_VALUE(top_id) AS top_id,
+                             ANY_VALUE(hierarchy) AS hierarchy
+                      FROM `{self.get_table_full_name(all_accounts_table_id)}`
+                      WHERE timestamp >= @since AND session_id = @session_id
+                      GROUP BY account_id) accounts
+                JOIN (SELECT account_id,
+                             ARRAY_AGG(error ORDER BY timestamp DESC LIMIT 1)[OFFSET(0)] AS error
+                      FROM `{self.get_table_full_name(summary_table_id)}`
+                      WHERE timestamp >= @since AND session_id = @session_id
+                      GROUP BY account_id) summaries USING (account_id)
+                LEFT JOIN (SELECT account_id, COUNT(*) AS ads_to_remove,
+                                  COUNTIF(bowling_status = 'REMOVED') AS removed_ads,
+                                  COUNTIF(bowling_status = 'FAILED_TO_REMOVE')
+                                      AS failed_to_remove_ads
+                           FROM (SELECT account_id, bowling_status
+                                 FROM `{self.get_table_full_name(ads_table_id)}`
+                                 WHERE timestamp >= @since AND session_id = @session_id
+                                 QUALIFY ROW_NUMBER() OVER (
+                                     PARTITION BY account_id, ad_group_id, ad_id
+                                     ORDER BY timestamp DESC) = 1)
+                           GROUP BY account_id) ads USING (account_id)
+            ) new
+            ON rollup.account_id = new.account_id
+            WHEN MATCHED THEN
+                UPDATE SET top_id = new.top_id, hierarchy = new.hierarchy,
+                           session_id = new.session_id, timestamp = new.timestamp,
+                           ads_to_remove = new.ads_to_remove, removed_ads = new.removed_ads,
+                           failed_to_remove_ads = new.failed_to_remove_ads, error = new.error
+            WHEN NOT MATCHED THEN INSERT ROW"""
+        return self._run_dml(query_text, [
+            bigquery.ScalarQueryParameter("session_id", "STRING", session_id),
+            bigquery.ScalarQueryParameter("since", "TIMESTAMP", since)])
+
+    def insert_mcc_rollup(self, mcc_rollup_table_id, account_rollup_table_id, session_id, since,
+                          shard=None):
+        """Appends a row per top MCC to mcc_rollup_table_id, summing the account rollups of a
+        session"""
+        query_text = f"""INSERT INTO `{self.get_table_full_name(mcc_rollup_table_id)}`
+                (account_id, session_id, shard, timestamp, total_accounts,
+                 accounts_with_ads_to_remove, accounts_with_ads_removed, failed_accounts,
+                 total_ads_to_remove, total_removed_ads)
+            SELECT top_id, @session_id, @shard, CURRENT_TIMESTAMP(), COUNT(*),
+                   COUNTIF(ads_to_remove > 0), COUNTIF(removed_ads > 0),
+                   COUNTIF(error IS NOT NULL), SUM(ads_to_remove), SUM(removed_ads)
+            FROM `{self.get_table_full_name(account_rollup_table_id)}`
+            WHERE timestamp >= @since AND session_id = @session_id
+            GROUP BY top_id"""
+        return self._run_dml(query_text, [
+            bigquery.ScalarQueryParameter("session_id", "STRING", session_id),
+            bigquery.ScalarQueryParameter("since", "TIMESTAMP", since),
+            bigquery.ScalarQueryParameter("shard", "STRING", shard)])
+
+    def _run_dml(self, query_text, query_parameters):
+        job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+        query_job = self.client.query(query_text, job_config=job_config,
+                                      timeout=_BQ_QUERY_TIMEOUT)
         query_job.result()  # Wait for query job to finish.
-        print(f"DML query modified {query_job.num_dml_affected_rows} rows.")
+        logger.info("DML query modified %s rows.", query_job.num_dml_affected_rows)
         return query_job.num_dml_affected_rows
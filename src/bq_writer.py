@@ -0,0 +1,183 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""BigQuery writers, one per table, shared by all the worker threads.
+
+- BqBackgroundWriter: streaming inserts. Worker threads hand their rows over and move on, one
+  writer thread per table batches the rows of all the accounts and inserts them.
+- BqLoadJobWriter: rows are staged as a newline delimited json file and appended to the table
+  with a load job at the end of the session (or whenever the file grows too big). Cheaper and
+  faster than streaming for large volumes, but rows only land in BQ when loaded.
+"""
+import datetime
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+
+from instrumentation import get_metrics
+
+logger = logging.getLogger(__name__)
+
+_MAX_BATCH_ROWS = 1000
+_MAX_DELAY_SECONDS = 5.0
+_MAX_RETRIES = 3
+_RETRY_BACKOFF_SECONDS = 2.0
+# Row errors worth retrying. "stopped" rows were valid but not inserted because another row of
+# the same request was invalid.
+_RETRYABLE_REASONS = {"stopped", "timeout", "backendError", "internalError", "rateLimitExceeded"}
+_CLOSE = object()
+_MAX_STAGING_FILE_BYTES = 512 * 1024 * 1024
+
+
+class BqBackgroundWriter:
+    """Collects rows for one table from any thread and inserts them in batches of up to
+    {max_batch_rows}, or whatever was collected after {max_delay_seconds}"""
+
+    @property
+    def pending_rows(self):
+        return self._queue.qsize()
+
+    def __init__(self, bq_service_wrapper, table_id, max_batch_rows=_MAX_BATCH_ROWS,
+                 max_delay_seconds=_MAX_DELAY_SECONDS, max_retries=_MAX_RETRIES):
+        self._bq_service_wrapper = bq_service_wrapper
+        self._table_id = table_id
+        self._max_batch_rows = max_batch_rows
+        self._max_delay_seconds = max_delay_seconds
+        self._max_retries = max_retries
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"bq-writer-{table_id}",
+                                        daemon=True)
+        self._thread.start()
+
+    def add_rows(self, rows):
+        """Queues rows for insertion. Rows are copied, so callers may keep updating them"""
+        for row in rows:
+            self._queue.put(dict(row))
+
+    def close(self):
+        """Inserts all the queued rows and stops the writer thread"""
+        self._queue.put(_CLOSE)
+        self._thread.join()
+
+    def _run(self):
+        closed = False
+        while not closed:
+            batch = []
+            deadline = None
+            while len(batch) < self._max_batch_rows:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    row = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if row is _CLOSE:
+                    closed = True
+                    break
+                batch.append(row)
+                if deadline is None:
+                    deadline = time.monotonic() + self._max_delay_seconds
+            if batch:
+                self._insert(batch)
+
+    def _insert(self, rows):
+        for attempt in range(self._max_retries + 1):
+            if attempt > 0:
+                time.sleep(_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+            try:
+                with get_metrics().time("bq_insert"):
+                    errors = self._bq_service_wrapper.insert_rows(self._table_id, rows)
+            except Exception as exception:  # pylint: disable=broad-except
+                logger.warning("Failed inserting %d rows to %s: %s", len(rows), self._table_id,
+                               exception)
+                continue
+            if not errors:
+                logger.info("%d new rows have been added to %s.", len(rows), self._table_id)
+                return
+            retryable_rows = []
+            for error in errors:
+                reasons = {row_error.get("reason") for row_error in error.get("errors", [])}
+                if reasons and reasons <= _RETRYABLE_REASONS:
+                    retryable_rows.append(rows[error["index"]])
+                else:
+                    logger.warning("Encountered errors while inserting rows to %s: %s",
+                                   self._table_id, error)
+            rows = retryable_rows
+            if not rows:
+                return
+        logger.error("Gave up inserting %d rows to %s", len(rows), self._table_id)
+
+
+class BqLoadJobWriter:
+    """Stages rows for one table in a local newline delimited json file and loads it with a
+    single load job when closed, or when it exceeds {max_file_bytes}"""
+
+    @property
+    def pending_rows(self):
+        return self._staged_rows
+
+    def __init__(self, bq_service_wrapper, table_id, staging_path=None,
+                 max_file_bytes=_MAX_STAGING_FILE_BYTES):
+        self._bq_service_wrapper = bq_service_wrapper
+        self._table_id = table_id
+        self._staging_path = staging_path
+        self._max_file_bytes = max_file_bytes
+        self._lock = threading.Lock()
+        self._file = None
+        self._staged_rows = 0
+
+    def add_rows(self, rows):
+        """Stages rows. "AUTO" timestamps are resolved now, as load jobs do not support them"""
+        timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        lines = []
+        for row in rows:
+            if row.get("timestamp") == "AUTO":
+                row = dict(row, timestamp=timestamp)
+            lines.append(json.dumps(row) + "\n")
+        full_file = None
+        with self._lock:
+            if self._file is None:
+                self._file = tempfile.NamedTemporaryFile(
+                    'w+', encoding='utf-8', dir=self._staging_path, prefix=f"{self._table_id}_",
+                    suffix=".json", delete=False)
+            self._file.writelines(lines)
+            self._staged_rows += len(lines)
+            if self._file.tell() >= self._max_file_bytes:
+                full_file, self._file, self._staged_rows = self._file, None, 0
+        if full_file is not None:
+            self._load(full_file)
+
+    def close(self):
+        """Loads all the staged rows"""
+        with self._lock:
+            staged_file, self._file, self._staged_rows = self._file, None, 0
+        if staged_file is not None:
+            self._load(staged_file)
+
+    def _load(self, staged_file):
+        staged_file.flush()
+        try:
+            with open(staged_file.name, 'rb') as file_object, get_metrics().time("bq_load"):
+                self._bq_service_wrapper.load_rows_from_file(self._table_id, file_object)
+        except Exception as exception:  # pylint: disable=broad-except
+            # Keep the file, so it can be loaded manually.
+            logger.error("Failed loading %s to %s: %s", staged_file.name, self._table_id,
+                         exception)
+            staged_file.close()
+            return
+        staged_file.close()
+        os.remove(staged_file.name)
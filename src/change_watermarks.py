@@ -0,0 +1,112 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-account change watermarks of incremental audits, one file per top MCC id.
+
+The watermark of an account is the start of the last session that audited it. An incremental
+session only scans the ad groups whose ads changed (change_status) since then, minus a lookback
+covering ads changed before the watermark but reviewed (disapproved) after it. An account is
+fully scanned when it has no watermark or when its watermark is older than the change history
+the API keeps. Every account is fully scanned once every {full_sweep_seconds}, as a safety net
+for disapprovals which do not follow a change of the ad (e.g. policy updates).
+"""
+import datetime
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+_LOOKBACK_SECONDS = 24 * 60 * 60
+_FULL_SWEEP_SECONDS = 24 * 60 * 60
+# change_status only returns the changes of the last 90 days
+_MAX_HISTORY_SECONDS = 89 * 24 * 60 * 60
+# change_status times are in the time zone of the account, which is not known here
+_TIME_ZONE_SLACK_SECONDS = 14 * 60 * 60
+
+
+class ChangeWatermarks:
+    """Loads, updates (from any thread) and stores the watermarks of a top MCC"""
+
+    @property
+    def is_full_sweep(self):
+        return self._is_full_sweep
+
+    def __init__(self, cache_path, top_id, full_sweep_seconds=_FULL_SWEEP_SECONDS,
+                 lookback_seconds=_LOOKBACK_SECONDS, force_full_sweep=False, shard_suffix=""):
+        """The watermarks of a shard of the accounts (see account_sharding) are kept in their own
+        file, with {shard_suffix}"""
+        self._cache_path = cache_path
+        self._top_id = top_id
+        self._shard_suffix = shard_suffix
+        self._lookback_seconds = lookback_seconds
+        self._lock = threading.Lock()
+        self._session_start = time.time()
+        watermarks_json = self.load()
+        self._watermarks = watermarks_json.get("accounts", {})
+        self._last_full_sweep = watermarks_json.get("last_full_sweep", 0)
+        self._is_full_sweep = force_full_sweep or \
+            self._session_start - self._last_full_sweep >= full_sweep_seconds
+
+    def get_change_window(self, account_id):
+        """Returns the (since, until) UTC datetimes of the changes to scan in an account, or None
+        if the account must be fully scanned"""
+        if self._is_full_sweep:
+            return None
+        with self._lock:
+            watermark = self._watermarks.get(account_id)
+        if watermark is None:
+            return None
+        since = watermark - self._lookback_seconds - _TIME_ZONE_SLACK_SECONDS
+        if self._session_start - since > _MAX_HISTORY_SECONDS:
+            return None
+        until = self._session_start + _TIME_ZONE_SLACK_SECONDS
+        return _to_datetime(since), _to_datetime(until)
+
+    def mark_audited(self, account_id):
+        """Moves the watermark of an account to the start of this session"""
+        with self._lock:
+            self._watermarks[account_id] = self._session_start
+
+    def load(self):
+        """Returns the stored watermarks json, empty if there is none"""
+        try:
+            with open(self.get_watermarks_file(), encoding='utf-8') as file_object:
+                return json.load(file_object)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, session_completed=False):
+        """Stores the watermarks. A full sweep only counts once all its accounts were audited
+        ({session_completed})"""
+        if self._is_full_sweep and session_completed:
+            self._last_full_sweep = self._session_start
+        Path(self._cache_path).mkdir(parents=True, exist_ok=True)
+        watermarks_file = self.get_watermarks_file()
+        temp_file = watermarks_file.with_suffix(".tmp")
+        with self._lock:
+            watermarks_json = {"last_full_sweep": self._last_full_sweep,
+                               "accounts": dict(self._watermarks)}
+        with open(temp_file, 'w', encoding='utf-8') as file_object:
+            json.dump(watermarks_json, file_object)
+        os.replace(temp_file, watermarks_file)
+
+    def get_watermarks_file(self):
+        """Returns the watermarks file of the top MCC (or of its shard)"""
+        return Path(self._cache_path) / \
+            f"change_watermarks_{self._top_id}{self._shard_suffix}.json"
+
+
+def _to_datetime(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
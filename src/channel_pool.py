@@ -0,0 +1,163 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A pool of Google Ads API channels, shared by the worker threads of a GAdsServiceWrapper.
+
+Every client.get_service call opens its own gRPC channel, with its own HTTP/2 connection, so a
+single GoogleAdsService / AdGroupAdService pair multiplexes all the concurrent search_stream and
+mutate requests of the workers on one connection each. The pool holds {size} pairs of services.
+Every request leases the least loaded pair (fewest requests in flight, round-robin among equals)
+for its whole duration: a search_stream keeps its pair until the stream is read or closed.
+
+A pair left idle for {health_check_seconds} is health-checked when it is leased again: if one of
+its channels is in TRANSIENT_FAILURE or SHUTDOWN (or does not report its state), the pair is
+replaced by a new one (and closed once its last request is done), instead of failing the next
+request.
+"""
+import contextlib
+import logging
+import queue
+import threading
+import time
+
+from instrumentation import get_metrics
+
+logger = logging.getLogger(__name__)
+
+_HEALTH_CHECK_SECONDS = 60.0
+_HEALTH_CHECK_TIMEOUT_SECONDS = 1.0
+# UNKNOWN: the channel did not report its state in time
+_UNHEALTHY_STATES = {"TRANSIENT_FAILURE", "SHUTDOWN", "UNKNOWN"}
+
+
+class ServiceChannels:
+    """The GoogleAdsService and AdGroupAdService of a pool entry, each on its own channel"""
+
+    @property
+    def ga_service(self):
+        return self._ga_service
+
+    @property
+    def ad_group_ad_service(self):
+        return self._ad_group_ad_service
+
+    def __init__(self, client):
+        self._ga_service = client.get_service("GoogleAdsService")
+        self._ad_group_ad_service = client.get_service("AdGroupAdService")
+        # Guarded by the lock of the pool
+        self.in_flight = 0
+        self.last_used = time.monotonic()
+        self.retired = False
+
+    def is_healthy(self, timeout_seconds=_HEALTH_CHECK_TIMEOUT_SECONDS):
+        """Checks that all the channels report a state other than TRANSIENT_FAILURE or SHUTDOWN
+        within {timeout_seconds} (services without a gRPC channel, e.g. fakes, are healthy)"""
+        return all(_get_connectivity_name(service, timeout_seconds) not in _UNHEALTHY_STATES for
+                   service in (self._ga_service, self._ad_group_ad_service))
+
+    def close(self):
+        """Closes the channels"""
+        for service in (self._ga_service, self._ad_group_ad_service):
+            transport = getattr(service, "transport", None)
+            if transport is not None and hasattr(transport, "close"):
+                transport.close()
+
+
+class ChannelPool:
+    """Leases the ServiceChannels of a pool to the requests. Thread-safe"""
+
+    @property
+    def size(self):
+        return len(self._entries)
+
+    @property
+    def default_channels(self):
+        """The first entry of the pool, e.g. for the callers of the wrapper's services"""
+        return self._entries[0]
+
+    def __init__(self, client, size=1, health_check_seconds=_HEALTH_CHECK_SECONDS):
+        if size < 1:
+            raise ValueError("A channel pool needs at least one entry")
+        self._client = client
+        self._health_check_seconds = health_check_seconds
+        self._entries = [ServiceChannels(client) for _ in range(size)]
+        self._next_index = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def lease(self):
+        """Yields the least loaded ServiceChannels, for the duration of a request"""
+        channels = self._acquire()
+        try:
+            yield channels
+        finally:
+            self._release(channels)
+
+    def get_in_flight(self):
+        """Returns the number of requests in flight per entry"""
+        with self._lock:
+            return [channels.in_flight for channels in self._entries]
+
+    def _acquire(self):
+        size = len(self._entries)
+        with self._lock:
+            index = min(range(size), key=lambda entry_index: (
+                self._entries[entry_index].in_flight, (entry_index - self._next_index) % size))
+            self._next_index = (index + 1) % size
+            channels = self._entries[index]
+            idle_seconds = time.monotonic() - channels.last_used
+            check_health = channels.in_flight == 0 and idle_seconds >= self._health_check_seconds
+            channels.in_flight += 1
+        # Only the request which found the entry idle checks it, the others see it in flight
+        if check_health and not channels.is_healthy():
+            channels = self._replace(index, channels)
+        return channels
+
+    def _replace(self, index, channels):
+        """Replaces the leased (unhealthy) entry at index by a new one, and leases the new one"""
+        logger.warning("Recycling unhealthy API channel %d of %d", index + 1, len(self._entries))
+        get_metrics().increment("api_channels_recycled")
+        new_channels = ServiceChannels(self._client)
+        with self._lock:
+            self._entries[index] = new_channels
+            new_channels.in_flight += 1
+            channels.retired = True
+        self._release(channels)
+        return new_channels
+
+    def _release(self, channels):
+        with self._lock:
+            channels.in_flight -= 1
+            channels.last_used = time.monotonic()
+            close = channels.retired and channels.in_flight == 0
+        if close:
+            channels.close()
+
+
+def _get_connectivity_name(service, timeout_seconds):
+    """Returns the name of the connectivity state of the gRPC channel of a service, UNKNOWN if
+    it is not reported in time, or None if the service has no gRPC channel"""
+    channel = getattr(getattr(service, "transport", None), "grpc_channel", None)
+    if channel is None:
+        return None
+    states = queue.SimpleQueue()
+    on_state = states.put
+    # Called back at once with the current state, by a gRPC thread
+    channel.subscribe(on_state, try_to_connect=False)
+    try:
+        return states.get(timeout=timeout_seconds).name
+    except queue.Empty:
+        return "UNKNOWN"
+    finally:
+        channel.unsubscribe(on_state)
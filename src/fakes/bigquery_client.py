@@ -0,0 +1,187 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An in-memory bigquery.Client replacement, covering what BqServiceWrapper uses.
+
+Usage: BqServiceWrapper(ds_id, client=FakeBigQueryClient()). Rows are validated against the
+table schema (unknown fields and missing REQUIRED fields are rejected, like BQ does) and can be
+read back with rows(table_full_name), or only counted (keep_rows=False, e.g. in benchmarks) with
+rows_count(table_full_name). Every request may wait a simulated latency (latency_seconds).
+"""
+import json
+import threading
+import time
+
+from google.api_core.exceptions import NotFound
+
+_FAKE_PROJECT = "fake-project"
+
+
+class FakeLoadJob:
+    """The part of bigquery.LoadJob / QueryJob that BqServiceWrapper reads"""
+
+    def __init__(self, output_rows=0, errors=None, num_dml_affected_rows=0):
+        self.output_rows = output_rows
+        self.errors = errors
+        self.num_dml_affected_rows = num_dml_affected_rows
+
+    def __iter__(self):
+        """Queries return no rows"""
+        return iter([])
+
+    def result(self, timeout=None):
+        if self.errors:
+            raise ValueError(f"Load job failed: {self.errors}")
+        return self
+
+
+class FakeBigQueryClient:
+    """Datasets and tables live in memory; requests are counted per method"""
+
+    @property
+    def project(self):
+        return self._project
+
+    @property
+    def requests_count(self):
+        return dict(self._requests_count)
+
+    def __init__(self, project=_FAKE_PROJECT, keep_rows=True, latency_seconds=0.0):
+        self._project = project
+        self._keep_rows = keep_rows
+        self._latency_seconds = latency_seconds
+        self._datasets = set()
+        self._tables = {}
+        self._rows = {}
+        self._rows_counts = {}
+        self._requests_count = {}
+        self._lock = threading.Lock()
+
+    def rows(self, table_full_name):
+        """Returns the rows of a table"""
+        with self._lock:
+            return list(self._rows[table_full_name])
+
+    def rows_count(self, table_full_name):
+        """Returns the number of rows written to a table"""
+        with self._lock:
+            return self._rows_counts[table_full_name]
+
+    def get_dataset(self, dataset_full_name):
+        self._count("get_dataset")
+        if dataset_full_name not in self._datasets:
+            raise NotFound(f"Dataset {dataset_full_name}")
+        return dataset_full_name
+
+    def create_dataset(self, dataset, timeout=None):
+        self._count("create_dataset")
+        self._datasets.add(f"{dataset.project}.{dataset.dataset_id}")
+        return dataset
+
+    def get_table(self, table_full_name):
+        self._count("get_table")
+        with self._lock:
+            if table_full_name not in self._tables:
+                raise NotFound(f"Table {table_full_name}")
+            return self._tables[table_full_name]
+
+    def create_table(self, table):
+        self._count("create_table")
+        with self._lock:
+            table_full_name = f"{table.project}.{table.dataset_id}.{table.table_id}"
+            self._tables[table_full_name] = table
+            self._rows[table_full_name] = []
+            self._rows_counts[table_full_name] = 0
+        return table
+
+    def update_table(self, table, fields):
+        self._count("update_table")
+        with self._lock:
+            table_full_name = f"{table.project}.{table.dataset_id}.{table.table_id}"
+            if table_full_name not in self._tables:
+                raise NotFound(f"Table {table_full_name}")
+            self._tables[table_full_name] = table
+        return table
+
+    def delete_table(self, table_full_name, not_found_ok=False):
+        self._count("delete_table")
+        with self._lock:
+            if table_full_name not in self._tables and not not_found_ok:
+                raise NotFound(f"Table {table_full_name}")
+            self._tables.pop(table_full_name, None)
+            self._rows.pop(table_full_name, None)
+            self._rows_counts.pop(table_full_name, None)
+
+    def insert_rows_json(self, table_full_name, json_rows, row_ids=None):
+        """Inserts all the rows, or none if one of them is invalid (like BQ does)"""
+        self._count("insert_rows_json")
+        if row_ids is not None and len(row_ids) != len(json_rows):
+            raise ValueError("row_ids and json_rows must have the same length")
+        with self._lock:
+            schema = self._get_schema(table_full_name)
+            errors = [(index, self._validate(schema, row)) for index, row in
+                      enumerate(json_rows)]
+            if any(row_errors for _, row_errors in errors):
+                return [{"index": index,
+                         "errors": row_errors or [{"reason": "stopped", "message": ""}]} for
+                        index, row_errors in errors]
+            self._add_rows(table_full_name, [json.loads(json.dumps(row)) for row in json_rows])
+        return []
+
+    def load_table_from_file(self, file_object, table_full_name, job_config=None):
+        """Loads newline delimited json; like BQ, a single invalid row fails the whole job"""
+        self._count("load_table_from_file")
+        rows = [json.loads(line) for line in file_object.read().decode('utf-8').splitlines() if
+                line.strip()]
+        with self._lock:
+            schema = self._get_schema(table_full_name)
+            errors = [error for row in rows for error in self._validate(schema, row)]
+            if errors:
+                return FakeLoadJob(errors=errors)
+            self._add_rows(table_full_name, rows)
+        return FakeLoadJob(output_rows=len(rows))
+
+    def query(self, query_text, job_config=None, timeout=None):
+        self._count("query")
+        return FakeLoadJob()
+
+    def _add_rows(self, table_full_name, rows):
+        if self._keep_rows:
+            self._rows[table_full_name].extend(rows)
+        self._rows_counts[table_full_name] += len(rows)
+
+    def _get_schema(self, table_full_name):
+        if table_full_name not in self._tables:
+            raise NotFound(f"Table {table_full_name}")
+        return {field.name.lower(): field for field in self._tables[table_full_name].schema}
+
+    @staticmethod
+    def _validate(schema, row):
+        errors = []
+        for name in row:
+            if name.lower() not in schema:
+                errors.append({"reason": "invalid", "message": f"no such field: {name}"})
+        for name, field in schema.items():
+            if field.mode == "REQUIRED" and row.get(field.name) is None:
+                errors.append({"reason": "invalid", "message": f"missing required field: {name}"})
+            elif isinstance(row.get(field.name), (list, dict)) and field.mode != "REPEATED":
+                errors.append({"reason": "invalid", "message": f"not a scalar: {name}"})
+        return errors
+
+    def _count(self, method):
+        """Counts a request and waits the simulated latency"""
+        with self._lock:
+            self._requests_count[method] = self._requests_count.get(method, 0) + 1
+        if self._latency_seconds:
+            time.sleep(self._latency_seconds)
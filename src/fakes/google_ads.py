@@ -0,0 +1,339 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A GoogleAdsClient replacement serving a synthetic MCC tree and synthetic disapproved ads.
+
+Usage: GAdsServiceWrapper(top_id, client=FakeGoogleAdsClient(tree)), where tree has
+clients_with_levels(customer_id) like a benchmarks.synthetic.SyntheticMccTree. Only the services
+are faked, so the queries, retries, rate limits and instrumentation of GAdsServiceWrapper all run.
+Responses are google-ads messages holding only the selected fields, parsed from their serialized
+form like the API responses, so their decoding cost is realistic. Every request waits a simulated
+latency and may fail with a transient (UNAVAILABLE) or quota (RESOURCE_EXHAUSTED) error at the
+given rates, and every streamed ads batch waits a simulated batch latency (the streaming rate of
+the API). Removed ads are no longer served, like by the API, and the removal of the given
+failing ads is reported as a partial failure.
+"""
+import math
+import random
+import re
+import threading
+import time
+
+import grpc
+from google.ads.googleads.client import GoogleAdsClient
+from google.ads.googleads.errors import GoogleAdsException
+
+_DEVELOPER_TOKEN = "fake-developer-token"
+_BATCH_ROWS = 10000
+# (topic, weight): with the default topics file, destination topics are not removed
+_TOPICS = (("DESTINATION_NOT_WORKING", 0.4), ("HEALTHCARE_NOT_ALLOWED", 0.2),
+           ("TRADEMARKS_IN_AD_TEXT", 0.2), ("MISLEADING_CONTENT", 0.2))
+_AD_TYPES = ("RESPONSIVE_SEARCH_AD", "EXPANDED_TEXT_AD", "TEXT_AD")
+# The ads of an account are spread over that many campaigns
+_CAMPAIGNS = 50
+_FIRST_CAMPAIGN_ID = 100000
+_FIRST_AD_ID = 500000000
+_AD_GROUP_AD_RESOURCE_NAME = re.compile(r"customers/(\d+)/adGroupAds/\d+~(\d+)")
+
+
+class FakeGoogleAdsClient:
+    """Serves customer_client, change_status (no changes), campaign and ad_group_ad queries
+    (streamed, or counted by search), and removal mutates (which all succeed unless a request
+    fails, or the ad is one of the failing_removals). Types and enums are those of a real
+    GoogleAdsClient"""
+
+    @property
+    def developer_token(self):
+        return self._client.developer_token
+
+    @property
+    def enums(self):
+        return self._client.enums
+
+    @property
+    def requests_count(self):
+        return dict(self._requests_count)
+
+    def __init__(self, tree, ads_per_account=100, topics=_TOPICS, latency_seconds=0.0,
+                 transient_error_rate=0.0, quota_error_rate=0.0, batch_rows=_BATCH_ROWS, seed=0,
+                 batch_latency_seconds=0.0, failing_removals=()):
+        """{ads_per_account} is a number, or a function of the account id returning it.
+        {failing_removals} are the ids of the ads whose removal fails"""
+        self._client = GoogleAdsClient(None, _DEVELOPER_TOKEN, use_proto_plus=True)
+        self._services = {"GoogleAdsService": _FakeGoogleAdsService(self, tree, ads_per_account,
+                                                                    topics, batch_rows,
+                                                                    batch_latency_seconds),
+                          "AdGroupAdService": _FakeAdGroupAdService(self, failing_removals)}
+        self._latency_seconds = latency_seconds
+        self._transient_error_rate = transient_error_rate
+        self._quota_error_rate = quota_error_rate
+        self._random = random.Random(seed)
+        self._requests_count = {}
+        self._removed_ads = {}
+        self._lock = threading.Lock()
+
+    def get_type(self, name):
+        return self._client.get_type(name)
+
+    def get_service(self, name):
+        return self._services[name]
+
+    def remove_ad(self, customer_id, ad_id):
+        with self._lock:
+            self._removed_ads.setdefault(str(customer_id), set()).add(int(ad_id))
+
+    def get_removed_ads(self, customer_id):
+        """The ids of the removed ads of an account"""
+        with self._lock:
+            return set(self._removed_ads.get(str(customer_id), ()))
+
+    def get_ad_topics(self, customer_id):
+        """The policy topic of every ad the account had before any removal"""
+        return self._services["GoogleAdsService"].get_ad_topics(customer_id)
+
+    def on_request(self, method):
+        """Counts a request, waits the simulated latency and possibly fails"""
+        with self._lock:
+            self._requests_count[method] = self._requests_count.get(method, 0) + 1
+            draw = self._random.random()
+        if self._latency_seconds:
+            time.sleep(self._latency_seconds)
+        if draw < self._transient_error_rate:
+            raise self.build_exception(grpc.StatusCode.UNAVAILABLE, "Fake transient error")
+        if draw < self._transient_error_rate + self._quota_error_rate:
+            raise self.build_exception(grpc.StatusCode.RESOURCE_EXHAUSTED, "Fake quota error")
+
+    def build_exception(self, status_code, message):
+        """Returns a GoogleAdsException with the status code, like the API raises"""
+        failure = self.get_type("GoogleAdsFailure")
+        error = self.get_type("GoogleAdsError")
+        error.message = message
+        failure.errors.append(error)
+        return GoogleAdsException(_FakeCall(status_code), _FakeCall(status_code), failure,
+                                  "fake-request-id")
+
+
+class _FakeCall:
+    """The part of a grpc.Call that GoogleAdsException exposes"""
+
+    def __init__(self, status_code):
+        self._status_code = status_code
+
+    def code(self):
+        return self._status_code
+
+
+class _FakeGoogleAdsService:
+    """search_stream and search (only its total_results_count) of the GoogleAdsService"""
+
+    def __init__(self, client, tree, ads_per_account, topics, batch_rows, batch_latency_seconds):
+        self._client = client
+        self._tree = tree
+        self._ads_per_account = ads_per_account
+        self._topics = [topic for topic, _ in topics]
+        self._topic_weights = [weight for _, weight in topics]
+        self._batch_rows = batch_rows
+        self._batch_latency_seconds = batch_latency_seconds
+        self._response_type = type(self._client.get_type("SearchGoogleAdsStreamResponse"))
+        # Serialized ad batches by (selected fields, campaign range, batch index, rows count). The
+        # ads of all the accounts are the same, as the tool takes the account id from the
+        # account, not the ad
+        self._payloads = {}
+        self._payloads_lock = threading.Lock()
+
+    def search_stream(self, request):
+        resource = re.search(r"FROM\s+(\w+)", request.query).group(1)
+        self._client.on_request(f"search_stream:{resource}")
+        if resource == "customer_client":
+            return iter([self._get_customer_clients(request)])
+        if resource == "campaign":
+            return iter([self._get_campaigns(request)])
+        if resource == "ad_group_ad":
+            return self._get_ads(request)
+        return iter([])  # change_status: nothing changed
+
+    def search(self, request):
+        resource = re.search(r"FROM\s+(\w+)", request.query).group(1)
+        self._client.on_request(f"search:{resource}")
+        response = self._client.get_type("SearchGoogleAdsResponse")
+        if resource == "ad_group_ad" and request.search_settings.return_total_results_count:
+            response.total_results_count = len(self._get_ad_indexes(request))
+        return response
+
+    def get_ad_topics(self, customer_id):
+        return [self._get_topic(index) for index in range(self._get_ads_count(customer_id))]
+
+    def _get_topic(self, index):
+        return random.Random(index).choices(self._topics, self._topic_weights)[0]
+
+    def _get_campaigns(self, request):
+        response = self._client.get_type("SearchGoogleAdsStreamResponse")
+        for index in range(min(_CAMPAIGNS, self._get_ads_count(request.customer_id))):
+            row = self._client.get_type("GoogleAdsRow")
+            row.campaign.id = _FIRST_CAMPAIGN_ID + index
+            response.results.append(row)
+        return response
+
+    def _get_customer_clients(self, request):
+        level_match = re.search(r"customer_client\.level\s*=\s*(\d+)", request.query)
+        response = self._client.get_type("SearchGoogleAdsStreamResponse")
+        for client_id, is_manager, level in self._tree.clients_with_levels(request.customer_id):
+            if level_match is not None and level != int(level_match.group(1)):
+                continue
+            row = self._client.get_type("GoogleAdsRow")
+            row.customer_client.id = int(client_id)
+            row.customer_client.manager = is_manager
+            row.customer_client.level = level
+            response.results.append(row)
+        return response
+
+    def _get_ads(self, request):
+        fields = tuple(field.strip() for field in re.search(
+            r"SELECT(.*?)FROM", request.query, re.S).group(1).split(","))
+        campaign_range = _get_campaign_range(request.query)
+        indexes = self._get_ad_indexes(request)
+        # Once ads of the account were removed, its batches are not those of the other accounts
+        is_cached = not self._client.get_removed_ads(request.customer_id)
+        for batch_index, start in enumerate(range(0, len(indexes), self._batch_rows)):
+            batch_indexes = indexes[start:start + self._batch_rows]
+            if self._batch_latency_seconds:
+                time.sleep(self._batch_latency_seconds)
+            key = (fields, campaign_range, batch_index, len(batch_indexes)) if is_cached else None
+            yield self._response_type.deserialize(self._get_payload(key, fields, batch_indexes))
+
+    def _get_ad_indexes(self, request):
+        """The indexes of the (not removed) ads of the account, in the campaign range of the
+        query"""
+        ads_count = self._get_ads_count(request.customer_id)
+        min_campaign_id, max_campaign_id = _get_campaign_range(request.query)
+        removed_ads = self._client.get_removed_ads(request.customer_id)
+        if min_campaign_id is None and max_campaign_id is None and not removed_ads:
+            return range(ads_count)
+        return [index for index in range(ads_count) if
+                (min_campaign_id or 0) <= _get_campaign_id(index) <= (max_campaign_id or math.inf)
+                and _get_ad_id(index) not in removed_ads]
+
+    def _get_ads_count(self, customer_id):
+        if callable(self._ads_per_account):
+            return self._ads_per_account(customer_id)
+        return self._ads_per_account
+
+    def _get_payload(self, key, fields, indexes):
+        """The serialized batch of the ads, cached by {key} (None = not cached)"""
+        with self._payloads_lock:
+            payload = self._payloads.get(key)
+        if payload is None:
+            response = self._client.get_type("SearchGoogleAdsStreamResponse")
+            for index in indexes:
+                response.results.append(self._build_ad_row(fields, index))
+            payload = self._response_type.serialize(response)
+            if key is not None:
+                with self._payloads_lock:
+                    self._payloads[key] = payload
+        return payload
+
+    def _build_ad_row(self, fields, index):
+        """A disapproved ad row holding the selected fields (those of its own ad type)"""
+        row = self._client.get_type("GoogleAdsRow")
+        ad_type = _AD_TYPES[index % len(_AD_TYPES)]
+        topic_entry = self._client.get_type("PolicyTopicEntry")
+        topic_entry.topic = self._get_topic(index)
+        topic_entry.type_ = self._client.enums.PolicyTopicEntryTypeEnum.PROHIBITED
+        evidence = self._client.get_type("PolicyTopicEvidence")
+        evidence.text_list.texts.append(f"https://www.example.com/landing/{index}")
+        topic_entry.evidences.append(evidence)
+        headline = self._client.get_type("AdTextAsset")
+        headline.text = f"Headline {index}"
+        text = f"Some creative text {index}, long enough to look like a real description"
+        values = {"campaign.id": _get_campaign_id(index),
+                  "ad_group_ad.ad.id": _get_ad_id(index),
+                  "ad_group_ad.ad.type": ad_type,
+                  "ad_group_ad.ad_group": f"customers/1/adGroups/{200000 + index % 500}",
+                  "ad_group_ad.policy_summary.policy_topic_entries": [topic_entry],
+                  "ad_group_ad.ad.final_urls": [f"https://www.example.com/landing/{index}"],
+                  "ad_group_ad.ad.responsive_search_ad.headlines": [headline] * 5,
+                  "ad_group_ad.ad.responsive_search_ad.descriptions": [headline] * 2}
+        for field in fields:
+            parts = field.split(".")
+            if field.startswith("ad_group_ad.ad.") and parts[2].upper() in _AD_TYPES and \
+                    parts[2].upper() != ad_type:
+                continue
+            message = row
+            for part in parts[:-1]:
+                message = getattr(message, part)
+            setattr(message, parts[-1], values.get(field, text[:25]))
+        return row
+
+
+def _get_ad_id(index):
+    return _FIRST_AD_ID + index
+
+
+def _get_campaign_id(index):
+    return _FIRST_CAMPAIGN_ID + index % _CAMPAIGNS
+
+
+def _get_campaign_range(query):
+    """The (min, max) campaign ids (None = open) of a query"""
+    min_match = re.search(r"campaign\.id\s*>=\s*(\d+)", query)
+    max_match = re.search(r"campaign\.id\s*<=\s*(\d+)", query)
+    return (int(min_match.group(1)) if min_match is not None else None,
+            int(max_match.group(1)) if max_match is not None else None)
+
+
+class _FakeAdGroupAdService:
+    """mutate_ad_group_ads of the AdGroupAdService: every removal succeeds, and the ad is no
+    longer served, but those of the failing ads, which come back as partial failures"""
+
+    def __init__(self, client, failing_removals):
+        self._client = client
+        self._failing_removals = {int(ad_id) for ad_id in failing_removals}
+
+    @staticmethod
+    def ad_group_ad_path(customer_id, ad_group_id, ad_id):
+        return f"customers/{customer_id}/adGroupAds/{ad_group_id}~{ad_id}"
+
+    def mutate_ad_group_ads(self, request):
+        self._client.on_request("mutate_ad_group_ads")
+        response = self._client.get_type("MutateAdGroupAdsResponse")
+        failure = self._client.get_type("GoogleAdsFailure")
+        for index, operation in enumerate(request.operations):
+            result = self._client.get_type("MutateAdGroupAdResult")
+            match = _AD_GROUP_AD_RESOURCE_NAME.match(operation.remove)
+            if match is not None and int(match.group(2)) in self._failing_removals:
+                # Failed operations come back as empty results
+                failure.errors.append(self._build_error(index, match.group(2)))
+            else:
+                result.resource_name = operation.remove
+                if match is not None:
+                    self._client.remove_ad(*match.groups())
+            response.results.append(result)
+        if failure.errors:
+            response.partial_failure_error.code = grpc.StatusCode.INVALID_ARGUMENT.value[0]
+            detail = response.partial_failure_error.details.add()
+            detail.type_url = ("type.googleapis.com/"
+                               f"{type(failure).pb(failure).DESCRIPTOR.full_name}")
+            detail.value = type(failure).serialize(failure)
+        return response
+
+    def _build_error(self, index, ad_id):
+        """A GoogleAdsError at the index of the operation, like a partial failure reports"""
+        error = self._client.get_type("GoogleAdsError")
+        error.message = f"Fake removal failure of ad {ad_id}"
+        error.error_code.mutate_error = self._client.get_type(
+            "MutateErrorEnum").MutateError.RESOURCE_NOT_FOUND
+        error.location.field_path_elements.append(
+            type(error.location).FieldPathElement(field_name="operations", index=index))
+        return error
+
@@ -13,10 +13,49 @@
 # limitations under the License.
 
 
-from google.ads.googleads.client import GoogleAdsClient
+import time
+
+from channel_pool import ChannelPool
+from instrumentation import get_metrics
+from rate_limiter import RequestKind, get_token_bucket
+from retry_policy import RetryPolicy, is_quota_error, is_transient_error
 
 GOOGLE_ADS_YAML = './secret_keys/google-ads.yaml'
 _TIMEOUT_MILLIS = 1000 * 15
+# The max LIMIT of a change_status query
+_MAX_CHANGE_STATUS_ROWS = 10000
+
+# Needed for the topics check and for removal.
+_AD_ID_FIELDS = ["campaign.id",
+                 "ad_group_ad.ad.id",
+                 "ad_group_ad.ad.type",
+                 "ad_group_ad.ad_group",
+                 "ad_group_ad.policy_summary.policy_topic_entries"]
+_AD_OUTPUT_FIELDS = ["ad_group_ad.ad.final_urls"]
+# The names of the AdTypeEnum values (but UNSPECIFIED and UNKNOWN), which ad_types may hold
+AD_TYPES = ("TEXT_AD", "EXPANDED_TEXT_AD", "EXPANDED_DYNAMIC_SEARCH_AD", "HOTEL_AD",
+            "SHOPPING_SMART_AD", "SHOPPING_PRODUCT_AD", "VIDEO_AD", "IMAGE_AD",
+            "RESPONSIVE_SEARCH_AD", "LEGACY_RESPONSIVE_DISPLAY_AD", "APP_AD",
+            "LEGACY_APP_INSTALL_AD", "RESPONSIVE_DISPLAY_AD", "LOCAL_AD", "HTML5_UPLOAD_AD",
+            "DYNAMIC_HTML5_AD", "APP_ENGAGEMENT_AD", "SHOPPING_COMPARISON_LISTING_AD",
+            "VIDEO_BUMPER_AD", "VIDEO_NON_SKIPPABLE_IN_STREAM_AD", "VIDEO_TRUEVIEW_IN_STREAM_AD",
+            "VIDEO_RESPONSIVE_AD", "SMART_CAMPAIGN_AD", "CALL_AD", "APP_PRE_REGISTRATION_AD",
+            "IN_FEED_VIDEO_AD", "DEMAND_GEN_MULTI_ASSET_AD", "DEMAND_GEN_CAROUSEL_AD",
+            "TRAVEL_AD", "DEMAND_GEN_VIDEO_RESPONSIVE_AD", "DEMAND_GEN_PRODUCT_AD",
+            "YOUTUBE_AUDIO_AD")
+# The 'mandatory_data' of each ad type
+_AD_TYPE_FIELDS = {"TEXT_AD": ["ad_group_ad.ad.text_ad.headline",
+                               "ad_group_ad.ad.text_ad.description1",
+                               "ad_group_ad.ad.text_ad.description2"],
+                   "EXPANDED_TEXT_AD": ["ad_group_ad.ad.expanded_text_ad.description",
+                                        "ad_group_ad.ad.expanded_text_ad.description2",
+                                        "ad_group_ad.ad.expanded_text_ad.headline_part1",
+                                        "ad_group_ad.ad.expanded_text_ad.headline_part2",
+                                        "ad_group_ad.ad.expanded_text_ad.headline_part3"],
+                   "RESPONSIVE_SEARCH_AD": ["ad_group_ad.ad.responsive_search_ad.headlines",
+                                            "ad_group_ad.ad.responsive_search_ad.descriptions",
+                                            "ad_group_ad.ad.responsive_search_ad.path1",
+                                            "ad_group_ad.ad.responsive_search_ad.path2"]}
 
 
 class GAdsServiceWrapper:
@@ -28,7 +67,7 @@ class GAdsServiceWrapper:
 
     @property
     def ga_service(self):
-        return self._ga_service
+        return self._channel_pool.default_channels.ga_service
 
     @property
     def customer_id(self):
@@ -36,72 +75,236 @@ class GAdsServiceWrapper:
 
     @property
     def ad_group_ad_service(self):
-        return self._ad_group_ad_service
+        return self._channel_pool.default_channels.ad_group_ad_service
+
+    @property
+    def retry_policy(self):
+        return self._retry_policy
+
+    @property
+    def channel_pool(self):
+        return self._channel_pool
 
-    def __init__(self, customer_id):
+    def __init__(self, customer_id, read_qps=0, mutate_qps=0, max_retries=4, channels=1,
+                 client=None):
         """ GoogleAdsClient will read the google-ads.yaml configuration file in the
-         home directory if none is specified. """
-        self._client = GoogleAdsClient.load_from_storage(GOOGLE_ADS_YAML)
-        self._ga_service = self._client.get_service("GoogleAdsService")
-        self._ad_group_ad_service = self._client.get_service("AdGroupAdService")
+         home directory if none is specified (or a client, e.g. a FakeGoogleAdsClient, is given).
+         Reads and mutates are rate limited (0 = unlimited) per developer token, across all the
+         wrappers of this process. Transient and quota errors are retried up to {max_retries}
+         times. The requests are spread over a pool of {channels} channels (see ChannelPool). """
+        if client is None:
+            # Imported with the first client (the library takes a while to import), so the
+            # runs without the API do not import it
+            # pylint: disable=import-outside-toplevel
+            from google.ads.googleads.client import GoogleAdsClient
+            client = GoogleAdsClient.load_from_storage(GOOGLE_ADS_YAML)
+        self._client = client
+        self._channel_pool = ChannelPool(self._client, channels)
         self._customer_id = customer_id
+        self._read_bucket = get_token_bucket(self._client.developer_token, RequestKind.READ,
+                                             read_qps)
+        self._mutate_bucket = get_token_bucket(self._client.developer_token, RequestKind.MUTATE,
+                                               mutate_qps)
+        self._retry_policy = RetryPolicy(_is_retryable, max_retries)
+        self._listener = None
+
+    def set_listener(self, listener):
+        """Reports the outcome of the API requests to the listener (e.g. an AdaptiveScheduler):
+        listener.on_request_latency(kind, seconds) for the successful requests (the time to the
+        first batch for a stream, without the rate limit waits), and the quota errors (see
+        RetryPolicy.set_listener). None removes the listener"""
+        self._listener = listener
+        self._retry_policy.set_listener(listener)
 
     def get_stream_of_rows(self, customer_id, query):
-        """Returns a stream of results from GAds API"""
+        """Returns a stream of results from GAds API, retried until its first batch"""
         search_request = self._client.get_type("SearchGoogleAdsStreamRequest")
         search_request.customer_id = customer_id
         search_request.query = query
-        return self._ga_service.search_stream(request=search_request)
+        return self._retry_policy.stream(self._search_stream, search_request)
+
+    def get_total_results_count(self, customer_id, query):
+        """Returns the number of rows matching a query (ignoring its LIMIT), retried like the
+        streams"""
+        search_request = self._client.get_type("SearchGoogleAdsRequest")
+        search_request.customer_id = customer_id
+        search_request.query = query
+        search_request.search_settings.return_total_results_count = True
+        return self._retry_policy.call(self._search, search_request).total_results_count
+
+    def mutate_ad_group_ads(self, request):
+        """Sends a MutateAdGroupAdsRequest"""
+        return self._retry_policy.call(self._mutate_ad_group_ads, request)
+
+    def get_customer_clients(self, customer_id, level=None):
+        """Returns a list of (id, is_manager, level) for all the direct and indirect clients of a
+        given account (including itself at level 0), optionally only those at {level}"""
+        query = '''
+        SELECT
+          customer_client.id,
+          customer_client.manager,
+          customer_client.level
+        FROM
+          customer_client'''
+        if level is not None:
+            query += '''
+        WHERE
+          customer_client.level = ''' + str(level)
+
+        clients = []
+        rows = self.get_stream_of_rows(customer_id, query)
+        for batch in rows:
+            for row in batch.results:
+                customer_client = row.customer_client
+                clients.append((str(customer_client.id), customer_client.manager,
+                                customer_client.level))
+        return clients
 
-    def get_sub_accounts(self, is_mcc, customer_id, hierarchy):
-        """Returns a list {id, hierarchy} for all the descendant accounts of a given MCC account
-        which are mcc themselves = {is_mcc} """
+    def get_changed_ad_groups(self, customer_id, since, until):
+        """Returns the resource names of the ad groups whose ads changed between since and until
+        (datetimes), or None if there were more changes than a change_status query returns"""
+        query = f'''
+        SELECT
+          change_status.ad_group
+        FROM
+          change_status
+        WHERE
+          change_status.last_change_date_time BETWEEN '{since:%Y-%m-%d %H:%M:%S}'
+            AND '{until:%Y-%m-%d %H:%M:%S}'
+          AND change_status.resource_type = AD_GROUP_AD
+        LIMIT {_MAX_CHANGE_STATUS_ROWS}'''
+
+        ad_groups = set()
+        rows_count = 0
+        rows = self.get_stream_of_rows(customer_id, query)
+        for batch in rows:
+            for row in batch.results:
+                rows_count += 1
+                ad_groups.add(row.change_status.ad_group)
+        if rows_count >= _MAX_CHANGE_STATUS_ROWS:
+            return None
+        return ad_groups
+
+    def get_campaign_ids(self, customer_id):
+        """Returns the ids of the (not removed) campaigns of an account"""
         query = '''
         SELECT
-          customer_client.descriptive_name,
-          customer_client.id
+          campaign.id
         FROM
-          customer_client
+          campaign
         WHERE
-          customer_client.manager = ''' + str(is_mcc)
+          campaign.status != REMOVED'''
 
-        accounts = []
+        campaign_ids = []
         rows = self.get_stream_of_rows(customer_id, query)
         for batch in rows:
             for row in batch.results:
-                customer_id_str = str(row.customer_client.id)
-                if not customer_id_str == customer_id:
-                    accounts.append({"account_id": customer_id_str,
-                                     "hierarchy": hierarchy + '_' + customer_id_str})
-        return accounts
-
-    def get_disapproved_ads_for_account(self, account_id):
-        """Returns disapproved ads for account"""
-        query = """
+                campaign_ids.append(row.campaign.id)
+        return campaign_ids
+
+    def get_disapproved_ads_for_account(self, account_id, ad_types=None, ids_only=False,
+                                        ad_groups=None, campaign_range=None):
+        """Returns disapproved ads for account, see build_disapproved_ads_query"""
+        return self.get_stream_of_rows(account_id,
+                                       build_disapproved_ads_query(ad_types, ids_only, ad_groups,
+                                                                   campaign_range))
+
+    def count_disapproved_ads(self, account_id, ad_types=None):
+        """Returns the number of disapproved ads of an account (a single row is fetched)"""
+        return self.get_total_results_count(
+            account_id, build_disapproved_ads_query(ad_types, ids_only=True) + """
+            LIMIT 1""")
+
+    def _search(self, search_request):
+        metrics = get_metrics()
+        with metrics.time("read_rate_limit_wait"):
+            self._read_bucket.acquire()
+        metrics.increment("api_searches")
+        with self._channel_pool.lease() as service_channels:
+            started = time.monotonic()
+            response = service_channels.ga_service.search(request=search_request)
+        self._on_request_done("search", started)
+        return response
+
+    def _search_stream(self, search_request):
+        metrics = get_metrics()
+        with metrics.time("read_rate_limit_wait"):
+            self._read_bucket.acquire()
+        metrics.increment("api_search_streams")
+        # The channels stay leased until the stream is read (or closed)
+        with self._channel_pool.lease() as service_channels:
+            started = time.monotonic()
+            for batch in service_channels.ga_service.search_stream(request=search_request):
+                if started is not None:
+                    self._on_request_done("search_stream", started)
+                    started = None
+                yield batch
+        if started is not None:
+            self._on_request_done("search_stream", started)
+
+    def _mutate_ad_group_ads(self, request):
+        metrics = get_metrics()
+        with metrics.time("mutate_rate_limit_wait"):
+            self._mutate_bucket.acquire()
+        metrics.increment("api_mutates")
+        metrics.increment("api_mutate_operations", len(request.operations))
+        with metrics.time("mutate"), self._channel_pool.lease() as service_channels:
+            started = time.monotonic()
+            response = service_channels.ad_group_ad_service.mutate_ad_group_ads(request=request)
+        self._on_request_done("mutate", started)
+        return response
+
+    def _on_request_done(self, kind, started):
+        listener = self._listener
+        if listener is not None:
+            listener.on_request_latency(kind, time.monotonic() - started)
+
+
+def _is_retryable(exception):
+    return is_transient_error(exception) or is_quota_error(exception)
+
+
+def get_disapproved_ads_fields(ad_types=None, ids_only=False):
+    """Returns the ad_group_ad fields to select: the ids, type and policy topics, plus (unless
+    {ids_only}) the final urls and the creative fields of {ad_types} (default: all known types)"""
+    fields = list(_AD_ID_FIELDS)
+    if ids_only:
+        return fields
+    fields.extend(_AD_OUTPUT_FIELDS)
+    for ad_type in ad_types or _AD_TYPE_FIELDS:
+        fields.extend(_AD_TYPE_FIELDS.get(ad_type, []))
+    return fields
+
+
+def build_disapproved_ads_query(ad_types=None, ids_only=False, ad_groups=None,
+                                campaign_range=None):
+    """Returns the GAQL query of the disapproved (not removed) ads, only of {ad_types}, in
+    {ad_groups} (resource names) and in the campaigns of {campaign_range} ((min, max) ids, None =
+    open) if given. Raises ValueError if an ad type is not one of AD_TYPES"""
+    unknown_ad_types = sorted(set(ad_types or ()) - set(AD_TYPES))
+    if unknown_ad_types:
+        raise ValueError(f"Unknown ad types: {', '.join(unknown_ad_types)}")
+    query = """
             SELECT
-              customer.id,
-              campaign.id,
-              ad_group_ad.ad.type,
-              ad_group_ad.ad.text_ad.headline,
-              ad_group_ad.ad.text_ad.description1,
-              ad_group_ad.ad.text_ad.description2,
-              ad_group_ad.ad.expanded_text_ad.description,
-              ad_group_ad.ad.expanded_text_ad.description2,
-              ad_group_ad.ad.expanded_text_ad.headline_part1,
-              ad_group_ad.ad.expanded_text_ad.headline_part2,
-              ad_group_ad.ad.expanded_text_ad.headline_part3,
-              ad_group_ad.ad.responsive_search_ad.headlines,
-              ad_group_ad.ad.responsive_search_ad.descriptions,
-              ad_group_ad.ad.responsive_search_ad.path1,
-              ad_group_ad.ad.responsive_search_ad.path2,
-              ad_group_ad.ad.id,
-              ad_group_ad.ad.final_urls,
-              ad_group_ad.ad.type,
-              ad_group_ad.ad_group,
-              ad_group_ad.policy_summary.approval_status,
-              ad_group_ad.policy_summary.policy_topic_entries
+              """ + """,
+              """.join(get_disapproved_ads_fields(ad_types, ids_only)) + """
             FROM ad_group_ad
-            WHERE         
+            WHERE
                 ad_group_ad.policy_summary.approval_status = DISAPPROVED
-                AND ad_group_ad.status != REMOVED  """
-        return self.get_stream_of_rows(account_id, query)
+                AND ad_group_ad.status != REMOVED"""
+    if ad_types:
+        query += """
+                AND ad_group_ad.ad.type IN (""" + ", ".join(ad_types) + ")"
+    if ad_groups:
+        query += """
+                AND ad_group_ad.ad_group IN (""" + \
+                 ", ".join(f"'{ad_group}'" for ad_group in sorted(ad_groups)) + ")"
+    if campaign_range:
+        min_campaign_id, max_campaign_id = campaign_range
+        if min_campaign_id is not None:
+            query += f"""
+                AND campaign.id >= {min_campaign_id}"""
+        if max_campaign_id is not None:
+            query += f"""
+                AND campaign.id <= {max_campaign_id}"""
+    return query
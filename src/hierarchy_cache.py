@@ -0,0 +1,90 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""On-disk cache of discovered account trees, one file per top MCC id.
+
+A tree younger than the TTL is used as is (no discovery request at all). An older tree is refreshed
+incrementally: the top customer_client query is issued again and only the levels whose clients or
+managers changed are resolved again (re-expanded only with resolve_parents), while every other
+client keeps its cached parent. A client that moved between two managers of the same level, with no
+other change of these levels, keeps its cached parent until the next full refresh, done once the
+last one is older than full_refresh_seconds (a day by default): this is the longest a cached parent
+can be stale.
+"""
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+from account_discovery import AccountTree
+
+logger = logging.getLogger(__name__)
+
+_FULL_REFRESH_SECONDS = 24 * 60 * 60
+
+
+class AccountHierarchyCache:
+    """Loads and stores AccountTree objects keyed by top MCC id"""
+
+    def __init__(self, cache_path, ttl_seconds, full_refresh_seconds=_FULL_REFRESH_SECONDS):
+        self._cache_path = cache_path
+        self._ttl_seconds = ttl_seconds
+        self._full_refresh_seconds = full_refresh_seconds
+
+    def get_tree(self, discovery, top_id, force_refresh=False):
+        """Returns the cached tree of top_id if it is fresh, otherwise refreshes it (incrementally
+        when possible) with discovery, an AccountTreeDiscovery, and stores it"""
+        cache_entry = self.load(top_id)
+        if cache_entry is None or force_refresh:
+            return self.save(discovery.discover_tree(top_id))
+        tree, created, full_refresh = cache_entry
+        now = time.time()
+        age_seconds = now - created
+        if age_seconds < self._ttl_seconds:
+            logger.info("Using cached account tree of %s (%d seconds old)", top_id, age_seconds)
+            return tree
+        if full_refresh is None or now - full_refresh >= self._full_refresh_seconds:
+            logger.info("Refreshing cached account tree of %s fully", top_id)
+            return self.save(discovery.discover_tree(top_id))
+        logger.info("Refreshing cached account tree of %s incrementally", top_id)
+        return self.save(discovery.discover_tree(top_id, known_tree=tree), full_refresh)
+
+    def load(self, top_id):
+        """Returns (tree, created, full_refresh) or None if top_id is not cached. full_refresh,
+        the time of the last full discovery, is None for caches written before it was stored"""
+        try:
+            with open(self.get_cache_file(top_id), encoding='utf-8') as file_object:
+                cache_json = json.load(file_object)
+        except (OSError, ValueError):
+            return None
+        return (AccountTree.from_json(cache_json["tree"]), cache_json["created"],
+                cache_json.get("full_refresh"))
+
+    def save(self, tree, full_refresh=None):
+        """Stores the tree and returns it. full_refresh is the time of the last full discovery,
+        now when not given"""
+        now = time.time()
+        Path(self._cache_path).mkdir(parents=True, exist_ok=True)
+        cache_file = self.get_cache_file(tree.top_id)
+        temp_file = cache_file.with_suffix(".tmp")
+        with open(temp_file, 'w', encoding='utf-8') as file_object:
+            json.dump({"created": now, "full_refresh": full_refresh or now,
+                       "tree": tree.to_json()}, file_object)
+        os.replace(temp_file, cache_file)
+        return tree
+
+    def get_cache_file(self, top_id):
+        """Returns the cache file of a top MCC"""
+        return Path(self._cache_path) / f"account_tree_{top_id}.json"
@@ -0,0 +1,250 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run instrumentation: per-phase timings, counters, histograms and gauges, plus a profiler.
+
+Phases are timed per batch or chunk rather than per row, to keep the overhead negligible. Phase
+times are summed over all the threads, so in parallel mode they add up to more than the wall time
+of the run. The metrics of the process (get_metrics()) are exported as json and optionally as a
+Prometheus textfile (for the node exporter textfile collector).
+
+The SamplingProfiler samples the stacks of all the threads (unlike cProfile, which only profiles
+the thread it runs in) and writes them as collapsed stacks, the input format of flamegraph.pl and
+speedscope.
+"""
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+_HISTOGRAM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+_METRIC_PREFIX = "disapproved_ads_auditor"
+_SAMPLING_INTERVAL_SECONDS = 0.01
+_TOP_FUNCTIONS = 25
+
+
+class Metrics:
+    """Thread-safe metrics of a run"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._phase_seconds = Counter()
+        self._phase_counts = Counter()
+        self._counters = Counter()
+        self._histograms = {}
+        self._max_gauges = {}
+
+    @contextlib.contextmanager
+    def time(self, phase):
+        """Adds the wall time of the with block to phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def add_time(self, phase, seconds):
+        with self._lock:
+            self._phase_seconds[phase] += seconds
+            self._phase_counts[phase] += 1
+
+    def increment(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def observe(self, histogram, value):
+        """Adds a value (e.g. seconds) to a histogram with fixed buckets"""
+        with self._lock:
+            if histogram not in self._histograms:
+                self._histograms[histogram] = {"buckets": [0] * (len(_HISTOGRAM_BUCKETS) + 1),
+                                               "count": 0, "sum": 0.0, "max": 0.0}
+            values = self._histograms[histogram]
+            bucket = next((index for index, bound in enumerate(_HISTOGRAM_BUCKETS) if
+                           value <= bound), len(_HISTOGRAM_BUCKETS))
+            values["buckets"][bucket] += 1
+            values["count"] += 1
+            values["sum"] += value
+            values["max"] = max(values["max"], value)
+
+    def observe_max(self, gauge, value):
+        """Keeps the max value of a gauge (e.g. a queue depth)"""
+        with self._lock:
+            if value > self._max_gauges.get(gauge, 0):
+                self._max_gauges[gauge] = value
+
+    def merge(self, snapshot):
+        """Adds the metrics of another process (its snapshot), e.g. of a worker process"""
+        with self._lock:
+            for phase, values in snapshot["phases"].items():
+                self._phase_seconds[phase] += values["seconds"]
+                self._phase_counts[phase] += values["count"]
+            self._counters.update(snapshot["counters"])
+            for gauge, value in snapshot["max_gauges"].items():
+                self._max_gauges[gauge] = max(self._max_gauges.get(gauge, 0), value)
+            for histogram, values in snapshot["histograms"].items():
+                if histogram not in self._histograms:
+                    self._histograms[histogram] = {
+                        "buckets": [0] * (len(_HISTOGRAM_BUCKETS) + 1), "count": 0, "sum": 0.0,
+                        "max": 0.0}
+                merged_values = self._histograms[histogram]
+                # Snapshot buckets are cumulative
+                previous_count = 0
+                for index, count in enumerate(values["buckets"].values()):
+                    merged_values["buckets"][index] += count - previous_count
+                    previous_count = count
+                merged_values["count"] += values["count"]
+                merged_values["sum"] += values["sum"]
+                merged_values["max"] = max(merged_values["max"], values["max"])
+
+    def reset(self):
+        with self._lock:
+            self._start = time.monotonic()
+            self._phase_seconds.clear()
+            self._phase_counts.clear()
+            self._counters.clear()
+            self._histograms.clear()
+            self._max_gauges.clear()
+
+    def snapshot(self):
+        """Returns all the metrics as a json serializable dict"""
+        with self._lock:
+            elapsed_seconds = time.monotonic() - self._start
+            histograms = {}
+            for histogram, values in self._histograms.items():
+                cumulative_count = 0
+                buckets = {}
+                for bound, count in zip(_HISTOGRAM_BUCKETS + ("+Inf",), values["buckets"]):
+                    cumulative_count += count
+                    buckets[str(bound)] = cumulative_count
+                histograms[histogram] = dict(values, buckets=buckets)
+            return {"elapsed_seconds": elapsed_seconds,
+                    "phases": {phase: {"seconds": seconds, "count": self._phase_counts[phase]}
+                               for phase, seconds in sorted(self._phase_seconds.items())},
+                    "counters": dict(sorted(self._counters.items())),
+                    "counters_per_second": {counter: value / elapsed_seconds for counter, value
+                                            in sorted(self._counters.items())},
+                    "histograms": histograms,
+                    "max_gauges": dict(sorted(self._max_gauges.items()))}
+
+    def write_json(self, file_path, extra=None):
+        """Writes the snapshot (with the {extra} fields, e.g. the session id) as json"""
+        snapshot = dict(extra or {}, **self.snapshot())
+        _write_atomically(file_path, json.dumps(snapshot, indent=2))
+
+    def write_prometheus(self, file_path, labels=None):
+        """Writes the snapshot in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        label_text = ",".join(f'{name}="{value}"' for name, value in (labels or {}).items())
+
+        def sample(name, value, extra_labels=""):
+            all_labels = ",".join(label for label in (label_text, extra_labels) if label)
+            return f"{_METRIC_PREFIX}_{name}{{{all_labels}}} {value}"
+
+        lines = [f"# TYPE {_METRIC_PREFIX}_elapsed_seconds gauge",
+                 sample("elapsed_seconds", snapshot["elapsed_seconds"]),
+                 f"# TYPE {_METRIC_PREFIX}_phase_seconds counter"]
+        lines.extend(sample("phase_seconds", values["seconds"], f'phase="{phase}"') for
+                     phase, values in snapshot["phases"].items())
+        for counter, value in snapshot["counters"].items():
+            lines.append(f"# TYPE {_METRIC_PREFIX}_{counter}_total counter")
+            lines.append(sample(f"{counter}_total", value))
+        for gauge, value in snapshot["max_gauges"].items():
+            lines.append(f"# TYPE {_METRIC_PREFIX}_{gauge}_max gauge")
+            lines.append(sample(f"{gauge}_max", value))
+        for histogram, values in snapshot["histograms"].items():
+            lines.append(f"# TYPE {_METRIC_PREFIX}_{histogram} histogram")
+            lines.extend(sample(f"{histogram}_bucket", count, f'le="{bound}"') for bound, count in
+                         values["buckets"].items())
+            lines.append(sample(f"{histogram}_sum", values["sum"]))
+            lines.append(sample(f"{histogram}_count", values["count"]))
+        _write_atomically(file_path, "\n".join(lines) + "\n")
+
+
+class SamplingProfiler:
+    """Samples the stacks of all the threads every {interval_seconds} in a background thread"""
+
+    def __init__(self, interval_seconds=_SAMPLING_INTERVAL_SECONDS):
+        self._interval_seconds = interval_seconds
+        self._stacks = Counter()
+        self._samples_count = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write_collapsed_stacks(self, file_path):
+        """Writes one 'outer;...;inner count' line per distinct stack"""
+        _write_atomically(file_path, "".join(f"{';'.join(stack)} {count}\n" for stack, count in
+                                             self._stacks.most_common()))
+
+    def log_top_functions(self, top=_TOP_FUNCTIONS):
+        """Logs the functions found in the most samples, with their self samples"""
+        total_samples = Counter()
+        self_samples = Counter()
+        for stack, count in self._stacks.items():
+            for function in set(stack):
+                total_samples[function] += count
+            self_samples[stack[-1]] += count
+        lines = [f"Profile: {self._samples_count} samples (all threads)"]
+        if self._samples_count:
+            lines.append(f"{'total %':>8} {'self %':>8}  function")
+            for function, count in total_samples.most_common(top):
+                lines.append(f"{100 * count / self._samples_count:>8.1f} "
+                             f"{100 * self_samples[function] / self._samples_count:>8.1f}  "
+                             f"{function}")
+        logger.info("\n".join(lines))
+
+    def _run(self):
+        own_thread_id = threading.get_ident()
+        while not self._stop.wait(self._interval_seconds):
+            # pylint: disable-next=protected-access
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.reverse()
+                # Idle threads (waiting on a queue or a lock) are sampled too, as where they wait
+                self._stacks[tuple(stack)] += 1
+                self._samples_count += 1
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    """Returns the metrics of the process"""
+    return _metrics
+
+
+def _write_atomically(file_path, text):
+    temp_file = f"{file_path}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as file_object:
+        file_object.write(text)
+    os.replace(temp_file, file_path)
@@ -39,176 +39,770 @@ Options to:
 import argparse
 import json
 import logging
-import re
+import multiprocessing
 import sys
 import time
 import uuid
+from collections import Counter
 from concurrent import futures
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
-from google.ads.googleads.errors import GoogleAdsException
-from google.cloud import bigquery
-
-from array_utils import split, take_out_elements
-from bq_connector import BqServiceWrapper, BowlingStatus
-from gads_connector import GAdsServiceWrapper
+from account_discovery import AccountTreeDiscovery
+from ad_records import AdRecordExtractor
+from account_index import AccountIndex
+from account_sizes import AccountPart, AccountSizes, SplitAccount, get_parts_count, \
+    order_largest_first, split_campaign_ids
+from account_sharding import PROCESS_SHARD_SALT, get_shard_suffix, parse_shard, select_shard
+from account_scheduler import AdaptiveScheduler
+from array_utils import chunked, split
+from async_logging import start_async_logging
+from bowling_status import BowlingStatus
+from bq_writer import BqBackgroundWriter, BqLoadJobWriter
+from change_watermarks import ChangeWatermarks
+from gads_connector import AD_TYPES, GAdsServiceWrapper
+from hierarchy_cache import AccountHierarchyCache
+from instrumentation import SamplingProfiler, get_metrics
+from mutate_pipeline import MutatePipeline
+from output_sink import NdjsonSink
+from retry_policy import get_error_message, is_google_ads_exception
+from schema_marker import SchemaMarker, get_fingerprint
+from session_journal import SessionJournal, get_journal_file
+from session_rollup import rollup_session_files
+from spill_buffer import SpillBuffer
+from stream_capture import StreamCapture
+from topic_matcher import TopicMatcher
 
 _DS_ID = "google_3_strikes"
 _ALL_ACCOUNTS_TABLE_NAME = "AllAccounts"
 _ADS_TO_REMOVE_TABLE_NAME = "AdsToRemove"
 _PER_ACCOUNT_SUMMARY_TABLE_NAME = "PerAccountSummary"
 _PER_MCC_SUMMARY_TABLE_NAME = "PerMccSummary"
+# The latest row of every ad of AdsToRemove, kept up to date at the end of every session
+_ADS_LATEST_STATUS_TABLE_NAME = "AdsLatestStatus"
+_AD_KEY_FIELDS = ("account_id", "ad_group_id", "ad_id")
+# Rollups of the sessions (see session_rollup.py), which the report reads
+_ACCOUNT_ROLLUP_TABLE_NAME = "AccountRollup"
+_MCC_ROLLUP_TABLE_NAME = "MccRollup"
+_TABLE_NAMES = (_ALL_ACCOUNTS_TABLE_NAME, _ADS_TO_REMOVE_TABLE_NAME,
+                _PER_ACCOUNT_SUMMARY_TABLE_NAME, _PER_MCC_SUMMARY_TABLE_NAME)
 _OUTPUT_PATH = "../output/"
+_STAGING_PATH = "../output/staging/"
+_CACHE_PATH = "../cache/"
+_JOURNAL_PATH = "../output/journal/"
+_CAPTURE_PATH = "../output/capture/"
 _TOPICS_FILE = './topics_substrings.json'
 _CHUNK_SIZE = 5000
+# Above that many changed ad groups, an incremental audit scans the whole account
+_MAX_CHANGED_AD_GROUPS = 1000
 _RETRIES_LEFT = 2
-
-logging.basicConfig(level=logging.INFO, format='[%(asctime)s - %(levelname)s] %(message).5000s')
+# The topics listed in the summary of a batch (per ad details are logged at DEBUG level)
+_LOGGED_TOP_TOPICS = 3
+# Rows streamed in the last 90 minutes or so can not be deleted by DML (streaming buffer)
+_STREAMING_BUFFER_MINUTES = 120
+# The partitions read by the BQ rollup of a session, which may be a resumed one
+_ROLLUP_LOOKBACK_DAYS = 7
+# The BQ dataset and tables are checked again after that long, even if their definitions did not
+# change (e.g. a table deleted outside the tool)
+_BQ_SCHEMA_MARKER_TTL_HOURS = 24
+# Worker processes do not inherit the API clients: gRPC channels do not survive a fork
+_PROCESS_START_METHOD = "spawn"
+_PROCESS_SHARD = None  # The shard of a worker process
+
+bqWriters = {}
+bqBootstrap = None
+outputSinks = {}
+changeWatermarks = None
+accountSizes = None
+sessionJournal = None
+streamCapture = None
+mutatePipeline = None
+metrics = get_metrics()
+
+logger = logging.getLogger("disapproved_ads_auditor")
 logging.getLogger('google.ads.googleads.client').setLevel(logging.INFO)
 
 
+def get_bq_table_definitions():
+    """Returns the (table_id, schema, partition_field, clustering_fields) of the BQ required
+    tables, partitioned by day on their timestamp and clustered on their account_id (and ad_id)"""
+    # Imported here, as only the runs writing to BQ need the BQ library
+    from google.cloud import bigquery  # pylint: disable=import-outside-toplevel
+    ads_schema = [bigquery.SchemaField("ad_id", "STRING", mode="REQUIRED"),
+                  bigquery.SchemaField("ad_type", "STRING", mode="REQUIRED"),
+                  bigquery.SchemaField("ad_group_id", "STRING", mode="REQUIRED"),
+                  bigquery.SchemaField("campaign_id", "STRING", mode="REQUIRED"),
+                  bigquery.SchemaField("hierarchy", "STRING", mode="REQUIRED"),
+                  bigquery.SchemaField("final_urls", "STRING", mode="REQUIRED"),
+                  bigquery.SchemaField("policy_topics", "STRING", mode="REQUIRED"),
+                  bigquery.SchemaField("evidences", "STRING", mode="REQUIRED"),
+                  bigquery.SchemaField("mandatory_data", "STRING", mode="REQUIRED"),
+                  bigquery.SchemaField("timestamp", "TIMESTAMP", mode="REQUIRED"),
+                  bigquery.SchemaField("bowling_status", "string", mode="NULLABLE"),
+                  bigquery.SchemaField("account_id", "string", mode="NULLABLE"),
+                  bigquery.SchemaField("session_id", "string", mode="REQUIRED"),
+                  bigquery.SchemaField("removal_error", "string", mode="NULLABLE")]
+    return [(_ALL_ACCOUNTS_TABLE_NAME,
+             [bigquery.SchemaField("account_id", "STRING", mode="REQUIRED"),
+              bigquery.SchemaField("hierarchy", "STRING", mode="REQUIRED"),
+              bigquery.SchemaField("timestamp", "TIMESTAMP", mode="REQUIRED"),
+              bigquery.SchemaField("session_id", "string", mode="REQUIRED"),
+              bigquery.SchemaField("top_id", "STRING", mode="NULLABLE"),
+              bigquery.SchemaField("hierarchies", "STRING", mode="REPEATED")],
+             "timestamp", ["account_id"]),
+            (_ADS_TO_REMOVE_TABLE_NAME, ads_schema, "timestamp", ["account_id", "ad_id"]),
+            (_ADS_LATEST_STATUS_TABLE_NAME, ads_schema, "timestamp", ["account_id", "ad_id"]),
+            (_PER_ACCOUNT_SUMMARY_TABLE_NAME,
+             [bigquery.SchemaField("account_id", "STRING", mode="REQUIRED"),
+              bigquery.SchemaField("ads_to_remove_count", "INTEGER", mode="REQUIRED"),
+              bigquery.SchemaField("timestamp", "TIMESTAMP", mode="REQUIRED"),
+              bigquery.SchemaField("session_id", "string", mode="REQUIRED"),
+              bigquery.SchemaField("error", "string", mode="NULLABLE")],
+             "timestamp", ["account_id"]),
+            (_PER_MCC_SUMMARY_TABLE_NAME,
+             [bigquery.SchemaField("account_id", "STRING", mode="REQUIRED"),
+              bigquery.SchemaField("total_sub_accounts", "INTEGER", mode="REQUIRED"),
+              bigquery.SchemaField("top_mcc_total_ads_to_remove", "INTEGER", mode="REQUIRED"),
+              bigquery.SchemaField("accounts_with_ads_to_remove", "INTEGER", mode="REQUIRED"),
+              bigquery.SchemaField("accounts_without_ads_to_remove", "INTEGER", mode="REQUIRED"),
+              bigquery.SchemaField("timestamp", "TIMESTAMP", mode="REQUIRED"),
+              bigquery.SchemaField("session_id", "string", mode="REQUIRED"),
+              bigquery.SchemaField("failed_accounts", "INTEGER", mode="NULLABLE"),
+              bigquery.SchemaField("shard", "string", mode="NULLABLE")],
+             "timestamp", ["account_id"]),
+            # The column order of AccountRollup is the one of the rows merged by
+            # merge_account_rollup
+            (_ACCOUNT_ROLLUP_TABLE_NAME,
+             [bigquery.SchemaField("account_id", "STRING", mode="REQUIRED"),
+              bigquery.SchemaField("top_id", "STRING", mode="NULLABLE"),
+              bigquery.SchemaField("hierarchy", "STRING", mode="NULLABLE"),
+              bigquery.SchemaField("session_id", "string", mode="REQUIRED"),
+              bigquery.SchemaField("timestamp", "TIMESTAMP", mode="REQUIRED"),
+              bigquery.SchemaField("ads_to_remove", "INTEGER", mode="REQUIRED"),
+              bigquery.SchemaField("removed_ads", "INTEGER", mode="REQUIRED"),
+              bigquery.SchemaField("failed_to_remove_ads", "INTEGER", mode="REQUIRED"),
+              bigquery.SchemaField("error", "string", mode="NULLABLE")],
+             "timestamp", ["account_id"]),
+            (_MCC_ROLLUP_TABLE_NAME,
+             [bigquery.SchemaField("account_id", "STRING", mode="REQUIRED"),
+              bigquery.SchemaField("session_id", "string", mode="REQUIRED"),
+              bigquery.SchemaField("shard", "string", mode="NULLABLE"),
+              bigquery.SchemaField("timestamp", "TIMESTAMP", mode="REQUIRED"),
+              bigquery.SchemaField("total_accounts", "INTEGER", mode="REQUIRED"),
+              bigquery.SchemaField("accounts_with_ads_to_remove", "INTEGER", mode="REQUIRED"),
+              bigquery.SchemaField("accounts_with_ads_removed", "INTEGER", mode="REQUIRED"),
+              bigquery.SchemaField("failed_accounts", "INTEGER", mode="REQUIRED"),
+              bigquery.SchemaField("total_ads_to_remove", "INTEGER", mode="REQUIRED"),
+              bigquery.SchemaField("total_removed_ads", "INTEGER", mode="REQUIRED")],
+             "timestamp", ["account_id"])]
+
+
 def create_bq_tables():
-    """Creates BQ required tables"""
-    bqServiceWrapper.create_table(_ALL_ACCOUNTS_TABLE_NAME,
-                                  [bigquery.SchemaField("account_id", "STRING", mode="REQUIRED"),
-                                   bigquery.SchemaField("hierarchy", "STRING", mode="REQUIRED"),
-                                   bigquery.SchemaField("timestamp", "TIMESTAMP", mode="REQUIRED"),
-                                   bigquery.SchemaField("session_id", "string", mode="REQUIRED")])
-    bqServiceWrapper.create_table(_ADS_TO_REMOVE_TABLE_NAME,
-                                  [bigquery.SchemaField("ad_id", "STRING", mode="REQUIRED"),
-                                   bigquery.SchemaField("ad_type", "STRING", mode="REQUIRED"),
-                                   bigquery.SchemaField("ad_group_id", "STRING", mode="REQUIRED"),
-                                   bigquery.SchemaField("campaign_id", "STRING", mode="REQUIRED"),
-                                   bigquery.SchemaField("hierarchy", "STRING", mode="REQUIRED"),
-                                   bigquery.SchemaField("final_urls", "STRING", mode="REQUIRED"),
-                                   bigquery.SchemaField("policy_topics", "STRING", mode="REQUIRED"),
-                                   bigquery.SchemaField("evidences", "STRING", mode="REQUIRED"),
-                                   bigquery.SchemaField("mandatory_data", "STRING",
-                                                        mode="REQUIRED"),
-                                   bigquery.SchemaField("timestamp", "TIMESTAMP", mode="REQUIRED"),
-                                   bigquery.SchemaField("bowling_status", "string",
-                                                        mode="NULLABLE"),
-                                   bigquery.SchemaField("account_id", "string", mode="NULLABLE"),
-                                   bigquery.SchemaField("session_id", "string", mode="REQUIRED"),
-                                   bigquery.SchemaField("removal_error", "string",
-                                                        mode="NULLABLE")])
-    bqServiceWrapper.create_table(_PER_ACCOUNT_SUMMARY_TABLE_NAME,
-                                  [bigquery.SchemaField("account_id", "STRING", mode="REQUIRED"),
-                                   bigquery.SchemaField("ads_to_remove_count", "INTEGER",
-                                                        mode="REQUIRED"),
-                                   bigquery.SchemaField("timestamp", "TIMESTAMP", mode="REQUIRED"),
-                                   bigquery.SchemaField("session_id", "string", mode="REQUIRED")])
-
-    bqServiceWrapper.create_table(_PER_MCC_SUMMARY_TABLE_NAME,
-                                  [bigquery.SchemaField("account_id", "STRING", mode="REQUIRED"),
-                                   bigquery.SchemaField("total_sub_accounts", "INTEGER",
-                                                        mode="REQUIRED"),
-                                   bigquery.SchemaField("top_mcc_total_ads_to_remove", "INTEGER",
-                                                        mode="REQUIRED"),
-                                   bigquery.SchemaField("accounts_with_ads_to_remove", "INTEGER",
-                                                        mode="REQUIRED"),
-                                   bigquery.SchemaField("accounts_without_ads_to_remove", "INTEGER",
-                                                        mode="REQUIRED"),
-                                   bigquery.SchemaField("timestamp", "TIMESTAMP", mode="REQUIRED"),
-                                   bigquery.SchemaField("session_id", "string", mode="REQUIRED")])
-
-
-def main(top_id):
-    """Gets all the accounts, logs the crucial disapproved ads and optionally removes them"""
-    top_id = top_id.replace("-", "")
-    accounts_with_removed_ads = 0
-    accounts_without_removed_ads = 0
-    top_mcc_total_removed_ads = 0
-    if _WRITE_TO_BQ:
+    """Creates the BQ dataset and the BQ required tables (or updates their fields and layout),
+    checking the tables concurrently. Skipped while the schema marker shows that the same
+    definitions were already verified"""
+    definitions = get_bq_table_definitions()
+    fingerprint = get_fingerprint(
+        [[table_id, [field.to_api_repr() for field in schema], partition_field, clustering_fields]
+         for table_id, schema, partition_field, clustering_fields in definitions])
+    schema_marker = get_schema_marker()
+    if not _VERIFY_BQ_SCHEMA and schema_marker.is_verified(fingerprint):
+        logger.info("The BQ tables of %s were already verified", bqServiceWrapper.dataset_full_name)
+        return
+    bqServiceWrapper.create_dataset(bqServiceWrapper.dataset_full_name)
+    with futures.ThreadPoolExecutor(max_workers=len(definitions)) as executor:
+        table_futures = [executor.submit(bqServiceWrapper.create_table, *definition) for
+                         definition in definitions]
+    for table_future in table_futures:
+        table_future.result()
+    schema_marker.record(fingerprint)
+
+
+def get_schema_marker():
+    """Returns the schema marker of the dataset"""
+    return SchemaMarker(Path(_CACHE_PATH) / f"bq_schema_{bqServiceWrapper.dataset_full_name}.json",
+                        _BQ_SCHEMA_MARKER_TTL_HOURS * 60 * 60)
+
+
+def start_bq_bootstrap(delete_db=False):
+    """Creates the BQ client and the tables (after deleting them if {delete_db}) in a background
+    thread, while the Google Ads client is created and the accounts discovered. Wait for it with
+    wait_for_bq_bootstrap"""
+    global bqBootstrap
+    executor = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="bq_bootstrap")
+    bqBootstrap = executor.submit(bootstrap_bq, delete_db)
+    executor.shutdown(wait=False)
+
+
+def bootstrap_bq(delete_db=False):
+    """Creates the BQ client and the tables (after deleting them if {delete_db})"""
+    global bqServiceWrapper
+    # pylint: disable=import-outside-toplevel
+    from bq_connector import BqServiceWrapper
+    bqServiceWrapper = BqServiceWrapper(_DS_ID, check_dataset=False)
+    if delete_db:
+        delete_tables()
+        time.sleep(30)  # Number of seconds
+    create_bq_tables()
+
+
+def wait_for_bq_bootstrap():
+    """Waits for the BQ bootstrap, or creates the tables with the current BQ client if none was
+    started"""
+    global bqBootstrap
+    if bqBootstrap is None:
         create_bq_tables()
-    accounts = flat_all_accounts(top_id, str(top_id))
-    write_to_file(_ALL_ACCOUNTS_TABLE_NAME, accounts)
+        return
+    try:
+        bqBootstrap.result()
+    finally:
+        bqBootstrap = None
+
+
+def main(top_ids):
+    """Gets all the accounts of the top MCCs, logs the crucial disapproved ads and optionally
+    removes them"""
+    top_ids = [top_id.replace("-", "") for top_id in top_ids]
+    # Identifies the set of top MCCs of the session (journal, capture, watermarks, metrics)
+    top_key = "_".join(top_ids)
+    metrics.reset()
+    profiler = SamplingProfiler() if _PROFILE else None
+    if profiler is not None:
+        profiler.start()
+    if _WRITE_TO_BQ:
+        wait_for_bq_bootstrap()
+        if _CLEAN_OUTDATED_BQ:
+            compact_bq_tables()
+    start_session(top_key)
+    try:
+        with metrics.time("session"):
+            process_accounts(top_ids, top_key)
+        sessionJournal.close(session_completed=True)
+    finally:
+        stop_session()
+        export_metrics(top_key, profiler)
     if _WRITE_TO_BQ:
-        bqServiceWrapper.upload_rows_to_bq(table_id=_ALL_ACCOUNTS_TABLE_NAME,
-                                           rows_to_insert=accounts)
+        update_latest_status()
+    if _SESSION_ROLLUP == "bq":
+        rollup_session_in_bq()
+    elif _SESSION_ROLLUP == "local":
+        rollup_session_files_locally()
+
+
+def start_session(top_key):
+    """Opens the journal, the output files and the BQ writers of the session in this process"""
+    global sessionJournal, streamCapture
+    # Replays the progress of the session, if it is a retry or a resumed session
+    sessionJournal = SessionJournal(_JOURNAL_PATH, CURRENT_SESSION_ID +
+                                    get_shard_suffix(_SHARD, _PROCESS_SHARD))
+    sessionJournal.check_top_id(top_key)
+    if _CAPTURE_STREAMS or _REPLAY_CAPTURE:
+        streamCapture = StreamCapture(_CAPTURE_PATH, top_key)
+    if _WRITE_TO_BQ:
+        start_bq_writers()
+    start_output_sinks()
+
+
+def check_resumed_session():
+    """Exits if the resumed session has no journal: its id is unknown or mistyped, or the session
+    already completed"""
+    journal_file = get_journal_file(_JOURNAL_PATH, CURRENT_SESSION_ID + get_shard_suffix(_SHARD))
+    if not journal_file.exists():
+        logger.error("Can not resume session %s: %s not found (unknown session id, or the "
+                     "session already completed)", CURRENT_SESSION_ID, journal_file)
+        sys.exit(1)
+
+
+def stop_session():
+    """Closes the journal and flushes the output files and the BQ writers"""
+    sessionJournal.close()
+    with metrics.time("flush_output"):
+        stop_output_sinks()
+        if _WRITE_TO_BQ:
+            stop_bq_writers()
+
+
+def export_metrics(top_key, profiler=None):
+    """Writes the metrics of the session (and its profile) to the output folder"""
+    file_prefix = f"{time.strftime('%Y%m%d-%H%M%S')}_{CURRENT_SESSION_ID[:8]}" \
+                  f"{get_shard_suffix(_SHARD)}"
+    metrics_file = Path(_OUTPUT_PATH) / f"metrics_{file_prefix}.json"
+    metrics.write_json(metrics_file, {"session_id": CURRENT_SESSION_ID, "top_id": top_key})
+    logger.info("Metrics written to %s", metrics_file)
+    if _PROMETHEUS_FILE:
+        metrics.write_prometheus(_PROMETHEUS_FILE, {"top_id": top_key})
+    if profiler is not None:
+        profiler.stop()
+        profile_file = Path(_OUTPUT_PATH) / f"profile_{file_prefix}.txt"
+        profiler.write_collapsed_stacks(profile_file)
+        profiler.log_top_functions()
+        logger.info("Collapsed stacks written to %s", profile_file)
+
+
+def process_accounts(top_ids, top_key):
+    """Audits (and optionally removes) the disapproved ads of all the accounts of the top MCCs (of
+    this node's shard if sharded), each account once, and writes the per MCC summaries"""
+    accounts = get_accounts(top_ids, top_key)
+    if _SHARD_PROCESSES > 1:
+        tallies = audit_accounts_in_processes(top_key, accounts)
+    else:
+        tallies = audit_accounts(top_key, accounts)
+    for top_id in top_ids:
+        write_per_mcc_summary(top_id, tallies.get(top_id, Counter()))
+
+
+def get_accounts(top_ids, top_key):
+    """Returns the accounts to audit, discovered (or read from the capture in replay mode) once per
+    session: all the accounts of the top MCCs, or those of this node's shard. An account linked
+    under several top MCCs is returned once, see AccountIndex"""
+    accounts = sessionJournal.accounts
+    if accounts is None:
+        if _REPLAY_CAPTURE:
+            accounts = [add_session_identifiers_bq_columns(account) for account in
+                        streamCapture.load_accounts()]
+        else:
+            accounts = discover_accounts(top_ids)
+        if _SHARD is not None:
+            accounts = select_shard(accounts, *_SHARD)
+        write_to_file(_ALL_ACCOUNTS_TABLE_NAME, accounts)
+        if _WRITE_TO_BQ:
+            upload_rows_to_bq(_ALL_ACCOUNTS_TABLE_NAME, accounts)
+        sessionJournal.record_accounts(top_key, accounts)
+    if _CAPTURE_STREAMS:
+        streamCapture.record_accounts(accounts)
+    return accounts
+
+
+def discover_accounts(top_ids):
+    """Discovers the trees of the top MCCs concurrently, and indexes their accounts"""
+    account_index = AccountIndex()
+    with futures.ThreadPoolExecutor(max_workers=len(top_ids)) as executor:
+        for top_id, accounts in zip(top_ids, executor.map(flat_all_accounts, top_ids, top_ids)):
+            account_index.add_accounts(top_id, accounts)
+    if account_index.duplicates_count:
+        logger.info("%d accounts linked under several top MCCs are audited once",
+                    account_index.duplicates_count)
+    return account_index.get_accounts()
+
+
+def audit_accounts(top_key, accounts):
+    """Audits the accounts, tracking their sizes, and their change watermarks in incremental mode.
+    Returns their tallies per top MCC"""
+    global changeWatermarks, accountSizes
+    accountSizes = AccountSizes(_CACHE_PATH, top_key, get_shard_suffix(_SHARD, _PROCESS_SHARD))
+    if _INCREMENTAL_AUDIT:
+        changeWatermarks = ChangeWatermarks(_CACHE_PATH, top_key, _FULL_SWEEP_HOURS * 60 * 60,
+                                            _CHANGE_LOOKBACK_HOURS * 60 * 60, _FORCE_FULL_SWEEP,
+                                            get_shard_suffix(_SHARD, _PROCESS_SHARD))
+        logger.info("Full sweep" if changeWatermarks.is_full_sweep else "Incremental audit")
+    try:
+        tallies = schedule_accounts(accounts)
+    except BaseException:
+        if changeWatermarks is not None:
+            changeWatermarks.save()
+        raise
+    finally:
+        accountSizes.save()
+    if changeWatermarks is not None:
+        changeWatermarks.save(session_completed=True)
+    return tallies
+
+
+def schedule_accounts(accounts):
+    """Audits the accounts, concurrently in parallel mode (largest first, see plan_account_tasks).
+    Returns, per top MCC, the number of accounts with and without ads to remove, of failed
+    accounts and of ads to remove"""
     if _PARALLEL_MODE:
-        with futures.ThreadPoolExecutor() as executor:
-            results = executor.map(
-                lambda account_item: remove_disapproved_ads_for_account(account_item), accounts)
-        for removed_ads_count in results:
-            top_mcc_total_removed_ads += removed_ads_count
-            if removed_ads_count > 0:
-                accounts_with_removed_ads += 1
-            else:
-                accounts_without_removed_ads += 1
+        tasks = plan_account_tasks(accounts)
+        scheduler = AdaptiveScheduler(max_workers=_MAX_WORKERS, min_workers=_MIN_WORKERS)
+        # The latency and the quota errors of the API requests drive the concurrency
+        set_api_listener(scheduler)
+        try:
+            account_results = collect_account_results(
+                tasks, scheduler.map(run_account_task, tasks))
+        finally:
+            set_api_listener(None)
+        results = [account_results[account["account_id"]] for account in accounts]
     else:
-        for account in accounts:
-            removed_ads_count = remove_disapproved_ads_for_account(account)
-            if removed_ads_count > 0:
-                accounts_with_removed_ads += 1
-            else:
-                accounts_without_removed_ads += 1
-    per_mcc_summary = {
-        f"\ntop_mcc_total_accounts = {accounts_with_removed_ads + accounts_without_removed_ads}, "
-        f"accounts_with_removed_ads = {accounts_with_removed_ads}, "
-        f"accounts_without_removed_ads = {accounts_without_removed_ads}, "
-        f"top_mcc_total_removed_ads = {top_mcc_total_removed_ads}"}
-    print(per_mcc_summary)
-    write_to_file(_PER_MCC_SUMMARY_TABLE_NAME, per_mcc_summary)
+        results = [audit_account(account) for account in accounts]
+    tallies = {}
+    for account, removed_ads_count in zip(accounts, results):
+        tally = tallies.setdefault(account["top_id"], Counter())
+        if removed_ads_count is None:
+            tally["failed_accounts"] += 1
+            continue
+        tally["top_mcc_total_ads_to_remove"] += removed_ads_count
+        if removed_ads_count > 0:
+            tally["accounts_with_ads_to_remove"] += 1
+        else:
+            tally["accounts_without_ads_to_remove"] += 1
+    return tallies
+
+
+def set_api_listener(scheduler):
+    """Reports the outcome of the API requests to the scheduler (None: to nobody)"""
+    if gAdsServiceWrapper is not None:
+        gAdsServiceWrapper.set_listener(scheduler)
+
+
+def plan_account_tasks(accounts):
+    """Returns the tasks of the accounts, largest (estimated) first: the accounts themselves, or
+    the parts of those estimated above --split_account_ads (see account_sizes)"""
+    sizes = estimate_account_sizes(accounts)
+    sized_tasks = []
+    for account in accounts:
+        size = sizes.get(account["account_id"])
+        tasks = split_account(account, size)
+        sized_tasks.extend((None if size is None else size / len(tasks), task) for task in tasks)
+    sized_tasks = order_largest_first(sized_tasks, lambda sized_task: sized_task[0])
+    logger.info("%d tasks for %d accounts (%d with a size estimate), largest first",
+                len(sized_tasks), len(accounts), sum(size is not None for size in sizes.values()))
+    return [task for _, task in sized_tasks]
+
+
+def estimate_account_sizes(accounts):
+    """Returns the estimated size (disapproved ads) of the accounts by id, None if unknown: their
+    size in the last sessions, or (-size_estimate count) the count of their disapproved ads.
+    Accounts completed by an earlier attempt of this session have nothing left to audit"""
+    if _ACCOUNT_SIZE_ESTIMATE == "none":
+        return {}
+    sizes = {}
+    for account in accounts:
+        account_id = account["account_id"]
+        if sessionJournal.get_completed_count(account_id) is not None:
+            sizes[account_id] = 0
+        else:
+            sizes[account_id] = accountSizes.get(account_id)
+    unknown_account_ids = [account_id for account_id, size in sizes.items() if size is None]
+    if _ACCOUNT_SIZE_ESTIMATE == "count" and unknown_account_ids and not _REPLAY_CAPTURE:
+        with metrics.time("size_estimate"), \
+                futures.ThreadPoolExecutor(max_workers=_MAX_WORKERS) as executor:
+            sizes.update(zip(unknown_account_ids,
+                             executor.map(count_disapproved_ads, unknown_account_ids)))
+    return sizes
+
+
+def count_disapproved_ads(account_id):
+    """Returns the number of disapproved ads of an account, or None if the count failed"""
+    try:
+        return gAdsServiceWrapper.count_disapproved_ads(account_id, _AD_TYPES)
+    except Exception as exception:  # pylint: disable=broad-except
+        logger.warning("Account id: %s: failed to count its ads, its size is unknown: %s",
+                       account_id, get_error_message(exception))
+        return None
+
+
+def split_account(account, size):
+    """Returns the tasks of an account of {size}: its parts (contiguous ranges of its campaigns)
+    if it is larger than --split_account_ads, else the account itself. Incremental, capture and
+    replay sessions do not split accounts"""
+    parts_count = get_parts_count(size, _SPLIT_ACCOUNT_ADS, _MAX_WORKERS)
+    if parts_count <= 1 or _INCREMENTAL_AUDIT or _CAPTURE_STREAMS or _REPLAY_CAPTURE:
+        return [account]
+    account_id = account["account_id"]
+    try:
+        campaign_ranges = split_campaign_ids(gAdsServiceWrapper.get_campaign_ids(account_id),
+                                             parts_count)
+    except Exception as exception:  # pylint: disable=broad-except
+        logger.warning("Account id: %s: failed to list its campaigns, it is not split: %s",
+                       account_id, get_error_message(exception))
+        return [account]
+    if len(campaign_ranges) <= 1:
+        return [account]
+    logger.info("Account id: %s: about %d disapproved ads, split in %d parts", account_id, size,
+                len(campaign_ranges))
+    metrics.increment("split_accounts")
+    metrics.increment("account_parts", len(campaign_ranges))
+    return SplitAccount(account, campaign_ranges).parts
+
+
+def run_account_task(task):
+    """Runs a task of plan_account_tasks"""
+    if isinstance(task, AccountPart):
+        return run_account_part(task)
+    return audit_account(task)
+
+
+def run_account_part(part):
+    """Audits a part of an account and, if it is the last of its parts to be done, completes the
+    account (see complete_split_account), so that it is journaled without waiting for the other
+    tasks"""
+    try:
+        result = audit_account_part(part)
+    except Exception as exception:  # pylint: disable=broad-except
+        result = exception
+    part_results = part.split_account.add_part_result(part, result)
+    if part_results is not None:
+        part.split_account.result = complete_split_account(part_results)
+    return result
+
+
+def collect_account_results(tasks, task_results):
+    """Returns the results of the accounts of the tasks by id, those of the split accounts as
+    completed by their last part"""
+    account_results = {}
+    for task, result in zip(tasks, task_results):
+        if isinstance(task, AccountPart):
+            account_results[task.account["account_id"]] = task.split_account.result
+        else:
+            account_results[task["account_id"]] = result
+    return account_results
+
+
+def audit_accounts_in_processes(top_key, accounts):
+    """Audits the accounts in worker processes, a shard of them each, and merges the tallies and
+    the metrics of the shards"""
+    tallies = {}
+    context = multiprocessing.get_context(_PROCESS_START_METHOD)
+    with futures.ProcessPoolExecutor(max_workers=_SHARD_PROCESSES, mp_context=context) as executor:
+        shard_results = [executor.submit(audit_shard, _SESSION_ARGS, CURRENT_SESSION_ID, top_key,
+                                         select_shard(accounts, shard_index, _SHARD_PROCESSES,
+                                                      PROCESS_SHARD_SALT),
+                                         (shard_index, _SHARD_PROCESSES)) for
+                         shard_index in range(1, _SHARD_PROCESSES + 1)]
+        for shard_result in shard_results:
+            shard_tallies, shard_metrics = shard_result.result()
+            for top_id, shard_tally in shard_tallies.items():
+                tallies.setdefault(top_id, Counter()).update(shard_tally)
+            metrics.merge(shard_metrics)
+    return tallies
+
+
+def audit_shard(args, session_id, top_key, accounts, process_shard):
+    """Runs in a worker process: audits a shard of the accounts with its own API clients, journal
+    and output files. Returns the tally of the shard and the metrics of the process"""
+    global CURRENT_SESSION_ID, _PROCESS_SHARD
+    configure(args)
+    CURRENT_SESSION_ID = session_id
+    _PROCESS_SHARD = process_shard
+    create_services(args, processes_count=process_shard[1])
+    metrics.reset()
+    start_session(top_key)
+    try:
+        tallies = audit_accounts(top_key, accounts)
+        sessionJournal.close(session_completed=True)
+    finally:
+        stop_session()
+        mutatePipeline.shutdown()
+    return tallies, metrics.snapshot()
+
+
+def write_per_mcc_summary(top_id, tally):
+    """Writes the per MCC summary of a top MCC (of this node's shard if sharded)"""
+    per_mcc_summary = add_session_identifiers_bq_columns(
+        {"account_id": top_id,
+         "accounts_with_ads_to_remove": tally["accounts_with_ads_to_remove"],
+         "accounts_without_ads_to_remove": tally["accounts_without_ads_to_remove"],
+         "top_mcc_total_ads_to_remove": tally["top_mcc_total_ads_to_remove"],
+         "total_sub_accounts": tally["accounts_with_ads_to_remove"] +
+                               tally["accounts_without_ads_to_remove"] + tally["failed_accounts"],
+         "failed_accounts": tally["failed_accounts"]})
+    if _SHARD is not None:
+        per_mcc_summary["shard"] = get_shard_text()
+    logger.info("%s", per_mcc_summary)
+    write_to_file(_PER_MCC_SUMMARY_TABLE_NAME, [per_mcc_summary])
     if _WRITE_TO_BQ:
-        bqServiceWrapper.upload_rows_to_bq(table_id=_PER_MCC_SUMMARY_TABLE_NAME, rows_to_insert=[
-            add_session_identifiers_bq_columns(
-                {"account_id": top_id, "accounts_with_ads_to_remove": accounts_with_removed_ads,
-                 "accounts_without_ads_to_remove": accounts_without_removed_ads,
-                 "top_mcc_total_ads_to_remove": top_mcc_total_removed_ads,
-                 "total_sub_accounts": accounts_with_removed_ads + accounts_without_removed_ads})])
+        upload_rows_to_bq(_PER_MCC_SUMMARY_TABLE_NAME, [per_mcc_summary])
 
 
 def flat_all_accounts(account_id, hierarchy):
     """Returns a list {id, hierarchy} for all the descendant accounts of a given MCC account"""
-    accounts = gAdsServiceWrapper.get_sub_accounts(False, account_id, hierarchy)
-    accounts.append({"account_id": account_id, "hierarchy": hierarchy})
-    sub_mccs = gAdsServiceWrapper.get_sub_accounts(True, account_id, hierarchy)
-    if len(sub_mccs) > 0:
-        for sub_mcc in sub_mccs:
-            accounts = accounts + flat_all_accounts(sub_mcc["account_id"], sub_mcc["hierarchy"])
+    discovery = AccountTreeDiscovery(gAdsServiceWrapper, resolve_parents=_RESOLVE_HIERARCHY)
+    with metrics.time("discovery"):
+        if _HIERARCHY_CACHE_TTL_HOURS > 0:
+            cache = AccountHierarchyCache(_CACHE_PATH, _HIERARCHY_CACHE_TTL_HOURS * 60 * 60)
+            tree = cache.get_tree(discovery, account_id, _FULL_HIERARCHY_REFRESH)
+        else:
+            tree = discovery.discover_tree(account_id)
+    metrics.increment("discovery_requests", discovery.requests_count)
+    accounts = tree.flat_accounts(hierarchy)
     return [add_session_identifiers_bq_columns(account) for account in accounts]
 
 
+def audit_account(account):
+    """Audits (and optionally removes) the ads of an account, isolating its failures from the
+    other accounts. Returns the number of ads found, or None if the account failed"""
+    start = time.perf_counter()
+    try:
+        return remove_disapproved_ads_for_account(account)
+    except Exception as exception:  # pylint: disable=broad-except
+        metrics.increment("failed_accounts")
+        audit_ads_after_remove(account["account_id"], 0, exception)
+        return None
+    finally:
+        metrics.observe("account_seconds", time.perf_counter() - start)
+
+
+def audit_account_part(part):
+    """Audits (and optionally removes) the ads of a part of an account. Returns the number of ads
+    found and not removed by this attempt (see scan_account). Its failures are raised: the
+    account is completed, or failed, by complete_split_account once all its parts ran"""
+    start = time.perf_counter()
+    try:
+        logger.info("Processing Account id: %s, campaigns %s to %s =============",
+                    part.account["account_id"], *part.campaign_range)
+        return scan_account(part.account, campaign_range=part.campaign_range)
+    finally:
+        part.seconds = time.perf_counter() - start
+
+
+def complete_split_account(part_results):
+    """Completes an account from the (part, result) of its parts. Returns the number of ads found,
+    or None if a part failed"""
+    account = part_results[0][0].account
+    metrics.observe("account_seconds", sum(part.seconds for part, _ in part_results))
+    for _, result in part_results:
+        if isinstance(result, Exception):
+            metrics.increment("failed_accounts")
+            audit_ads_after_remove(account["account_id"], 0, result)
+            return None
+    return complete_account(account["account_id"], sum(result for _, result in part_results))
+
+
 def remove_disapproved_ads_for_account(account):
     """Remove all disapproved ads for a given customer id"""
     account_id = account["account_id"]
-    ad_removal_operations = []
-    ads_to_remove_json = []
-    rows = gAdsServiceWrapper.get_disapproved_ads_for_account(account_id)
-    ads_to_remove_count = 0
-    print(f"\nProcessing Account id: {account_id} =============")
-
-    for batch in rows:
-        for row in batch.results:
-            ad_group_ad = row.ad_group_ad
-            campaign_id = row.campaign.id
-            ad = ad_group_ad.ad
-            policy_summary = ad_group_ad.policy_summary
-            current_topics = [entry.topic.lower() for entry in policy_summary.policy_topic_entries]
-            if has_included_topic(current_topics, _INCLUDED_TOPICS_SUBSTRINGS,
-                                  _EXCLUDED_TOPICS_SUBSTRINGS):
-                ads_to_remove_count += 1
-                print('** A suspension topic, will be removed')
-                print(f'\ttopics: "{current_topics}"')
-                ad_json = get_ad_hierarchy(account, campaign_id, ad_group_ad, ad)
-                ad_json["policy_topics"] = str(current_topics)
-                ad_json["evidences"] = str(get_policy_extra(policy_summary))
-                populate_ad_json_mandatory_data(ad_json, ad_group_ad, ad)
-                ads_to_remove_json.append(ad_json)
-                if _REMOVE_ADS:
-                    ad_removal_operations.append(
-                        build_ad_removal_sync_operation(account_id, ad_json["ad_group_id"],
-                                                        row.ad_group_ad.ad.id))
+    completed_count = sessionJournal.get_completed_count(account_id)
+    if completed_count is not None:
+        logger.info("Account id: %s was already processed in this session", account_id)
+        return completed_count
+    logger.info("Processing Account id: %s =============", account_id)
+    ad_groups = get_changed_ad_groups(account_id)
+    if ad_groups is not None and not ad_groups:
+        logger.info("No ad changed since the last audit")
+        ads_to_remove_count = 0
+    else:
+        ads_to_remove_count = scan_account(account, ad_groups)
+    return complete_account(account_id, ads_to_remove_count)
 
+
+def scan_account(account, ad_groups=None, campaign_range=None):
+    """Audits (and optionally removes) the disapproved ads of an account (only in {ad_groups} or
+    in the campaigns of {campaign_range} if given). Returns the number of ads found and not
+    removed by this scan: the removed ones are counted with all those removed in the session, by
+    complete_account"""
+    if _STREAMING_MODE:
+        return stream_disapproved_ads_for_account(account, ad_groups, campaign_range)
+    account_id = account["account_id"]
+    ads_to_remove_json = list(get_ads_to_remove(account, ad_groups, campaign_range))
+    ads_to_remove_count = len(ads_to_remove_json)
     if len(ads_to_remove_json) > 0:
         ads_to_remove_json = audit_ads_before_remove(ads_to_remove_json)
-    if len(ad_removal_operations) > 0:
-        remove_ads(ad_removal_operations, ads_to_remove_json, account_id)
+        if _REMOVE_ADS:
+            ads_to_remove_count -= remove_ads(
+                build_ad_removal_sync_operations(account_id, ads_to_remove_json),
+                ads_to_remove_json, account_id)
+    return ads_to_remove_count
+
+
+def complete_account(account_id, ads_to_remove_count):
+    """Writes the summary of an audited account and records it as completed. Returns its number
+    of ads found"""
+    # The removed ads are not found anymore by the later attempts, they are all counted here
+    ads_to_remove_count += sessionJournal.get_removed_count(account_id)
     audit_ads_after_remove(account_id, ads_to_remove_count)
+    sessionJournal.record_account_completed(account_id, ads_to_remove_count)
+    if changeWatermarks is not None:
+        changeWatermarks.mark_audited(account_id)
     return ads_to_remove_count
 
 
+def get_changed_ad_groups(account_id):
+    """Returns the ad groups to scan in an incremental audit, or None to scan the whole account"""
+    if changeWatermarks is None:
+        return None
+    change_window = changeWatermarks.get_change_window(account_id)
+    if change_window is None:
+        return None
+    ad_groups = gAdsServiceWrapper.get_changed_ad_groups(account_id, *change_window)
+    if ad_groups is None or len(ad_groups) > _MAX_CHANGED_AD_GROUPS:
+        return None
+    return ad_groups
+
+
+def stream_disapproved_ads_for_account(account, ad_groups=None, campaign_range=None):
+    """Audits (and optionally removes) the disapproved ads of an account chunk by chunk, while
+    they are streamed, so only one chunk is held in memory. Returns the number of ads found and
+    not removed, see scan_account"""
+    account_id = account["account_id"]
+    ads_to_remove_count = 0
+    # Either each chunk is removed right after it is audited, or all the ads of the account are
+    # audited first and spilled to disk, then removed once the stream is done.
+    spill_buffer = SpillBuffer() if _REMOVE_ADS and _AUDIT_ALL_BEFORE_REMOVE else None
+    try:
+        with start_ads_removal(account_id) as ads_removal:
+            for ads_chunk in chunked(get_ads_to_remove(account, ad_groups, campaign_range),
+                                     _CHUNK_SIZE):
+                ads_to_remove_count += len(ads_chunk)
+                ads_chunk = audit_ads_before_remove(ads_chunk)
+                if spill_buffer is not None:
+                    spill_buffer.extend(ads_chunk)
+                elif _REMOVE_ADS:
+                    ads_removal.submit(build_ad_removal_sync_operations(account_id, ads_chunk),
+                                       ads_chunk)
+            if spill_buffer is not None:
+                for ads_chunk in spill_buffer.chunks(_CHUNK_SIZE):
+                    ads_removal.submit(build_ad_removal_sync_operations(account_id, ads_chunk),
+                                       ads_chunk)
+    finally:
+        if spill_buffer is not None:
+            spill_buffer.close()
+    return ads_to_remove_count - ads_removal.handled_count
+
+
+def get_ads_to_remove(account, ad_groups=None, campaign_range=None):
+    """Yields the AdRecord of every disapproved ad with a relevant topic (only in {ad_groups} or
+    in the campaigns of {campaign_range} if given), batch by batch as they are streamed. The
+    streamed rows of a full scan are recorded as the size of the account"""
+    batches = iter(get_disapproved_ads_batches(account["account_id"], ad_groups, campaign_range))
+    rows_count = 0
+    while True:
+        with metrics.time("stream_read"):
+            batch = next(batches, None)
+        if batch is None:
+            break
+        rows_count += len(batch.results)
+        metrics.increment("stream_batches")
+        metrics.increment("stream_rows", len(batch.results))
+        metrics.increment("stream_bytes", type(batch).pb(batch).ByteSize())
+        with metrics.time("convert"):
+            ad_records = _AD_RECORD_EXTRACTOR.extract(batch, account)
+        metrics.increment("ads_to_remove", len(ad_records))
+        log_ad_records(account, batch, ad_records)
+        yield from ad_records
+    # A replay reads a past capture: the sizes it sees may be outdated
+    if ad_groups is None and accountSizes is not None and not _REPLAY_CAPTURE:
+        accountSizes.record(account["account_id"], rows_count, campaign_range)
+
+
+def log_ad_records(account, batch, ad_records):
+    """Logs every relevant ad at DEBUG level, otherwise a summary of the batch with its most
+    common topics"""
+    if logger.isEnabledFor(logging.DEBUG):
+        for ad_record in ad_records:
+            logger.debug('** A suspension topic, will be removed\n\ttopics: "%s"\n\tevidences: %s',
+                         ad_record.policy_topics, ad_record.evidences)
+    elif ad_records:
+        top_topics = Counter(ad_record.policy_topics for ad_record in
+                             ad_records).most_common(_LOGGED_TOP_TOPICS)
+        logger.info("Account id: %s: %d of %d streamed ads have a suspension topic, will be "
+                    "removed. Top topics: %s", account["account_id"], len(ad_records),
+                    len(batch.results), top_topics)
+
+
+def get_disapproved_ads_batches(account_id, ad_groups=None, campaign_range=None):
+    """Returns the stream of the disapproved ads batches of an account (only in {ad_groups} or in
+    the campaigns of {campaign_range} if given), from the API (captured if in capture mode) or
+    from its capture in replay mode"""
+    if _REPLAY_CAPTURE:
+        return streamCapture.replay(account_id)
+    batches = gAdsServiceWrapper.get_disapproved_ads_for_account(account_id, _AD_TYPES, _IDS_ONLY,
+                                                                 ad_groups, campaign_range)
+    if _CAPTURE_STREAMS:
+        return streamCapture.record(account_id, batches)
+    return batches
+
+
 def add_session_identifiers_bq_columns(item):
     """Adds session identifiers BQ columns"""
     item["timestamp"] = "AUTO"
@@ -223,151 +817,126 @@ def add_bq_columns_to_ad(ad_removal_item, status):
     return ad_removal_item
 
 
-def audit_ads_after_remove(account_id, ads_to_remove_count):
-    """Audits ads after removal"""
-    data = {f"\nAccount-id: {account_id} ============= Finished Processing. # relevant disapproved "
-            f"ads found: {str(ads_to_remove_count)}"}
-    write_to_file(_PER_ACCOUNT_SUMMARY_TABLE_NAME, data)
+def audit_ads_after_remove(account_id, ads_to_remove_count, exception=None):
+    """Audits ads after removal, or the failure of the account"""
+    per_account_summary = {"account_id": account_id, "ads_to_remove_count": ads_to_remove_count}
+    if exception is None:
+        logger.info("Account-id: %s ============= Finished Processing. # relevant disapproved "
+                    "ads found: %d", account_id, ads_to_remove_count)
+    else:
+        if is_google_ads_exception(exception):
+            handle_googleads_exception(exception)
+        per_account_summary["error"] = get_error_message(exception)
+        logger.warning("Account-id: %s ============= Failed: %s", account_id,
+                       per_account_summary['error'])
+    add_session_identifiers_bq_columns(per_account_summary)
+    write_to_file(_PER_ACCOUNT_SUMMARY_TABLE_NAME, [per_account_summary])
     if _WRITE_TO_BQ:
-        bqServiceWrapper.upload_rows_to_bq(table_id=_PER_ACCOUNT_SUMMARY_TABLE_NAME,
-                                           rows_to_insert=[add_session_identifiers_bq_columns(
-                                               {"account_id": account_id,
-                                                "ads_to_remove_count": ads_to_remove_count})])
+        upload_rows_to_bq(_PER_ACCOUNT_SUMMARY_TABLE_NAME, [per_account_summary])
 
 
-def audit_ads_before_remove(ads_to_be_removed_json):
-    """Audits ads before removal"""
-    ads_to_be_removed_json = [add_bq_columns_to_ad(ad_removal_item, BowlingStatus.SCANNED.name) for
-                              ad_removal_item in ads_to_be_removed_json]
+def audit_ads_before_remove(ad_records):
+    """Audits ads before removal and returns their AdsToRemove rows"""
+    ads_to_be_removed_json = [add_bq_columns_to_ad(ad_record.to_row(), BowlingStatus.SCANNED.name)
+                              for ad_record in ad_records]
     write_to_file(_ADS_TO_REMOVE_TABLE_NAME, ads_to_be_removed_json)
     if _WRITE_TO_BQ:
-        bqServiceWrapper.upload_rows_to_bq(table_id=_ADS_TO_REMOVE_TABLE_NAME,
-                                           rows_to_insert=ads_to_be_removed_json)
+        upload_rows_to_bq(_ADS_TO_REMOVE_TABLE_NAME, ads_to_be_removed_json)
     return ads_to_be_removed_json
 
 
-def get_full_output_path(file_name):
-    """Return full output path"""
-    return Path(f"{_OUTPUT_PATH}/{file_name}_{time.strftime('%Y%m%d-%H%M%S')}.json")
+def start_output_sinks():
+    """Opens a single output file (sink) per table for the whole session"""
+    file_time = time.strftime('%Y%m%d-%H%M%S')
+    for table_id in _TABLE_NAMES:
+        outputSinks[table_id] = NdjsonSink(
+            _OUTPUT_PATH, f"{table_id}_{file_time}_{CURRENT_SESSION_ID[:8]}"
+                          f"{get_shard_suffix(_SHARD, _PROCESS_SHARD)}",
+            compress=_GZIP_OUTPUT, max_file_bytes=_MAX_OUTPUT_FILE_MB * 1024 * 1024)
 
 
-def write_to_file(file, content):
-    """Writes to file"""
-    with open(get_full_output_path(file), 'a') as file_object:
-        file_object.write(
-            "\n" + json.dumps(content, default=lambda x: list(x) if isinstance(x, set) else x))
+def stop_output_sinks():
+    """Flushes and closes the output files"""
+    for output_sink in outputSinks.values():
+        output_sink.close()
+    outputSinks.clear()
 
 
-def get_policy_extra(policy_summary):
-    """Returns 'Policy Extra' data"""
-    evidence_array = []
-    # Display the policy topic entries related to the ad disapproval.
-    for entry in policy_summary.policy_topic_entries:
-        print(f'\ttopic: "{entry.topic}", type "{entry.type_.name}"')
-        # Display the attributes and values that triggered the policy
-        # topic.
-        evidence_array_per_entry = []
-        for evidence in entry.evidences:
-            for index, text in enumerate(evidence.text_list.texts):
-                evidence_array_per_entry.append(f"\t\tevidence text[{index}]: {text}")
-        evidence_array.append(
-            {"topic": entry.topic, "type": entry.type_.name, "array": evidence_array_per_entry})
-    return evidence_array
+def write_to_file(file, records):
+    """Appends records to the table's output file, one json record per line"""
+    with metrics.time("file_write"):
+        outputSinks[file].write(records)
 
 
 def populate_errors(failed_items, errors):
-    """Populate ads with corresponding removal errors"""
-    for item, error in zip(failed_items, errors):
-        item["bowling_status"] = {BowlingStatus.FAILED_TO_REMOVE.name}
-        item["removal_error"] = error
+    """Populate ads with corresponding removal errors (a list of errors per ad)"""
+    for item, item_errors in zip(failed_items, errors):
+        item["bowling_status"] = BowlingStatus.FAILED_TO_REMOVE.name
+        item["removal_error"] = str(item_errors[0] if len(item_errors) == 1 else item_errors)
 
 
 def update_status_removed(removed_items):
     """Update ads with status removed"""
     for item in removed_items:
-        item["bowling_status"] = {BowlingStatus.REMOVED.name}
+        item["bowling_status"] = BowlingStatus.REMOVED.name
 
 
 def remove_ads(removal_operations, removal_json, account_id):
-    """Removes ads"""
-    operations_chucks = split(removal_operations, _CHUNK_SIZE)
-    json_request_chunks = split(removal_json, _CHUNK_SIZE)
-    for chunk_index, operations_chuck in enumerate(operations_chucks):
-        try:
-            response_chunk = send_bulk_mutate_request(account_id, operations_chuck)
-        except GoogleAdsException as exception:
-            handle_googleads_exception(exception)
-        else:
-            # Remove succeeded
-            index_array, error_array = _print_results(response_chunk)
-            removed_items = json_request_chunks[chunk_index]
-            failed_items = take_out_elements(removed_items, index_array)
-            update_status_removed(failed_items)
-            populate_errors(failed_items, error_array)
-            all_items = removed_items + failed_items
-            write_to_file(_ADS_TO_REMOVE_TABLE_NAME, all_items)
-            if _WRITE_TO_BQ:
-                bqServiceWrapper.upload_rows_to_bq(table_id=_ADS_TO_REMOVE_TABLE_NAME,
-                                                   rows_to_insert=all_items)
-
-
-def get_ad_hierarchy(account, campaign_id, ad_group_ad, ad):
-    """Returns ad hierarchy"""
-    match_groups = re.match(r"customers/(\w+)/adGroups/(\w+)", ad_group_ad.ad_group)
-    if match_groups is not None:
-        ad_group_id = match_groups.group(2)
-    else:
-        ad_group_id = ad_group_ad.ad_group
-    return {"hierarchy": account["hierarchy"], "account_id": account["account_id"],
-            "campaign_id": campaign_id, "ad_group_id": ad_group_id, "ad_id": ad.id,
-            "ad_type": ad.type_.name, "final_urls": ', '.join(ad_group_ad.ad.final_urls)}
-
-
-def populate_ad_json_mandatory_data(ad_json, ad_group_ad, ad):
-    """Populates ad json with 'mandatory_data' """
-    if ad.type_.name.upper() == "TEXT_AD":
-        mandatory_data = {"ad.text_ad.headline": ad.text_ad.headline,
-                          "desc1": ad.text_ad.description1, "desc2": ad.text_ad.description2}
-    elif ad.type_.name.upper() == "EXPANDED_TEXT_AD":
-        mandatory_data = {
-            'ad_group_ad.ad.expanded_text_ad.description':
-                ad_group_ad.ad.expanded_text_ad.description,
-            'ad_group_ad.ad.expanded_text_ad.description2':
-                ad_group_ad.ad.expanded_text_ad.description2,
-            'ad_group_ad.ad.expanded_text_ad.headline_part1':
-                ad_group_ad.ad.expanded_text_ad.headline_part1,
-            'ad_group_ad.ad.expanded_text_ad.headline_part2':
-                ad_group_ad.ad.expanded_text_ad.headline_part2,
-            'ad_group_ad.ad.expanded_text_ad.headline_part3':
-                ad_group_ad.ad.expanded_text_ad.headline_part3}
-    elif ad.type_.name.upper() == "RESPONSIVE_SEARCH_AD":
-        mandatory_data = {"ad_group_ad.ad.responsive_search_ad.headlines": extract_text_from_proto(
-            ad_group_ad.ad.responsive_search_ad.headlines),
-            "ad_group_ad.ad.responsive_search_ad.descriptions": extract_text_from_proto(
-                ad_group_ad.ad.responsive_search_ad.descriptions),
-            "ad_group_ad.ad.responsive_search_ad.path1": ad_group_ad.ad.responsive_search_ad.path1,
-            "ad_group_ad.ad.responsive_search_ad.path2": ad_group_ad.ad.responsive_search_ad.path2}
+    """Removes ads, with several chunks in flight. Returns the number of removed ads"""
+    with start_ads_removal(account_id) as ads_removal:
+        for operations_chuck, json_request_chunk in zip(split(removal_operations, _CHUNK_SIZE),
+                                                        split(removal_json, _CHUNK_SIZE)):
+            ads_removal.submit(operations_chuck, json_request_chunk)
+    return ads_removal.handled_count
+
+
+def start_ads_removal(account_id):
+    """Returns an AccountMutates sending the removal chunks of an account on the session's
+    mutate pipeline"""
+    return mutatePipeline.account(account_id, handle_removal_response, _MUTATE_CHUNKS_IN_FLIGHT)
+
+
+def handle_removal_response(ads_chunk, response_future):
+    """Audits the ads of a removal chunk, once its mutate request is done. Returns the number of
+    removed ads"""
+    try:
+        response_chunk = response_future.result()
+    except Exception as exception:  # pylint: disable=broad-except
+        if not is_google_ads_exception(exception):
+            raise  # Fails the account
+        # The chunk failed (after the retries of transient and quota errors), the next chunks
+        # go on
+        handle_googleads_exception(exception)
+        removed_items = []
+        failed_items = ads_chunk
+        populate_errors(failed_items, [[get_error_message(exception)]] * len(failed_items))
     else:
-        mandatory_data = {"type": ad.type_.name.upper()}
-    ad_json["mandatory_data"] = str(mandatory_data)
-
-
-def extract_text_from_proto(proto_list):
-    """Extracts text from proto"""
-    values = []
-    for item in proto_list:
-        if item.pinned_field:
-            values.append("%s: %s" % (item.pinned_field, item.text))
-        else:
-            values.append("%s" % item.text)
-    return values
+        # Remove succeeded
+        index_array, error_array = _print_results(response_chunk)
+        # An operation index (= ad index in the chunk) may come with several errors
+        errors_per_index = {}
+        for index, error in zip(index_array, error_array):
+            errors_per_index.setdefault(index, []).append(error)
+        removed_items = [item for index, item in enumerate(ads_chunk) if
+                         index not in errors_per_index]
+        failed_indices = sorted(index for index in errors_per_index if index < len(ads_chunk))
+        failed_items = [ads_chunk[index] for index in failed_indices]
+        update_status_removed(removed_items)
+        populate_errors(failed_items, [errors_per_index[index] for index in failed_indices])
+    all_items = removed_items + failed_items
+    write_to_file(_ADS_TO_REMOVE_TABLE_NAME, all_items)
+    if _WRITE_TO_BQ:
+        upload_rows_to_bq(_ADS_TO_REMOVE_TABLE_NAME, all_items)
+    if removed_items:
+        sessionJournal.record_chunk_removed(removed_items[0]["account_id"], len(removed_items))
+    return len(removed_items)
 
 
 def load_included_topics():
     """Loads topics non crucial list (exclusion list)"""
     with open(_TOPICS_FILE, encoding='utf-8-sig') as file_object:
         substring_inclusion_list = json.load(file_object)["only_these_substrings"]
-        print(substring_inclusion_list)
+        logger.info("Inclusion topics substrings: %s", substring_inclusion_list)
         return substring_inclusion_list
 
 
@@ -375,25 +944,14 @@ def load_excluded_topics():
     """Loads topics non crucial list (exclusion list)"""
     with open(_TOPICS_FILE, encoding='utf-8-sig') as file_object:
         substring_exclusion_list = json.load(file_object)["anything_but_these_substrings"]
-        print(substring_exclusion_list)
+        logger.info("Exclusion topics substrings: %s", substring_exclusion_list)
         return substring_exclusion_list
 
 
-def has_included_topic(current_topics, inclusion_topics_substrings, exclusion_topics_substrings):
-    """Checks if the topic list contains a critical topic"""
-    for current_topic in current_topics:
-        if is_included_topic(current_topic, inclusion_topics_substrings, True) or is_included_topic(
-            current_topic, exclusion_topics_substrings, False):
-            return True
-    return False
-
-
-def is_included_topic(current_topic, topics_substrings, isInclusionList):
-    """Checks if a given topic is critical"""
-    for topic_substring in topics_substrings:
-        if topic_substring in current_topic:
-            return isInclusionList
-    return not isInclusionList
+def build_ad_removal_sync_operations(account_id, ads_json):
+    """Builds the removal operations of the given ads"""
+    return [build_ad_removal_sync_operation(account_id, ad_json["ad_group_id"], ad_json["ad_id"])
+            for ad_json in ads_json]
 
 
 def build_ad_removal_sync_operation(account_id, ad_group_id, ad_id):
@@ -412,7 +970,7 @@ def send_bulk_mutate_request(account_id, operations):
     request.customer_id = account_id
     request.operations = operations
     request.partial_failure = True
-    return gAdsServiceWrapper.ad_group_ad_service.mutate_ad_group_ads(request=request)
+    return gAdsServiceWrapper.mutate_ad_group_ads(request)
 
 
 # [START handle_partial_failure_1]
@@ -439,7 +997,7 @@ def _print_results(response):
 
     # Check for existence of any partial failures in the response.
     if _is_partial_failure_error_present(response):
-        print("Partial failures occurred. Details will be shown below.\n")
+        logger.info("Partial failures occurred. Details will be shown below.")
         # Prints the details of the partial failure errors.
         partial_failure = getattr(response, "partial_failure_error", None)
         # partial_failure_error.details is a repeated field and iterable
@@ -457,25 +1015,26 @@ def _print_results(response):
                 # Construct and print a string that details which element in
                 # the above ad_group_operations list failed (by index number)
                 # as well as the error message and error code.
-                print("A partial failure at index "
-                      f"{error.location.field_path_elements[0].index} occurred "
-                      f"\nError message: {error.message}\nError code: "
-                      f"{error.error_code}")
+                logger.warning("A partial failure at index %d occurred\nError message: %s\n"
+                               "Error code: %s", error.location.field_path_elements[0].index,
+                               error.message, error.error_code)
                 index_array.append(error.location.field_path_elements[0].index)
                 error_array.append(
                     {"error_message": str(error.message), "error_code": str(error.error_code)})
-    else:
-        print("All operations completed successfully. No partial failure "
-              "to show.")
 
     # In the list of results, operations from the ad_group_operation list
     # that failed will be represented as empty messages. This loop detects
-    # such empty messages and ignores them, while printing information about
-    # successful operations.
+    # such empty messages and ignores them, while logging information about
+    # successful operations (per ad at DEBUG level only).
+    removed_count = 0
+    log_removed_ads = logger.isEnabledFor(logging.DEBUG)
     for message in response.results:
         if not message:
             continue
-        print(f"Removed ad group ad with resource_name: {message.resource_name}.")
+        removed_count += 1
+        if log_removed_ads:
+            logger.debug("Removed ad group ad with resource_name: %s.", message.resource_name)
+    logger.info("Removed %d ads, %d partial failures", removed_count, len(index_array))
     return index_array, error_array
 
 
@@ -484,18 +1043,122 @@ def handle_googleads_exception(exception):
     Args:
         exception: an instance of GoogleAdsException.
     """
-    print(f'Request with ID "{exception.request_id}" failed with status '
-          f'"{exception.error.code().name}" and includes the following errors:')
+    lines = [f'Request with ID "{exception.request_id}" failed with status '
+             f'"{exception.error.code().name}" and includes the following errors:']
     for error in exception.failure.errors:
-        print(f'\tError with message "{error.message}".')
+        lines.append(f'\tError with message "{error.message}".')
         if error.location:
             for field_path_element in error.location.field_path_elements:
-                print(f"\t\tOn field: {field_path_element.field_name}")
-    sys.exit(1)
+                lines.append(f"\t\tOn field: {field_path_element.field_name}")
+    logger.error("\n".join(lines))
+
+
+def start_bq_writers():
+    """Starts a BQ writer per table: streaming inserts, or load jobs at the end of the session"""
+    if _BQ_INGESTION == "load":
+        create_results_folder(_STAGING_PATH)
+    for table_id in _TABLE_NAMES:
+        if _BQ_INGESTION == "load":
+            bqWriters[table_id] = BqLoadJobWriter(bqServiceWrapper, table_id, _STAGING_PATH)
+        else:
+            bqWriters[table_id] = BqBackgroundWriter(bqServiceWrapper, table_id)
+
+
+def stop_bq_writers():
+    """Inserts all the queued rows and stops the background BQ writers"""
+    for bq_writer in bqWriters.values():
+        bq_writer.close()
+    bqWriters.clear()
+
+
+def upload_rows_to_bq(table_id, rows_to_insert):
+    """Queues rows to be inserted to BQ by the table's background writer"""
+    with metrics.time("bq_enqueue"):
+        bqWriters[table_id].add_rows(rows_to_insert)
+    metrics.observe_max("bq_pending_rows", bqWriters[table_id].pending_rows)
+
+
+def update_latest_status():
+    """Merges the rows of the session into the latest status per ad table"""
+    from google.api_core.exceptions import GoogleAPIError  # pylint: disable=import-outside-toplevel
+    try:
+        bqServiceWrapper.update_latest_status(_ADS_TO_REMOVE_TABLE_NAME,
+                                              _ADS_LATEST_STATUS_TABLE_NAME, _AD_KEY_FIELDS)
+    except GoogleAPIError as ex:
+        # E.g. a concurrent merge of another shard; the next session catches up
+        logger.warning("Failed to update %s: %s", _ADS_LATEST_STATUS_TABLE_NAME, ex)
+
+
+def rollup_session_in_bq():
+    """Rolls the session up into AccountRollup and MccRollup, reading its rows in BQ"""
+    from google.api_core.exceptions import GoogleAPIError  # pylint: disable=import-outside-toplevel
+    since = datetime.now(timezone.utc) - timedelta(days=_ROLLUP_LOOKBACK_DAYS)
+    try:
+        bqServiceWrapper.merge_account_rollup(_ACCOUNT_ROLLUP_TABLE_NAME, _ALL_ACCOUNTS_TABLE_NAME,
+                                              _ADS_TO_REMOVE_TABLE_NAME,
+                                              _PER_ACCOUNT_SUMMARY_TABLE_NAME, CURRENT_SESSION_ID,
+                                              since)
+        bqServiceWrapper.insert_mcc_rollup(_MCC_ROLLUP_TABLE_NAME, _ACCOUNT_ROLLUP_TABLE_NAME,
+                                           CURRENT_SESSION_ID, since, get_shard_text())
+    except GoogleAPIError as ex:
+        logger.warning("Failed to roll up session %s: %s", CURRENT_SESSION_ID, ex)
+
+
+def rollup_session_files_locally():
+    """Rolls the session up from its output files into AccountRollup and MccRollup files"""
+    session_rollup = rollup_session_files(_OUTPUT_PATH, CURRENT_SESSION_ID,
+                                          _ALL_ACCOUNTS_TABLE_NAME, _ADS_TO_REMOVE_TABLE_NAME,
+                                          _PER_ACCOUNT_SUMMARY_TABLE_NAME)
+    timestamp = datetime.now(timezone.utc).isoformat()
+    file_time = time.strftime('%Y%m%d-%H%M%S')
+    for table_id, rows in ((_ACCOUNT_ROLLUP_TABLE_NAME,
+                            session_rollup.get_account_rollups(timestamp)),
+                           (_MCC_ROLLUP_TABLE_NAME,
+                            session_rollup.get_mcc_rollups(timestamp, get_shard_text()))):
+        rollup_sink = NdjsonSink(_OUTPUT_PATH, f"{table_id}_{file_time}_{CURRENT_SESSION_ID[:8]}"
+                                               f"{get_shard_suffix(_SHARD)}",
+                                 compress=_GZIP_OUTPUT)
+        rollup_sink.write(rows)
+        rollup_sink.close()
+        logger.info("Rolled up %d rows to %s", len(rows), rollup_sink.get_full_output_path())
+
+
+def get_shard_text():
+    """Returns the shard of this node as "K/N", or None if not sharded"""
+    return None if _SHARD is None else f"{_SHARD[0]}/{_SHARD[1]}"
+
+
+def compact_bq_tables():
+    """Brings the latest status per ad up to date, then deletes the SCANNED rows of AdsToRemove
+    which a newer row of the same ad supersedes, in the partitions of the last
+    _BQ_COMPACTION_DAYS days (all of them if 0) but not in the streaming buffer"""
+    bqServiceWrapper.update_latest_status(_ADS_TO_REMOVE_TABLE_NAME,
+                                          _ADS_LATEST_STATUS_TABLE_NAME, _AD_KEY_FIELDS)
+    now = datetime.now(timezone.utc)
+    since = now - timedelta(days=_BQ_COMPACTION_DAYS) if _BQ_COMPACTION_DAYS else \
+        datetime(1970, 1, 1, tzinfo=timezone.utc)
+    bqServiceWrapper.compact_outdated_rows(_ADS_TO_REMOVE_TABLE_NAME,
+                                           _ADS_LATEST_STATUS_TABLE_NAME, _AD_KEY_FIELDS,
+                                           BowlingStatus.SCANNED, since,
+                                           now - timedelta(minutes=_STREAMING_BUFFER_MINUTES))
+
+
+def maintain_bq_tables():
+    """Runs the BQ maintenance of a session (the tables check, the compaction with -clean_bq and
+    the latest status update) without the session"""
+    wait_for_bq_bootstrap()
+    if _CLEAN_OUTDATED_BQ:
+        compact_bq_tables()  # Which updates the latest status first
+    else:
+        update_latest_status()
 
 
 def delete_tables():
     """Deletes BQ tables"""
+    get_schema_marker().clear()
+    bqServiceWrapper.delete_table(_ADS_LATEST_STATUS_TABLE_NAME)
+    bqServiceWrapper.delete_table(_ACCOUNT_ROLLUP_TABLE_NAME)
+    bqServiceWrapper.delete_table(_MCC_ROLLUP_TABLE_NAME)
     bqServiceWrapper.delete_table(_PER_MCC_SUMMARY_TABLE_NAME)
     bqServiceWrapper.delete_table(_ADS_TO_REMOVE_TABLE_NAME)
     bqServiceWrapper.delete_table(_ALL_ACCOUNTS_TABLE_NAME)
@@ -507,42 +1170,264 @@ def create_results_folder(output_path):
     Path(output_path).mkdir(parents=True, exist_ok=True)
 
 
-if __name__ == "__main__":
+def create_services(args, processes_count=1, bootstrap_bq_tables=False):
+    """Creates the API clients of this process. With {processes_count} worker processes, each one
+    gets its share of the rate limits. With {bootstrap_bq_tables}, the BQ client and tables are
+    set up in the background meanwhile (see start_bq_bootstrap)"""
+    global bqServiceWrapper, gAdsServiceWrapper, mutatePipeline
+    if _WRITE_TO_BQ:
+        if bootstrap_bq_tables:
+            start_bq_bootstrap(args.delete_db)
+        else:
+            # pylint: disable=import-outside-toplevel
+            from bq_connector import BqServiceWrapper
+            bqServiceWrapper = BqServiceWrapper(_DS_ID, check_dataset=False)
+    # A replay runs offline, without the API (nor its configuration), and so does a BQ maintenance
+    # run.
+    gAdsServiceWrapper = None if _REPLAY_CAPTURE or _BQ_MAINTENANCE_ONLY else \
+        GAdsServiceWrapper(args.top_id[0], read_qps=args.read_qps / processes_count,
+                           mutate_qps=args.mutate_qps / processes_count,
+                           max_retries=args.max_retries, channels=args.grpc_channels)
+    mutatePipeline = MutatePipeline(send_bulk_mutate_request, args.mutate_concurrency)
+
+
+def parse_args(argv=None):
+    """Parses the command line flags"""
     parser = argparse.ArgumentParser(description="Lists disapproved ads for a given top MCC")
-    parser.add_argument("-id", "--top_id", type=str, required=True,
-                        help="The Google Ads top mcc ID.", )
+    parser.add_argument("-id", "--top_id", type=str, nargs="+", required=True,
+                        help="The Google Ads top mcc ID, or several of them (separated by spaces "
+                             "or commas). An account under several of them is audited once.", )
     parser.add_argument("-seq", "--sequential", action="store_true",
                         help="Runs multiple accounts in parallel.", )
     parser.add_argument("-rm", "--remove_ads", action="store_true",
                         help="Should remove disapproved ads.", )
     parser.add_argument("-bq", "--write_to_bq", action="store_true",
                         help="Write output to BQ in addition to a local file.", )
+    parser.add_argument("-bq_ingestion", "--bq_ingestion", choices=["streaming", "load"],
+                        default="streaming",
+                        help="streaming: insert rows as they come. load: stage rows in local "
+                             "files and load them at the end of the session.", )
+    parser.add_argument("-resume", "--resume", type=str, metavar="SESSION_ID",
+                        help="Resumes a failed session: skips its completed accounts and "
+                             "continues its partially removed ones.", )
+    parser.add_argument("-session_id", "--session_id", type=str, metavar="SESSION_ID",
+                        help="The id of the session (default: a new one). Give the same id to the "
+                             "N nodes of a -shard run, so their rows form a single session.", )
     parser.add_argument("-ddb", "--delete_db", action="store_true", help="Delete DB tables.", )
     parser.add_argument("-clean_bq", "--clean_outdated_bq", action="store_true",
-                        help="Clean outdated rows in BQ.", )
-
-    args = parser.parse_args()
+                        help="Deletes the SCANNED rows of AdsToRemove superseded by a newer row "
+                             "of the same ad, before the session.", )
+    parser.add_argument("-bq_maintenance", "--bq_maintenance_only", action="store_true",
+                        help="Only runs the BQ maintenance (-ddb, the tables check, -clean_bq and "
+                             "the latest status update) and exits, without a session nor the "
+                             "Google Ads client.", )
+    parser.add_argument("-verify_schema", "--verify_bq_schema", action="store_true",
+                        help="Checks the BQ dataset and tables even if the local schema marker "
+                             "shows that they were already verified.", )
+    parser.add_argument("-compaction_days", "--bq_compaction_days", type=int, default=7,
+                        help="With -clean_bq, only compact the partitions of the last that many "
+                             "days. 0 = all of them (e.g. for a first compaction).", )
+    parser.add_argument("-rollup", "--session_rollup", choices=["bq", "local", "none"],
+                        help="At the end of the session, roll it up per account and per top MCC "
+                             "(for the report). bq (default with -bq): in the BQ rollup tables. "
+                             "local (default without -bq): from the output files to rollup "
+                             "files, without BQ. none: no rollup.", )
+    parser.add_argument("-gzip", "--gzip_output", action="store_true",
+                        help="Gzip the local output files.", )
+    parser.add_argument("-max_file_mb", "--max_output_file_mb", type=int, default=0,
+                        help="Start a new local output file after that many MB. 0 = never.", )
+    parser.add_argument("-workers", "--max_workers", type=int, default=16,
+                        help="Max accounts processed in parallel. The actual concurrency adapts "
+                             "between --min_workers and this number.", )
+    parser.add_argument("--min_workers", type=int, default=1,
+                        help="Min accounts processed in parallel.", )
+    parser.add_argument("--read_qps", type=float, default=0,
+                        help="Max search requests per second (per developer token). 0 = no "
+                             "limit.", )
+    parser.add_argument("--mutate_qps", type=float, default=0,
+                        help="Max mutate requests per second (per developer token). 0 = no "
+                             "limit.", )
+    parser.add_argument("--max_retries", type=int, default=4,
+                        help="Max retries of a failed API request (transient and quota "
+                             "errors), with exponential backoff.", )
+    parser.add_argument("--grpc_channels", type=int, default=1,
+                        help="Google Ads API channels (connections) shared by the worker threads "
+                             "of a process, each request going to the least loaded one.", )
+    parser.add_argument("-size_estimate", "--account_size_estimate",
+                        choices=["history", "count", "none"], default="history",
+                        help="In parallel mode, accounts start largest first. history (default): "
+                             "their size in the last sessions. count: also count the disapproved "
+                             "ads of the accounts without history, before the session. none: in "
+                             "discovery order.", )
+    parser.add_argument("-split_ads", "--split_account_ads", type=int, default=100000,
+                        help="In parallel mode, audit an account estimated above that many "
+                             "disapproved ads in parts (ranges of its campaigns) of about that "
+                             "many ads, in parallel. 0 = never.", )
+    parser.add_argument("--mutate_concurrency", type=int, default=8,
+                        help="Max removal (mutate) requests in flight, across all accounts.", )
+    parser.add_argument("--mutate_chunks_in_flight", type=int, default=2,
+                        help="Max removal chunks in flight per account.", )
+    parser.add_argument("-stream", "--stream_ads", action="store_true",
+                        help="Audits and removes the ads of an account chunk by chunk while they "
+                             "are streamed, instead of collecting them all first.", )
+    parser.add_argument("-audit_first", "--audit_all_before_remove", action="store_true",
+                        help="In stream mode, audits all the ads of an account (spilled to disk) "
+                             "before removing any of them.", )
+    parser.add_argument("-ad_types", "--ad_types", type=str.upper, nargs="+", choices=AD_TYPES,
+                        metavar="AD_TYPE",
+                        help="Only audit these ad types (AdType names, e.g. RESPONSIVE_SEARCH_AD) "
+                             "and only fetch their creative fields.", )
+    parser.add_argument("-ids_only", "--audit_ids_only", action="store_true",
+                        help="Do not fetch the ads' final urls and creative text (faster, for "
+                             "removal runs which do not need them).", )
+    parser.add_argument("-log_level", "--log_level", choices=["DEBUG", "INFO", "WARNING"],
+                        type=str.upper, default="INFO",
+                        help="DEBUG logs every ad found and removed. INFO (default) logs a "
+                             "summary per streamed batch and per removal request instead.", )
+    parser.add_argument("--prometheus_file", type=str,
+                        help="Also export the metrics of the session to this Prometheus "
+                             "textfile.", )
+    parser.add_argument("--profile", action="store_true",
+                        help="Sample the stacks of all the threads during the session and write "
+                             "them (collapsed, for flame graphs) to the output folder.", )
+    parser.add_argument("-cache_ttl", "--hierarchy_cache_ttl_hours", type=float, default=0,
+                        help="Reuse the cached account tree for that many hours, then refresh "
+                             "it incrementally. 0 disables the cache.", )
+    parser.add_argument("-full_refresh", "--full_hierarchy_refresh", action="store_true",
+                        help="Rediscover the whole account tree and update the cache.", )
+    parser.add_argument("-resolve_hierarchy", "--resolve_hierarchy", action="store_true",
+                        help="Find the parent MCC of every account (one request per MCC of the "
+                             "levels with several MCCs), so that every hierarchy lists all the "
+                             "MCCs above its account.", )
+    parser.add_argument("-incremental", "--incremental_audit", action="store_true",
+                        help="Only scan the ad groups whose ads changed since the last session "
+                             "(per account), with a periodic full sweep.", )
+    parser.add_argument("--full_sweep_hours", type=float, default=24,
+                        help="In incremental mode, fully scan all the accounts when the last "
+                             "full sweep is older than that.", )
+    parser.add_argument("--change_lookback_hours", type=float, default=24,
+                        help="In incremental mode, also scan the ads changed that many hours "
+                             "before the last session (pending policy reviews).", )
+    parser.add_argument("-full_sweep", "--force_full_sweep", action="store_true",
+                        help="In incremental mode, fully scan all the accounts this session.", )
+    parser.add_argument("-capture", "--capture_streams", action="store_true",
+                        help="Capture the disapproved ads streams of the accounts to "
+                             "output/capture/<top_id>, to replay them later.", )
+    parser.add_argument("-replay", "--replay_capture", action="store_true",
+                        help="Re-evaluate the captured disapproved ads streams offline (e.g. with "
+                             "new topics rules) instead of querying the API. Ads are not "
+                             "removed.", )
+    parser.add_argument("-shard", "--shard", type=parse_shard, metavar="K/N",
+                        help="Only audits shard K (from 1 to N) of the accounts, e.g. to split "
+                             "the accounts between N nodes.", )
+    parser.add_argument("-processes", "--shard_processes", type=int, default=1,
+                        help="Audits the accounts in that many worker processes, a shard each, "
+                             "each one with its own API clients and up to --max_workers threads. "
+                             "The rate limits are shared between the processes.", )
+    args = parser.parse_args(argv)
+    args.top_id = list(dict.fromkeys(top_id.replace("-", "") for value in args.top_id for
+                                     top_id in value.split(",") if top_id))
+    if args.shard_processes < 1:
+        parser.error("--shard_processes must be at least 1")
+    if args.grpc_channels < 1:
+        parser.error("--grpc_channels must be at least 1")
+    if args.split_account_ads < 0:
+        parser.error("--split_account_ads can not be negative")
+    if args.bq_compaction_days < 0:
+        parser.error("--bq_compaction_days can not be negative")
+    if args.session_rollup is None:
+        args.session_rollup = "bq" if args.write_to_bq else "local"
+    elif args.session_rollup == "bq" and not args.write_to_bq:
+        parser.error("-rollup bq requires -bq")
+    if args.resume and args.session_id:
+        parser.error("-resume and -session_id can not be combined")
+    if args.bq_maintenance_only and not args.write_to_bq:
+        parser.error("-bq_maintenance requires -bq")
+    if args.replay_capture and (args.remove_ads or args.capture_streams or args.write_to_bq):
+        # A replay must not reach the production tables (nor their latest status and rollups)
+        parser.error("-replay can not be combined with -rm, -capture or -bq")
+    if (args.replay_capture or args.capture_streams) and args.incremental_audit:
+        parser.error("-capture and -replay work on full scans, not with -incremental")
+    return args
+
+
+def configure(args):
+    """Sets the globals of the session from the parsed flags"""
+    global _REMOVE_ADS, _PARALLEL_MODE, _WRITE_TO_BQ, _BQ_INGESTION, _GZIP_OUTPUT
+    global _MAX_OUTPUT_FILE_MB, _MAX_WORKERS, _MIN_WORKERS, _MUTATE_CHUNKS_IN_FLIGHT
+    global _STREAMING_MODE, _AUDIT_ALL_BEFORE_REMOVE, _AD_TYPES, _IDS_ONLY
+    global _HIERARCHY_CACHE_TTL_HOURS, _FULL_HIERARCHY_REFRESH, _INCREMENTAL_AUDIT
+    global _FULL_SWEEP_HOURS, _CHANGE_LOOKBACK_HOURS, _FORCE_FULL_SWEEP, _PROMETHEUS_FILE, _PROFILE
+    global _CAPTURE_STREAMS, _REPLAY_CAPTURE, _SHARD, _SHARD_PROCESSES, _SESSION_ARGS
+    global _INCLUDED_TOPICS_SUBSTRINGS, _EXCLUDED_TOPICS_SUBSTRINGS, _TOPIC_MATCHER
+    global _AD_RECORD_EXTRACTOR, _RESOLVE_HIERARCHY
+    global _CLEAN_OUTDATED_BQ, _BQ_COMPACTION_DAYS, _SESSION_ROLLUP, CURRENT_SESSION_ID
+    global _BQ_MAINTENANCE_ONLY, _VERIFY_BQ_SCHEMA, _ACCOUNT_SIZE_ESTIMATE, _SPLIT_ACCOUNT_ADS
     _REMOVE_ADS = args.remove_ads
     _PARALLEL_MODE = not args.sequential
     _WRITE_TO_BQ = args.write_to_bq
-
+    _CLEAN_OUTDATED_BQ = args.clean_outdated_bq
+    _BQ_COMPACTION_DAYS = args.bq_compaction_days
+    _BQ_MAINTENANCE_ONLY = args.bq_maintenance_only
+    _VERIFY_BQ_SCHEMA = args.verify_bq_schema
+    _SESSION_ROLLUP = args.session_rollup
+    _BQ_INGESTION = args.bq_ingestion
+    _GZIP_OUTPUT = args.gzip_output
+    _MAX_OUTPUT_FILE_MB = args.max_output_file_mb
+    _MAX_WORKERS = args.max_workers
+    _MIN_WORKERS = args.min_workers
+    _ACCOUNT_SIZE_ESTIMATE = args.account_size_estimate
+    _SPLIT_ACCOUNT_ADS = args.split_account_ads
+    _MUTATE_CHUNKS_IN_FLIGHT = args.mutate_chunks_in_flight
+    _STREAMING_MODE = args.stream_ads
+    _AUDIT_ALL_BEFORE_REMOVE = args.audit_all_before_remove
+    _AD_TYPES = args.ad_types
+    _IDS_ONLY = args.audit_ids_only
+    _HIERARCHY_CACHE_TTL_HOURS = args.hierarchy_cache_ttl_hours
+    _FULL_HIERARCHY_REFRESH = args.full_hierarchy_refresh
+    _RESOLVE_HIERARCHY = args.resolve_hierarchy
+    _INCREMENTAL_AUDIT = args.incremental_audit
+    _FULL_SWEEP_HOURS = args.full_sweep_hours
+    _CHANGE_LOOKBACK_HOURS = args.change_lookback_hours
+    _FORCE_FULL_SWEEP = args.force_full_sweep
+    _PROMETHEUS_FILE = args.prometheus_file
+    _PROFILE = args.profile
+    _CAPTURE_STREAMS = args.capture_streams
+    _REPLAY_CAPTURE = args.replay_capture
+    _SHARD = args.shard
+    _SHARD_PROCESSES = args.shard_processes
+    _SESSION_ARGS = args
+
+    # The output of the session goes through a queue to a background thread
+    start_async_logging(getattr(logging, args.log_level))
     _INCLUDED_TOPICS_SUBSTRINGS = load_included_topics()
     _EXCLUDED_TOPICS_SUBSTRINGS = [] if len(
         _INCLUDED_TOPICS_SUBSTRINGS) == 0 else load_excluded_topics()
-    CURRENT_SESSION_ID = str(uuid.uuid4())
+    _TOPIC_MATCHER = TopicMatcher(_INCLUDED_TOPICS_SUBSTRINGS, _EXCLUDED_TOPICS_SUBSTRINGS)
+    _AD_RECORD_EXTRACTOR = AdRecordExtractor(_TOPIC_MATCHER, _IDS_ONLY)
+    CURRENT_SESSION_ID = args.resume or args.session_id or str(uuid.uuid4())
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure(args)
+    if args.resume:
+        check_resumed_session()
     while _RETRIES_LEFT > 0:
         _RETRIES_LEFT -= 1
         try:
             create_results_folder(_OUTPUT_PATH)
-            if _WRITE_TO_BQ:
-                bqServiceWrapper = BqServiceWrapper(_DS_ID)
-                if args.delete_db:
-                    delete_tables()
-                    time.sleep(30)  # Number of seconds
-                elif args.clean_outdated_bq:
-                    bqServiceWrapper.remove_outdated_scanned_rows(_ADS_TO_REMOVE_TABLE_NAME)
-            gAdsServiceWrapper = GAdsServiceWrapper(args.top_id)
-            main(args.top_id)
+            create_services(args, bootstrap_bq_tables=True)
+            if _BQ_MAINTENANCE_ONLY:
+                maintain_bq_tables()
+            else:
+                main(args.top_id)
             sys.exit(0)
-        except GoogleAdsException as ex:
+        except Exception as ex:  # pylint: disable=broad-except
+            if not is_google_ads_exception(ex):
+                raise
             handle_googleads_exception(ex)
+            # The next attempt creates its own pipeline: let this one send its chunks in flight
+            if mutatePipeline is not None:
+                mutatePipeline.shutdown()
+    sys.exit(1)
@@ -0,0 +1,123 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pipelined mutate requests.
+
+All the mutates of the session run on one MutatePipeline thread pool, whose size is the global
+budget of mutates in flight. Each account submits its chunks through an AccountMutates, which
+keeps up to {max_in_flight} of them in flight and handles the response of a finished chunk (in
+the account's own thread) while the next ones are still being sent. Every response is handed to
+the handler together with the payload (e.g. the ads json) of its own chunk, and the numbers the
+handler returns (e.g. of removed ads) are summed per account.
+"""
+import threading
+from concurrent import futures
+
+from instrumentation import get_metrics
+
+_DEFAULT_MAX_CONCURRENCY = 8
+_DEFAULT_MAX_IN_FLIGHT = 2
+
+
+class MutatePipeline:
+    """A thread pool for {send_function}(account_id, operations) calls"""
+
+    def __init__(self, send_function, max_concurrency=_DEFAULT_MAX_CONCURRENCY):
+        self._send_function = send_function
+        self._executor = futures.ThreadPoolExecutor(max_workers=max(1, max_concurrency),
+                                                    thread_name_prefix="mutate")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def account(self, account_id, handler, max_in_flight=_DEFAULT_MAX_IN_FLIGHT):
+        """Returns an AccountMutates calling handler(payload, response_future) per chunk, which
+        returns a count (or None)"""
+        return AccountMutates(self, account_id, handler, max_in_flight)
+
+    def submit(self, account_id, operations):
+        with self._lock:
+            self._in_flight += 1
+            in_flight = self._in_flight
+        # More than max_concurrency in flight = chunks queued for a free thread
+        get_metrics().observe_max("mutates_in_flight", in_flight)
+        future = self._executor.submit(self._send_function, account_id, operations)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def _on_done(self, _):
+        with self._lock:
+            self._in_flight -= 1
+
+
+class AccountMutates:
+    """The chunks of one account in flight. Use as a context manager, or call close()"""
+
+    @property
+    def handled_count(self):
+        """The sum of the counts returned by the handler so far"""
+        return self._handled_count
+
+    def __init__(self, pipeline, account_id, handler, max_in_flight):
+        self._pipeline = pipeline
+        self._account_id = account_id
+        self._handler = handler
+        self._max_in_flight = max(1, max_in_flight)
+        self._pending = {}
+        self._handled_count = 0
+
+    def submit(self, operations, payload):
+        """Sends a chunk, first handling finished chunks until fewer than max_in_flight remain"""
+        while len(self._pending) >= self._max_in_flight:
+            self._handle(futures.FIRST_COMPLETED)
+        self._pending[self._pipeline.submit(self._account_id, operations)] = payload
+
+    def close(self):
+        """Handles all the remaining chunks. If a handler raises, the other chunks are still
+        handled and the first exception is raised at the end"""
+        first_exception = None
+        while self._pending:
+            try:
+                self._handle(futures.ALL_COMPLETED)
+            except Exception as exception:  # pylint: disable=broad-except
+                first_exception = first_exception or exception
+        if first_exception is not None:
+            raise first_exception
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            try:
+                self.close()
+            except Exception:  # pylint: disable=broad-except
+                pass  # The original exception is raised
+        return False
+
+    def _handle(self, return_when):
+        done, _ = futures.wait(list(self._pending), return_when=return_when)
+        first_exception = None
+        for future in done:
+            payload = self._pending.pop(future)
+            try:
+                self._handled_count += self._handler(payload, future) or 0
+            except Exception as exception:  # pylint: disable=broad-except
+                first_exception = first_exception or exception
+        if first_exception is not None:
+            raise first_exception
@@ -0,0 +1,77 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import json
+import threading
+from pathlib import Path
+
+_BUFFER_BYTES = 1024 * 1024
+
+
+class NdjsonSink:
+    """A buffered, thread-safe newline delimited json file (one record per line) for one table
+    and session. The file is created on the first write, optionally gzipped, and rotated to a new
+    part once {max_file_bytes} (of uncompressed json, 0 = never) were written to it"""
+
+    @property
+    def records_count(self):
+        return self._records_count
+
+    def __init__(self, output_path, file_prefix, compress=False, max_file_bytes=0):
+        self._output_path = output_path
+        self._file_prefix = file_prefix
+        self._compress = compress
+        self._max_file_bytes = max_file_bytes
+        self._lock = threading.Lock()
+        self._file = None
+        self._part = 0
+        self._file_bytes = 0
+        self._records_count = 0
+
+    def write(self, records):
+        """Appends records (json serializable dicts)"""
+        lines = "".join(json.dumps(record) + "\n" for record in records)
+        if not lines:
+            return
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._file.write(lines)
+            self._file_bytes += len(lines)
+            self._records_count += len(records)
+            if self._max_file_bytes and self._file_bytes >= self._max_file_bytes:
+                self._file.close()
+                self._file = None
+                self._part += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def get_full_output_path(self):
+        """Returns the path of the current part"""
+        part_suffix = f"_{self._part:03d}" if self._max_file_bytes else ""
+        extension = ".jsonl.gz" if self._compress else ".jsonl"
+        return Path(self._output_path) / f"{self._file_prefix}{part_suffix}{extension}"
+
+    def _open(self):
+        self._file_bytes = 0
+        if self._compress:
+            self._file = gzip.open(self.get_full_output_path(), 'at', encoding='utf-8')
+        else:
+            self._file = open(self.get_full_output_path(), 'a', encoding='utf-8',
+                              buffering=_BUFFER_BYTES)
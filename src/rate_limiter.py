@@ -0,0 +1,63 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+from enum import Enum
+
+
+class RequestKind(Enum):
+    READ = 1
+    MUTATE = 2
+
+
+class TokenBucket:
+    """A thread-safe token bucket. A rate of 0 (or less) means unlimited"""
+
+    def __init__(self, rate_per_second, burst=None):
+        self._rate = rate_per_second
+        self._capacity = burst if burst is not None else max(1.0, rate_per_second)
+        self._tokens = self._capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Blocks until {tokens} tokens are available and takes them"""
+        if self._rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity,
+                                   self._tokens + (now - self._last_refill) * self._rate)
+                self._last_refill = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait_seconds = (tokens - self._tokens) / self._rate
+            time.sleep(wait_seconds)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_token_bucket(developer_token, request_kind, rate_per_second):
+    """Returns the bucket shared by every client of {developer_token} for {request_kind}
+    requests. The rate of the first call for a (developer_token, request_kind) wins"""
+    with _buckets_lock:
+        key = (developer_token, request_kind)
+        if key not in _buckets:
+            _buckets[key] = TokenBucket(rate_per_second)
+        return _buckets[key]
@@ -0,0 +1,176 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Retries of Google Ads API errors, with exponential backoff and full jitter.
+
+Transient errors (UNAVAILABLE, DEADLINE_EXCEEDED, ABORTED and INTERNAL statuses, TRANSIENT_ERROR
+failures) are retried; quota (RESOURCE_EXHAUSTED) errors too, waiting at least the retry delay the
+API hints. Other errors (invalid requests, missing permissions...) are raised at once. Quota errors
+are also reported to the listener of the policy, if any (the AdaptiveScheduler, which lowers the
+concurrency), so the request is retried where it failed rather than its whole account.
+
+The gRPC and Google Ads libraries are not imported here: an exception can only be one of theirs
+if the API client already imported them, so the runs without the API do not pay for them.
+"""
+import logging
+import random
+import sys
+import threading
+import time
+
+from instrumentation import get_metrics
+
+logger = logging.getLogger(__name__)
+
+_MAX_RETRIES = 4
+_INITIAL_BACKOFF_SECONDS = 1.0
+_MAX_BACKOFF_SECONDS = 60.0
+_TRANSIENT_STATUSES = {"UNAVAILABLE", "DEADLINE_EXCEEDED", "ABORTED", "INTERNAL"}
+_QUOTA_STATUS = "RESOURCE_EXHAUSTED"
+
+
+class RetryPolicy:
+    """Calls a function (or iterates a stream), retrying the errors which {is_retryable}"""
+
+    @property
+    def retries_count(self):
+        return self._retries_count
+
+    def __init__(self, is_retryable, max_retries=_MAX_RETRIES,
+                 initial_backoff_seconds=_INITIAL_BACKOFF_SECONDS,
+                 max_backoff_seconds=_MAX_BACKOFF_SECONDS):
+        self._is_retryable = is_retryable
+        self._max_retries = max_retries
+        self._initial_backoff_seconds = initial_backoff_seconds
+        self._max_backoff_seconds = max_backoff_seconds
+        self._retries_count = 0
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def set_listener(self, listener):
+        """Reports the quota errors to listener.on_quota_error(started), where started is the
+        time.monotonic() at which the failed request was sent. None removes the listener"""
+        self._listener = listener
+
+    def call(self, function, *args):
+        """Returns function(*args)"""
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                return function(*args)
+            except Exception as exception:  # pylint: disable=broad-except
+                self._on_error(started, exception)
+                if attempt >= self._max_retries or not self._is_retryable(exception):
+                    raise
+                self._wait(attempt, exception)
+                attempt += 1
+
+    def stream(self, open_stream, *args):
+        """Yields the items of open_stream(*args). The stream is opened again on errors raised
+        before its first item; later errors are raised, as the items already yielded can not be
+        taken back"""
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            yielded = False
+            try:
+                for item in open_stream(*args):
+                    yielded = True
+                    yield item
+                return
+            except Exception as exception:  # pylint: disable=broad-except
+                self._on_error(started, exception)
+                if yielded or attempt >= self._max_retries or not self._is_retryable(exception):
+                    raise
+                self._wait(attempt, exception)
+                attempt += 1
+
+    def get_delay_seconds(self, attempt, exception):
+        """Returns a random backoff of up to initial * 2^attempt seconds, or the hinted retry
+        delay if longer"""
+        backoff_seconds = random.uniform(0, min(self._max_backoff_seconds,
+                                                self._initial_backoff_seconds * 2 ** attempt))
+        retry_delay_seconds = get_retry_delay_seconds(exception)
+        if retry_delay_seconds is None:
+            return backoff_seconds
+        return max(backoff_seconds, retry_delay_seconds)
+
+    def _on_error(self, started, exception):
+        listener = self._listener
+        if listener is not None and is_quota_error(exception):
+            listener.on_quota_error(started)
+
+    def _wait(self, attempt, exception):
+        delay_seconds = self.get_delay_seconds(attempt, exception)
+        logger.warning("Retrying in %.1f seconds after: %s", delay_seconds,
+                       get_error_message(exception))
+        with self._lock:
+            self._retries_count += 1
+        get_metrics().increment("api_retries")
+        with get_metrics().time("retry_backoff"):
+            time.sleep(delay_seconds)
+
+
+def is_google_ads_exception(exception):
+    """Checks whether an exception is a GoogleAdsException"""
+    errors_module = sys.modules.get("google.ads.googleads.errors")
+    return errors_module is not None and isinstance(exception, errors_module.GoogleAdsException)
+
+
+def _is_rpc_error(exception):
+    grpc_module = sys.modules.get("grpc")
+    return grpc_module is not None and isinstance(exception, grpc_module.RpcError)
+
+
+def get_status_name(exception):
+    """Returns the gRPC status name of an API error, or None"""
+    if is_google_ads_exception(exception):
+        return exception.error.code().name
+    if _is_rpc_error(exception) and callable(getattr(exception, "code", None)):
+        return exception.code().name
+    return None
+
+
+def is_transient_error(exception):
+    """Checks whether an exception is an API error which may not happen again"""
+    if get_status_name(exception) in _TRANSIENT_STATUSES:
+        return True
+    if is_google_ads_exception(exception):
+        return any(error.error_code.internal_error.name == "TRANSIENT_ERROR" for error in
+                   exception.failure.errors)
+    return False
+
+
+def is_quota_error(exception):
+    """Checks whether an exception is a Google Ads quota (RESOURCE_EXHAUSTED) error"""
+    return get_status_name(exception) == _QUOTA_STATUS
+
+
+def get_retry_delay_seconds(exception):
+    """Returns the retry delay hinted by a quota error, or None"""
+    if not is_google_ads_exception(exception):
+        return None
+    # Durations are timedelta objects in proto-plus messages
+    retry_delay_seconds = [error.details.quota_error_details.retry_delay.total_seconds() for
+                           error in exception.failure.errors]
+    return max(retry_delay_seconds, default=0) or None
+
+
+def get_error_message(exception):
+    """Returns a one line description of an exception"""
+    if is_google_ads_exception(exception):
+        messages = "; ".join(error.message for error in exception.failure.errors)
+        return f"{exception.error.code().name}: {messages}"
+    return f"{type(exception).__name__}: {exception}"
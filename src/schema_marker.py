@@ -0,0 +1,62 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A local marker of the BQ schema already verified, so that the sessions skip the dataset and
+table checks (a request per table) at startup.
+
+The marker holds a fingerprint of the table definitions (names, fields, partitioning and
+clustering) and when they were verified. It is valid while the definitions are the same and it is
+younger than its TTL, so a table deleted outside the tool is recreated by the next check at the
+latest. Deleting the tables (-ddb) removes it.
+"""
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+
+class SchemaMarker:
+    """A marker file for a dataset"""
+
+    def __init__(self, marker_file, ttl_seconds):
+        self._marker_file = Path(marker_file)
+        self._ttl_seconds = ttl_seconds
+
+    def is_verified(self, fingerprint):
+        """Checks whether the schema of {fingerprint} was verified less than the TTL ago"""
+        try:
+            with open(self._marker_file, encoding='utf-8') as file_object:
+                marker_json = json.load(file_object)
+        except (OSError, ValueError):
+            return False
+        return marker_json.get("fingerprint") == fingerprint and \
+            time.time() - marker_json.get("verified", 0) < self._ttl_seconds
+
+    def record(self, fingerprint):
+        """Records that the schema of {fingerprint} was just verified"""
+        self._marker_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = self._marker_file.with_suffix(".tmp")
+        with open(temp_file, 'w', encoding='utf-8') as file_object:
+            json.dump({"fingerprint": fingerprint, "verified": time.time()}, file_object)
+        os.replace(temp_file, self._marker_file)
+
+    def clear(self):
+        """Removes the marker: the next session verifies the schema"""
+        self._marker_file.unlink(missing_ok=True)
+
+
+def get_fingerprint(definitions):
+    """Returns a fingerprint of json serializable definitions"""
+    return hashlib.sha256(json.dumps(definitions, sort_keys=True).encode('utf-8')).hexdigest()
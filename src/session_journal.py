@@ -0,0 +1,130 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checkpoint journal of a session, so a retried or resumed session continues where it stopped.
+
+An append-only newline delimited json file per session id records, as they happen:
+- the discovered accounts, so discovery is not repeated;
+- every removal chunk done, with its number of removed ads;
+- every account done, with its number of relevant disapproved ads.
+Opening the journal of an existing session replays it. Completed accounts are then skipped, and
+partially removed accounts are scanned again: removed ads are no longer returned by the query, so
+their removal continues from the next unsent chunk. The removed counts also cover the attempts
+of the current run (e.g. an account retried after a quota error), so the account's total counts
+the ads its failed attempts removed. The journal is deleted once the session completes.
+"""
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class SessionJournal:
+    """Records (from any thread) and replays the progress of a session"""
+
+    @property
+    def accounts(self):
+        """The discovered accounts, or None if they were not recorded yet"""
+        return self._accounts
+
+    def __init__(self, journal_path, session_id):
+        self._journal_file = get_journal_file(journal_path, session_id)
+        self._lock = threading.Lock()
+        self._top_id = None
+        self._accounts = None
+        self._completed_accounts = {}
+        self._removed_counts = {}
+        is_complete_line = self._replay()
+        Path(journal_path).mkdir(parents=True, exist_ok=True)
+        self._file = open(self._journal_file, 'a', encoding='utf-8')
+        if not is_complete_line:
+            self._file.write("\n")
+
+    def get_completed_count(self, account_id):
+        """Returns the ads count of an account completed in this session, or None"""
+        with self._lock:
+            return self._completed_accounts.get(account_id)
+
+    def get_removed_count(self, account_id):
+        """Returns the number of ads of an account removed in this session, by all its attempts:
+        those of earlier runs and those of this run (retries included)"""
+        with self._lock:
+            return self._removed_counts.get(account_id, 0)
+
+    def record_accounts(self, top_id, accounts):
+        self._append({"type": "accounts", "top_id": top_id, "accounts": accounts})
+
+    def record_chunk_removed(self, account_id, removed_count):
+        self._append({"type": "chunk", "account_id": account_id, "removed": removed_count})
+
+    def record_account_completed(self, account_id, ads_count):
+        self._append({"type": "account", "account_id": account_id, "ads_count": ads_count})
+
+    def check_top_id(self, top_id):
+        """Raises ValueError if the session was started for another top MCC"""
+        if self._top_id is not None and self._top_id != top_id:
+            raise ValueError(f"Session {self._journal_file.name} is of top MCC {self._top_id}, "
+                             f"not {top_id}")
+
+    def close(self, session_completed=False):
+        """Closes the journal, and deletes it if the session completed"""
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+            if session_completed:
+                os.remove(self._journal_file)
+
+    def _append(self, record):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._apply(record)
+            self._file.write(line)
+            self._file.flush()
+
+    def _replay(self):
+        """Applies the recorded records. Returns False if the last line was cut by a crash"""
+        line = "\n"
+        try:
+            with open(self._journal_file, encoding='utf-8') as file_object:
+                for line in file_object:
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        pass  # A line cut by a crash
+        except FileNotFoundError:
+            return True
+        logger.info("Resuming from %s: %d accounts already completed", self._journal_file,
+                    len(self._completed_accounts))
+        return line.endswith("\n")
+
+    def _apply(self, record):
+        if record["type"] == "accounts":
+            self._top_id = record["top_id"]
+            self._accounts = record["accounts"]
+        elif record["type"] == "chunk":
+            account_id = record["account_id"]
+            self._removed_counts[account_id] = \
+                self._removed_counts.get(account_id, 0) + record["removed"]
+        elif record["type"] == "account":
+            self._completed_accounts[record["account_id"]] = record["ads_count"]
+
+
+def get_journal_file(journal_path, session_id):
+    """Returns the journal file of a session (of a shard: {session_id} with its shard suffix)"""
+    return Path(journal_path) / f"journal_{session_id}.jsonl"
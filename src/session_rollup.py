@@ -0,0 +1,117 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per account and per top MCC rollups of a session, computed from its local output files.
+
+This is the local counterpart of BqServiceWrapper.merge_account_rollup / insert_mcc_rollup. An
+account is rolled up once it has a PerAccountSummary row (completed or failed). An ad is counted
+once, with its last status: a resumed session appends the rows of its later attempts to new files
+of the same session, which are read after the earlier ones.
+"""
+import gzip
+import json
+from collections import Counter
+from pathlib import Path
+
+from bowling_status import BowlingStatus
+
+
+class SessionRollup:
+    """Aggregates the AllAccounts, AdsToRemove and PerAccountSummary rows of a session"""
+
+    def __init__(self, session_id):
+        self._session_id = session_id
+        self._accounts = {}
+        self._summaries = {}
+        self._ad_statuses = {}
+
+    def add_accounts(self, rows):
+        for row in rows:
+            self._accounts[row["account_id"]] = row
+
+    def add_ads(self, rows):
+        for row in rows:
+            self._ad_statuses[(row.get("account_id"), row["ad_group_id"], row["ad_id"])] = \
+                row.get("bowling_status")
+
+    def add_account_summaries(self, rows):
+        for row in rows:
+            self._summaries[row["account_id"]] = row
+
+    def get_account_rollups(self, timestamp):
+        """Returns a row per rolled up account"""
+        status_counts = {}
+        for (account_id, _, _), status in self._ad_statuses.items():
+            status_counts.setdefault(account_id, Counter())[status] += 1
+        rollups = []
+        for account_id, summary in self._summaries.items():
+            account = self._accounts.get(account_id, {})
+            counts = status_counts.get(account_id, Counter())
+            rollups.append({"account_id": account_id, "top_id": account.get("top_id"),
+                            "hierarchy": account.get("hierarchy"),
+                            "session_id": self._session_id, "timestamp": timestamp,
+                            "ads_to_remove": sum(counts.values()),
+                            "removed_ads": counts[BowlingStatus.REMOVED.name],
+                            "failed_to_remove_ads": counts[BowlingStatus.FAILED_TO_REMOVE.name],
+                            "error": summary.get("error")})
+        return rollups
+
+    def get_mcc_rollups(self, timestamp, shard=None):
+        """Returns a row per top MCC, summing the rollups of its accounts"""
+        mcc_rollups = {}
+        for rollup in self.get_account_rollups(timestamp):
+            top_id = rollup["top_id"]
+            if top_id not in mcc_rollups:
+                mcc_rollups[top_id] = {"account_id": top_id, "session_id": self._session_id,
+                                       "shard": shard, "timestamp": timestamp,
+                                       "total_accounts": 0, "accounts_with_ads_to_remove": 0,
+                                       "accounts_with_ads_removed": 0, "failed_accounts": 0,
+                                       "total_ads_to_remove": 0, "total_removed_ads": 0}
+            mcc_rollup = mcc_rollups[top_id]
+            mcc_rollup["total_accounts"] += 1
+            mcc_rollup["accounts_with_ads_to_remove"] += rollup["ads_to_remove"] > 0
+            mcc_rollup["accounts_with_ads_removed"] += rollup["removed_ads"] > 0
+            mcc_rollup["failed_accounts"] += rollup["error"] is not None
+            mcc_rollup["total_ads_to_remove"] += rollup["ads_to_remove"]
+            mcc_rollup["total_removed_ads"] += rollup["removed_ads"]
+        return list(mcc_rollups.values())
+
+
+def rollup_session_files(output_path, session_id, all_accounts_table_id, ads_table_id,
+                         summary_table_id):
+    """Returns the SessionRollup of the output files of a session (of all its shards and
+    attempts found in output_path)"""
+    session_rollup = SessionRollup(session_id)
+    session_rollup.add_accounts(read_session_rows(output_path, all_accounts_table_id, session_id))
+    session_rollup.add_ads(read_session_rows(output_path, ads_table_id, session_id))
+    session_rollup.add_account_summaries(read_session_rows(output_path, summary_table_id,
+                                                           session_id))
+    return session_rollup
+
+
+def read_session_rows(output_path, table_id, session_id):
+    """Yields the rows of the output files (plain or gzipped, in any part) of a table for a
+    session, oldest file first"""
+    # Output files are named {table_id}_{yyyymmdd-hhmmss}_{session id prefix}{shard}{part}
+    files = sorted(Path(output_path).glob(f"{table_id}_*_{session_id[:8]}*.jsonl*"))
+    for file in files:
+        opener = gzip.open if file.suffix == ".gz" else open
+        with opener(file, 'rt', encoding='utf-8') as file_object:
+            for line in file_object:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # An empty line, or a line cut by a crash of an earlier attempt
+                if row.get("session_id") == session_id:
+                    yield row
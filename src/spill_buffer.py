@@ -0,0 +1,45 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import tempfile
+
+from array_utils import chunked
+
+
+class SpillBuffer:
+    """A FIFO of json items kept in a temporary file (one item per line) instead of in memory"""
+
+    @property
+    def count(self):
+        return self._count
+
+    def __init__(self, directory=None):
+        self._file = tempfile.TemporaryFile('w+', encoding='utf-8', dir=directory)
+        self._count = 0
+
+    def extend(self, items):
+        """Appends items to the buffer"""
+        for item in items:
+            self._file.write(json.dumps(item) + "\n")
+        self._count += len(items)
+
+    def chunks(self, size):
+        """Yields the buffered items, in order, in lists of up to size items"""
+        self._file.flush()
+        self._file.seek(0)
+        return chunked((json.loads(line) for line in self._file), size)
+
+    def close(self):
+        self._file.close()
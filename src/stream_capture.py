@@ -0,0 +1,121 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Capture and replay of the disapproved ads streams, to re-evaluate topic rules offline.
+
+A capture of a top MCC is a folder holding the discovered accounts (accounts.json) and a gzipped
+file per account with its raw search_stream batches: a header naming the response message type,
+then every serialized batch, each one prefixed with its length. A capture file replaces the
+previous one of its account only once the stream is done, so a failed stream never leaves a
+partial capture behind. Replaying a file needs neither the API nor the google-ads.yaml
+configuration.
+"""
+import gzip
+import importlib
+import json
+import os
+import struct
+import time
+from pathlib import Path
+
+_ACCOUNTS_FILE = "accounts.json"
+_COMPRESS_LEVEL = 1  # Captures are written on the hot path of a session
+_LENGTH = struct.Struct(">I")
+
+
+class StreamCapture:
+    """Records and replays the disapproved ads streams of the accounts of a top MCC"""
+
+    @property
+    def capture_path(self):
+        return self._capture_path
+
+    def __init__(self, capture_path, top_id):
+        self._capture_path = Path(capture_path) / top_id
+        self._top_id = top_id
+        self._response_types = {}
+
+    def load_accounts(self):
+        """Returns the captured accounts"""
+        accounts_file = self._capture_path / _ACCOUNTS_FILE
+        if not accounts_file.exists():
+            raise FileNotFoundError(f"No capture of top MCC {self._top_id} in "
+                                    f"{self._capture_path}")
+        with open(accounts_file, encoding='utf-8') as file_object:
+            return json.load(file_object)["accounts"]
+
+    def record_accounts(self, accounts):
+        self._capture_path.mkdir(parents=True, exist_ok=True)
+        accounts_file = self._capture_path / _ACCOUNTS_FILE
+        temp_file = accounts_file.with_name(f"{accounts_file.name}.tmp")
+        with open(temp_file, 'w', encoding='utf-8') as file_object:
+            json.dump({"top_id": self._top_id, "captured_at": time.time(),
+                       "accounts": accounts}, file_object)
+        os.replace(temp_file, accounts_file)
+
+    def record(self, account_id, batches):
+        """Yields the batches, writing them to the capture of the account"""
+        capture_file = self._get_capture_file(account_id)
+        temp_file = capture_file.with_name(f"{capture_file.name}.tmp")
+        completed = False
+        try:
+            with gzip.open(temp_file, 'wb', compresslevel=_COMPRESS_LEVEL) as file_object:
+                for batch in batches:
+                    if file_object.tell() == 0:
+                        response_type = type(batch)
+                        _write_record(file_object, f"{response_type.__module__}:"
+                                                   f"{response_type.__qualname__}".encode())
+                    _write_record(file_object, type(batch).serialize(batch))
+                    yield batch
+            completed = True
+        finally:
+            if completed:
+                os.replace(temp_file, capture_file)
+            else:
+                temp_file.unlink(missing_ok=True)
+
+    def replay(self, account_id):
+        """Yields the captured batches of the account"""
+        with gzip.open(self._get_capture_file(account_id), 'rb') as file_object:
+            header = _read_record(file_object)
+            if header is None:
+                return  # No batch was streamed
+            response_type = self._get_response_type(header.decode())
+            while True:
+                payload = _read_record(file_object)
+                if payload is None:
+                    return
+                yield response_type.deserialize(payload)
+
+    def _get_capture_file(self, account_id):
+        return self._capture_path / f"{account_id}.batches.gz"
+
+    def _get_response_type(self, type_name):
+        if type_name not in self._response_types:
+            module_name, class_name = type_name.split(":")
+            self._response_types[type_name] = getattr(importlib.import_module(module_name),
+                                                      class_name)
+        return self._response_types[type_name]
+
+
+def _write_record(file_object, payload):
+    file_object.write(_LENGTH.pack(len(payload)))
+    file_object.write(payload)
+
+
+def _read_record(file_object):
+    length_bytes = file_object.read(_LENGTH.size)
+    if not length_bytes:
+        return None
+    return file_object.read(_LENGTH.unpack(length_bytes)[0])
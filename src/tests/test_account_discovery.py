@@ -0,0 +1,132 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of account_discovery. Run from the src folder: python3 -m pytest tests"""
+import unittest
+
+from account_discovery import AccountTreeDiscovery
+from benchmarks.synthetic import FakeGAdsTreeService, deep_tree, wide_tree
+
+
+class _FakeTreeService:
+    """Serves the customer_client queries of a tree given as {client_id: parent_id}"""
+
+    def __init__(self, parents, managers):
+        self.parents = parents
+        self.managers = managers
+
+    def get_customer_clients(self, top_id, level=None):
+        if level == 1:
+            return [(client_id, client_id in self.managers, 1)
+                    for client_id, parent_id in self.parents.items() if parent_id == top_id]
+        return [(client_id, client_id in self.managers, self._get_level(client_id))
+                for client_id in self.parents]
+
+    def _get_level(self, client_id):
+        level = 0
+        while client_id != "0":
+            client_id = self.parents[client_id]
+            level += 1
+        return level
+
+
+def _get_tree_parents(tree):
+    return {child_id: parent_id for parent_id, children in tree.children.items() for child_id in
+            children}
+
+
+class SingleQueryDiscoveryTest(unittest.TestCase):
+
+    def test_wide_tree_is_discovered_with_a_single_request(self):
+        tree = wide_tree(3, 3, 2)
+        service = FakeGAdsTreeService(tree)
+        discovered = AccountTreeDiscovery(service).discover_tree(tree.top_id)
+        self.assertEqual(service.requests_count, 1)
+        self.assertEqual(sorted(discovered.parents), sorted(_get_tree_parents(tree)))
+        # Every level has several managers: only the top MCC is known above levels 2 and 3
+        for client_id, _, level in discovered.clients:
+            self.assertEqual(discovered.parents[client_id], tree.top_id, (client_id, level))
+        accounts = discovered.flat_accounts()
+        self.assertEqual(len(accounts), tree.accounts_count())
+        self.assertEqual(len({account["account_id"] for account in accounts}), len(accounts))
+
+    def test_levels_with_a_single_manager_give_the_exact_parents(self):
+        tree = deep_tree(4, 3)
+        service = FakeGAdsTreeService(tree)
+        discovered = AccountTreeDiscovery(service).discover_tree(tree.top_id)
+        self.assertEqual(service.requests_count, 1)
+        self.assertEqual(discovered.parents, _get_tree_parents(tree))
+
+    def test_clients_below_several_managers_get_their_nearest_known_ancestor(self):
+        service = _FakeTreeService({"a": "0", "b": "a", "c": "a", "x": "b", "y": "c", "z": "y"},
+                                   {"a", "b", "c", "y"})
+        discovered = AccountTreeDiscovery(service).discover_tree("0")
+        self.assertEqual(discovered.parents,
+                         {"a": "0", "b": "a", "c": "a", "x": "a", "y": "a", "z": "y"})
+        hierarchies = {account["account_id"]: account["hierarchy"] for account in
+                       discovered.flat_accounts()}
+        self.assertEqual(hierarchies, {"0": "0", "a": "0_a", "b": "0_a_b", "c": "0_a_c",
+                                       "x": "0_a_x", "y": "0_a_y", "z": "0_a_y_z"})
+
+    def test_resolve_parents_expands_the_managers_of_the_ambiguous_levels(self):
+        tree = wide_tree(3, 3, 2)
+        service = FakeGAdsTreeService(tree)
+        discovered = AccountTreeDiscovery(service, resolve_parents=True).discover_tree(
+            tree.top_id)
+        self.assertEqual(discovered.parents, _get_tree_parents(tree))
+        # The last manager of a level is not expanded
+        self.assertEqual(service.requests_count, 1 + 2 + 8)
+
+    def test_known_exact_parents_are_kept(self):
+        tree = wide_tree(3, 3, 2)
+        known_tree = AccountTreeDiscovery(FakeGAdsTreeService(tree),
+                                          resolve_parents=True).discover_tree(tree.top_id)
+        service = FakeGAdsTreeService(tree)
+        discovered = AccountTreeDiscovery(service).discover_tree(tree.top_id, known_tree)
+        self.assertEqual(service.requests_count, 1)
+        self.assertEqual(discovered.parents, _get_tree_parents(tree))
+
+
+class IncrementalDiscoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.service = _FakeTreeService({"a": "0", "b": "0", "x": "a", "y": "b", "z": "b"},
+                                        {"a", "b"})
+        self.known_tree = AccountTreeDiscovery(self.service,
+                                               resolve_parents=True).discover_tree("0")
+
+    def test_unchanged_levels_are_not_expanded(self):
+        discovery = AccountTreeDiscovery(self.service, resolve_parents=True)
+        tree = discovery.discover_tree("0", known_tree=self.known_tree)
+        self.assertEqual(tree.parents, self.known_tree.parents)
+        self.assertEqual(discovery.requests_count, 1)
+
+    def test_moved_client_is_resolved_when_its_level_changed(self):
+        self.service.parents.update({"y": "a", "w": "b"})
+        tree = AccountTreeDiscovery(self.service, resolve_parents=True).discover_tree(
+            "0", known_tree=self.known_tree)
+        self.assertEqual(tree.parents["y"], "a")
+        self.assertEqual(tree.parents["w"], "b")
+
+    def test_changed_level_falls_back_to_the_nearest_known_ancestor(self):
+        self.service.parents.update({"w": "b"})
+        discovery = AccountTreeDiscovery(self.service)
+        tree = discovery.discover_tree("0", known_tree=self.known_tree)
+        self.assertEqual(discovery.requests_count, 1)
+        self.assertEqual({client_id: tree.parents[client_id] for client_id in "xyzw"},
+                         {"x": "0", "y": "0", "z": "0", "w": "0"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of account_scheduler. Run from the src folder: python3 -m pytest tests"""
+import time
+import unittest
+
+from account_scheduler import AdaptiveScheduler
+
+
+class AdaptiveSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = AdaptiveScheduler(max_workers=16, min_workers=1)
+
+    def _report_round(self, kind, latency_seconds):
+        for _ in range(self.scheduler.limit):
+            self.scheduler.on_request_latency(kind, latency_seconds)
+
+    def test_steady_request_latency_grows_the_limit(self):
+        self._report_round("search_stream", 0.1)
+        self._report_round("mutate", 0.5)
+        self.assertEqual(self.scheduler.limit, 10)
+
+    def test_degraded_request_latency_shrinks_the_limit(self):
+        self._report_round("mutate", 0.1)
+        for _ in range(10):
+            self.scheduler.on_request_latency("mutate", 1.0)
+        self.assertLess(self.scheduler.limit, 9)
+
+    def test_quota_errors_of_requests_sent_together_halve_the_limit_once(self):
+        started = time.monotonic()
+        self.scheduler.on_quota_error(started)
+        self.scheduler.on_quota_error(started)
+        self.assertEqual(self.scheduler.limit, 4)
+        self.scheduler.on_quota_error(time.monotonic())
+        self.assertEqual(self.scheduler.limit, 2)
+
+    def test_long_tasks_do_not_change_the_limit(self):
+        results = self.scheduler.map(lambda seconds: time.sleep(seconds) or seconds,
+                                     [0.05, 0.0, 0.0, 0.0])
+        self.assertEqual(results, [0.05, 0.0, 0.0, 0.0])
+        self.assertEqual(self.scheduler.limit, 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of account_sharding. Run from the src folder: python3 -m pytest tests"""
+import unittest
+
+from account_sharding import PROCESS_SHARD_SALT, select_shard
+
+_ACCOUNTS = [{"account_id": str(1000000000 + index)} for index in range(10000)]
+
+
+class NestedShardingTest(unittest.TestCase):
+
+    def test_process_shards_of_a_node_shard_are_balanced(self):
+        for node_shards_count, processes_count in ((2, 2), (2, 4), (4, 2), (3, 3), (3, 2)):
+            node_accounts = select_shard(_ACCOUNTS, 1, node_shards_count)
+            process_accounts = [select_shard(node_accounts, process_index, processes_count,
+                                             PROCESS_SHARD_SALT) for process_index in
+                                range(1, processes_count + 1)]
+            expected_count = len(node_accounts) / processes_count
+            for accounts in process_accounts:
+                self.assertAlmostEqual(len(accounts), expected_count, delta=expected_count * 0.1)
+            self.assertEqual(sum(len(accounts) for accounts in process_accounts),
+                             len(node_accounts))
+
+    def test_node_shards_partition_the_accounts(self):
+        shards = [select_shard(_ACCOUNTS, shard_index, 4) for shard_index in range(1, 5)]
+        self.assertEqual(sorted(account["account_id"] for shard in shards for account in shard),
+                         sorted(account["account_id"] for account in _ACCOUNTS))
+
+
+if __name__ == "__main__":
+    unittest.main()
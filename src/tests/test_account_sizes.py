@@ -0,0 +1,144 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of account_sizes. Run from the src folder: python3 -m pytest tests"""
+import json
+import tempfile
+import unittest
+
+from account_sizes import AccountSizes, SplitAccount, get_parts_count, order_largest_first, \
+    split_campaign_ids
+
+
+def _in_range(campaign_id, campaign_range):
+    low, high = campaign_range
+    return (low is None or campaign_id >= low) and (high is None or campaign_id <= high)
+
+
+class SplitCampaignIdsTest(unittest.TestCase):
+
+    def _check_partition(self, campaign_ids, ranges):
+        """Checks that every campaign id is in exactly one range. Returns the ids per range"""
+        ids_per_range = [[campaign_id for campaign_id in sorted(set(campaign_ids)) if
+                          _in_range(campaign_id, campaign_range)] for campaign_range in ranges]
+        self.assertEqual(sorted(campaign_id for ids in ids_per_range for campaign_id in ids),
+                         sorted(set(campaign_ids)))
+        self.assertIsNone(ranges[0][0])
+        self.assertIsNone(ranges[-1][1])
+        return ids_per_range
+
+    def test_no_campaign_gives_a_single_open_range(self):
+        self.assertEqual(split_campaign_ids([], 4), [(None, None)])
+        self.assertEqual(split_campaign_ids([7], 4), [(None, None)])
+        self.assertEqual(split_campaign_ids([1, 2, 3], 1), [(None, None)])
+
+    def test_even_split(self):
+        self.assertEqual(split_campaign_ids([10, 20, 30, 40], 2), [(None, 29), (30, None)])
+
+    def test_uneven_remainders(self):
+        for campaigns_count in range(2, 30):
+            for parts_count in range(2, 8):
+                campaign_ids = list(range(100, 100 + 3 * campaigns_count, 3))
+                ranges = split_campaign_ids(campaign_ids, parts_count)
+                self.assertEqual(len(ranges), min(parts_count, campaigns_count))
+                sizes = [len(ids) for ids in self._check_partition(campaign_ids, ranges)]
+                self.assertLessEqual(max(sizes) - min(sizes), 1, (campaigns_count, parts_count))
+
+    def test_more_parts_than_campaigns(self):
+        ranges = split_campaign_ids([5, 9, 12], 10)
+        self.assertEqual(ranges, [(None, 8), (9, 11), (12, None)])
+
+    def test_unsorted_and_repeated_ids(self):
+        campaign_ids = [50, 10, 40, 10, 30, 20, 50]
+        ranges = split_campaign_ids(campaign_ids, 2)
+        self.assertEqual(ranges, split_campaign_ids(sorted(set(campaign_ids)), 2))
+        self._check_partition(campaign_ids, ranges)
+
+
+class GetPartsCountTest(unittest.TestCase):
+
+    def test_accounts_up_to_the_threshold_are_not_split(self):
+        self.assertEqual(get_parts_count(1000, 1000, 8), 1)
+        self.assertEqual(get_parts_count(1001, 1000, 8), 2)
+        self.assertEqual(get_parts_count(2000, 1000, 8), 2)
+        self.assertEqual(get_parts_count(2001, 1000, 8), 3)
+
+    def test_parts_are_capped(self):
+        self.assertEqual(get_parts_count(100000, 1000, 8), 8)
+        self.assertEqual(get_parts_count(100000, 1000, 0), 1)
+
+    def test_unknown_size_or_no_threshold(self):
+        self.assertEqual(get_parts_count(None, 1000, 8), 1)
+        self.assertEqual(get_parts_count(0, 1000, 8), 1)
+        self.assertEqual(get_parts_count(5000, 0, 8), 1)
+
+
+class AccountSizesTest(unittest.TestCase):
+
+    def setUp(self):
+        self._cache_path = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._cache_path.cleanup()
+
+    def test_sizes_are_stored_per_top_mcc_and_shard(self):
+        sizes = AccountSizes(self._cache_path.name, "1")
+        self.assertIsNone(sizes.get("2"))
+        sizes.record("2", 120)
+        sizes.save()
+        AccountSizes(self._cache_path.name, "1", "_shard1of2").save()
+
+        self.assertEqual(AccountSizes(self._cache_path.name, "1").get("2"), 120)
+        self.assertIsNone(AccountSizes(self._cache_path.name, "1", "_shard1of2").get("2"))
+        self.assertIsNone(AccountSizes(self._cache_path.name, "9").get("2"))
+
+    def test_size_of_a_split_account_sums_its_parts(self):
+        with open(AccountSizes(self._cache_path.name, "1").get_sizes_file(), 'w',
+                  encoding='utf-8') as file_object:
+            json.dump({"accounts": {"2": 500}}, file_object)
+        sizes = AccountSizes(self._cache_path.name, "1")
+        self.assertEqual(sizes.get("2"), 500)
+        sizes.record("2", 40, (None, 99))
+        sizes.record("2", 30, (100, None))
+        self.assertEqual(sizes.get("2"), 70)
+        # A part audited again replaces its earlier count
+        sizes.record("2", 35, (100, None))
+        self.assertEqual(sizes.get("2"), 75)
+
+    def test_unreadable_file_is_ignored(self):
+        sizes = AccountSizes(self._cache_path.name, "1")
+        with open(sizes.get_sizes_file(), 'w', encoding='utf-8') as file_object:
+            file_object.write('{"accounts": {"2": 1')
+        self.assertIsNone(AccountSizes(self._cache_path.name, "1").get("2"))
+
+    def test_largest_accounts_first_unknown_sizes_before(self):
+        sizes = {"a": 10, "b": None, "c": 30, "d": 10, "e": None}
+        self.assertEqual(order_largest_first(list(sizes), sizes.get), ["b", "e", "c", "a", "d"])
+
+
+class SplitAccountTest(unittest.TestCase):
+
+    def test_the_last_part_done_gets_the_results_of_all_the_parts(self):
+        split_account = SplitAccount({"account_id": "1"}, [(None, 9), (10, 19), (20, None)])
+        first_part, second_part, third_part = split_account.parts
+        self.assertEqual(first_part.account, {"account_id": "1"})
+        self.assertIsNone(split_account.add_part_result(third_part, 3))
+        error = RuntimeError("Part failed")
+        self.assertIsNone(split_account.add_part_result(first_part, error))
+        self.assertEqual(split_account.add_part_result(second_part, 2),
+                         [(third_part, 3), (first_part, error), (second_part, 2)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the AdRecordExtractor on proto-plus batches, also checked against the per row
+conversion it replaced. Run from the src folder: python3 -m pytest tests"""
+import unittest
+
+from google.ads.googleads.client import GoogleAdsClient
+
+from ad_records import AdRecordExtractor
+from benchmarks.extraction_benchmark import legacy_convert
+from topic_matcher import TopicMatcher
+
+_ACCOUNT = {"account_id": "1234567890", "hierarchy": "1000000000_1234567890"}
+
+
+class AdRecordExtractorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = GoogleAdsClient(None, "test", use_proto_plus=True)
+        self.enums = self.client.enums
+        self.batch = self.client.get_type("SearchGoogleAdsStreamResponse")
+        self.topic_matcher = TopicMatcher([], [])
+
+    def _add_row(self, ad_type, topics=(), final_urls=()):
+        row = self.client.get_type("GoogleAdsRow")
+        row.campaign.id = 11
+        row.ad_group_ad.ad_group = "customers/1234567890/adGroups/22"
+        row.ad_group_ad.ad.id = 33 + len(self.batch.results)
+        row.ad_group_ad.ad.type_ = ad_type
+        row.ad_group_ad.ad.final_urls.extend(final_urls)
+        for topic, evidence_texts in topics:
+            entry = self.client.get_type("PolicyTopicEntry")
+            entry.topic = topic
+            entry.type_ = self.enums.PolicyTopicEntryTypeEnum.PROHIBITED
+            if evidence_texts:
+                evidence = self.client.get_type("PolicyTopicEvidence")
+                evidence.text_list.texts.extend(evidence_texts)
+                entry.evidences.append(evidence)
+            row.ad_group_ad.policy_summary.policy_topic_entries.append(entry)
+        self.batch.results.append(row)
+        return row
+
+    def _extract(self, ids_only=False):
+        rows = [ad_record.to_row() for ad_record in
+                AdRecordExtractor(self.topic_matcher, ids_only).extract(self.batch, _ACCOUNT)]
+        self.assertEqual(rows, legacy_convert(self.topic_matcher, self.batch, ids_only))
+        return rows
+
+    def test_ads_without_policy_topics_are_skipped(self):
+        self._add_row(self.enums.AdTypeEnum.TEXT_AD)
+        self.assertEqual(self._extract(), [])
+
+    def test_ads_without_a_relevant_topic_are_skipped(self):
+        self.topic_matcher = TopicMatcher(["alcohol"], ["alcohol", "gambling"])
+        self._add_row(self.enums.AdTypeEnum.TEXT_AD, [("GAMBLING", ["casino"])])
+        kept_row = self._add_row(self.enums.AdTypeEnum.TEXT_AD, [("Alcohol", ["beer"])])
+        rows = self._extract()
+        self.assertEqual([row["ad_id"] for row in rows], [kept_row.ad_group_ad.ad.id])
+
+    def test_several_topics_and_their_evidences(self):
+        self._add_row(self.enums.AdTypeEnum.TEXT_AD,
+                      [("ALCOHOL", ["beer", "wine"]), ("Gambling", []), ("trademarks", ["x"])],
+                      ["https://www.example.com"])
+        row, = self._extract()
+        self.assertEqual(row["policy_topics"], "['alcohol', 'gambling', 'trademarks']")
+        self.assertEqual(row["evidences"],
+                         "[{'topic': 'ALCOHOL', 'type': 'PROHIBITED', "
+                         "'array': ['\\t\\tevidence text[0]: beer', "
+                         "'\\t\\tevidence text[1]: wine']}, "
+                         "{'topic': 'Gambling', 'type': 'PROHIBITED', 'array': []}, "
+                         "{'topic': 'trademarks', 'type': 'PROHIBITED', "
+                         "'array': ['\\t\\tevidence text[0]: x']}]")
+        self.assertEqual(row["ad_group_id"], "22")
+        self.assertEqual(row["final_urls"], "https://www.example.com")
+
+    def test_enum_names(self):
+        row = self._add_row(self.enums.AdTypeEnum.RESPONSIVE_SEARCH_AD, [("alcohol", ["beer"])])
+        headline = self.client.get_type("AdTextAsset")
+        headline.text = "Headline"
+        headline.pinned_field = self.enums.ServedAssetFieldTypeEnum.HEADLINE_1
+        row.ad_group_ad.ad.responsive_search_ad.headlines.append(headline)
+        extracted_row, = self._extract()
+        self.assertEqual(extracted_row["ad_type"], "RESPONSIVE_SEARCH_AD")
+        self.assertIn("'type': 'PROHIBITED'", extracted_row["evidences"])
+        ids_only_row, = self._extract(ids_only=True)
+        self.assertEqual(ids_only_row["mandatory_data"], "{'type': 'RESPONSIVE_SEARCH_AD'}")
+
+    def test_ad_types_without_final_urls(self):
+        self._add_row(self.enums.AdTypeEnum.CALL_AD, [("alcohol", ["beer"])])
+        self._add_row(self.enums.AdTypeEnum.IMAGE_AD, [("alcohol", [])])
+        call_row, image_row = self._extract()
+        self.assertEqual(call_row["final_urls"], "")
+        self.assertEqual(call_row["mandatory_data"], "{'type': 'CALL_AD'}")
+        self.assertEqual(image_row["ad_type"], "IMAGE_AD")
+
+
+if __name__ == "__main__":
+    unittest.main()
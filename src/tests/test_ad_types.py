@@ -0,0 +1,51 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the validation of the ad types of the disapproved ads query. Run from the src
+folder: python3 -m pytest tests"""
+import contextlib
+import io
+import unittest
+
+from google.ads.googleads.client import GoogleAdsClient
+
+import main
+from gads_connector import AD_TYPES, build_disapproved_ads_query
+
+
+class AdTypesTest(unittest.TestCase):
+
+    def test_ad_types_are_those_of_the_api(self):
+        client = GoogleAdsClient(None, "fake-developer-token", use_proto_plus=True)
+        self.assertEqual(set(AD_TYPES), {ad_type.name for ad_type in client.enums.AdTypeEnum} -
+                         {"UNSPECIFIED", "UNKNOWN"})
+
+    def test_ad_types_flag_accepts_ad_type_names(self):
+        args = main.parse_args(["-id", "1", "-ad_types", "text_ad", "RESPONSIVE_SEARCH_AD"])
+        self.assertEqual(args.ad_types, ["TEXT_AD", "RESPONSIVE_SEARCH_AD"])
+
+    def test_ad_types_flag_rejects_other_values(self):
+        for ad_type in ("TEXT_ADS", "TEXT_AD) OR (1 = 1", "UNSPECIFIED"):
+            with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+                main.parse_args(["-id", "1", "-ad_types", ad_type])
+
+    def test_query_rejects_other_ad_types(self):
+        self.assertIn("ad_group_ad.ad.type IN (TEXT_AD, IMAGE_AD)",
+                      build_disapproved_ads_query(["TEXT_AD", "IMAGE_AD"]))
+        with self.assertRaises(ValueError):
+            build_disapproved_ads_query(["TEXT_AD", "TEXT_AD) OR (1 = 1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of BqBackgroundWriter against a FakeBigQueryClient. Run from the src folder:
+python3 -m pytest tests"""
+import unittest
+from unittest import mock
+
+from google.cloud import bigquery
+
+import bq_writer
+from bq_connector import BqServiceWrapper
+from bq_writer import BqBackgroundWriter
+from fakes.bigquery_client import FakeBigQueryClient
+
+_DATASET_ID = "test_dataset"
+_TABLE_ID = "Ads"
+_SCHEMA = [bigquery.SchemaField("ad_id", "INTEGER", mode="REQUIRED"),
+           bigquery.SchemaField("status", "STRING")]
+
+
+class FlakyBigQueryClient(FakeBigQueryClient):
+    """Fails the first {failures} insert requests before they reach the table"""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.insert_requests = 0
+        self._failures = failures
+
+    def insert_rows_json(self, table_full_name, json_rows, row_ids=None):
+        self.insert_requests += 1
+        if self.insert_requests <= self._failures:
+            raise ConnectionError("Fake connection loss")
+        return super().insert_rows_json(table_full_name, json_rows, row_ids=row_ids)
+
+
+@mock.patch.object(bq_writer, "_RETRY_BACKOFF_SECONDS", 0.0)
+class BqBackgroundWriterTest(unittest.TestCase):
+
+    def _create_service(self, client):
+        service = BqServiceWrapper(_DATASET_ID, client=client)
+        service.create_table(_TABLE_ID, _SCHEMA)
+        return service
+
+    def _rows(self, client):
+        return client.rows(f"{client.project}.{_DATASET_ID}.{_TABLE_ID}")
+
+    def test_transient_error_is_retried(self):
+        client = FlakyBigQueryClient(failures=2)
+        writer = BqBackgroundWriter(self._create_service(client), _TABLE_ID)
+        writer.add_rows([{"ad_id": ad_id, "status": "SCANNED"} for ad_id in range(10)])
+        writer.close()
+        self.assertEqual(client.insert_requests, 3)
+        self.assertEqual(sorted(row["ad_id"] for row in self._rows(client)), list(range(10)))
+
+    def test_gives_up_after_max_retries(self):
+        client = FlakyBigQueryClient(failures=10)
+        writer = BqBackgroundWriter(self._create_service(client), _TABLE_ID, max_retries=2)
+        writer.add_rows([{"ad_id": 1, "status": "SCANNED"}])
+        writer.close()
+        self.assertEqual(client.insert_requests, 3)
+        self.assertEqual(self._rows(client), [])
+
+    def test_partial_row_errors_retry_only_the_stopped_rows(self):
+        client = FakeBigQueryClient()
+        writer = BqBackgroundWriter(self._create_service(client), _TABLE_ID)
+        rows = [{"ad_id": ad_id, "status": "SCANNED"} for ad_id in range(5)]
+        # Rejected by BQ: the other rows of the request are "stopped", and inserted on retry
+        rows.insert(2, {"ad_id": 99, "unknown_field": "x"})
+        rows.append({"status": "SCANNED"})
+        writer.add_rows(rows)
+        writer.close()
+        self.assertEqual(client.requests_count["insert_rows_json"], 2)
+        self.assertEqual(sorted(row["ad_id"] for row in self._rows(client)), list(range(5)))
+
+    def test_close_drains_the_queue(self):
+        client = FakeBigQueryClient()
+        # Neither the batch size nor the delay would flush the rows before close()
+        writer = BqBackgroundWriter(self._create_service(client), _TABLE_ID,
+                                    max_batch_rows=1000, max_delay_seconds=3600.0)
+        for ad_id in range(2500):
+            writer.add_rows([{"ad_id": ad_id, "status": "SCANNED"}])
+        writer.close()
+        self.assertEqual(writer.pending_rows, 0)
+        self.assertEqual(client.requests_count["insert_rows_json"], 3)
+        self.assertEqual(sorted(row["ad_id"] for row in self._rows(client)), list(range(2500)))
+
+    def test_rows_are_copied_when_added(self):
+        client = FakeBigQueryClient()
+        writer = BqBackgroundWriter(self._create_service(client), _TABLE_ID)
+        row = {"ad_id": 1, "status": "SCANNED"}
+        writer.add_rows([row])
+        row["status"] = "REMOVED"
+        writer.close()
+        self.assertEqual(self._rows(client), [{"ad_id": 1, "status": "SCANNED"}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the ChangeWatermarks of incremental audits. Run from the src folder:
+python3 -m pytest tests"""
+import datetime
+import json
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import change_watermarks
+import main
+from benchmarks.synthetic import wide_tree
+from change_watermarks import ChangeWatermarks
+from fakes.google_ads import FakeGoogleAdsClient
+from gads_connector import GAdsServiceWrapper
+from mutate_pipeline import MutatePipeline
+
+_TOP_ID = "1"
+_NOW = 1700000000.0
+_HOUR = 60 * 60
+_SLACK = change_watermarks._TIME_ZONE_SLACK_SECONDS  # pylint: disable=protected-access
+_MAX_HISTORY = change_watermarks._MAX_HISTORY_SECONDS  # pylint: disable=protected-access
+
+
+def _to_datetime(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+@mock.patch.object(change_watermarks.time, "time", return_value=_NOW)
+class ChangeWatermarksTest(unittest.TestCase):
+
+    def setUp(self):
+        self._cache_path = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._cache_path.cleanup()
+
+    def _store(self, watermarks, last_full_sweep=_NOW - _HOUR):
+        watermarks_file = ChangeWatermarks(self._cache_path.name, _TOP_ID).get_watermarks_file()
+        with open(watermarks_file, 'w', encoding='utf-8') as file_object:
+            json.dump({"last_full_sweep": last_full_sweep, "accounts": watermarks}, file_object)
+
+    def _open(self, **kwargs):
+        return ChangeWatermarks(self._cache_path.name, _TOP_ID, lookback_seconds=2 * _HOUR,
+                                **kwargs)
+
+    def test_window_starts_a_lookback_before_the_watermark(self, _):
+        self._store({"2": _NOW - 10 * _HOUR})
+        watermarks = self._open()
+        self.assertFalse(watermarks.is_full_sweep)
+        self.assertEqual(watermarks.get_change_window("2"),
+                         (_to_datetime(_NOW - 12 * _HOUR - _SLACK), _to_datetime(_NOW + _SLACK)))
+
+    def test_account_without_watermark_is_fully_scanned(self, _):
+        self._store({"2": _NOW - 10 * _HOUR})
+        self.assertIsNone(self._open().get_change_window("3"))
+
+    def test_full_sweep_scans_every_account(self, _):
+        self._store({"2": _NOW - 10 * _HOUR}, last_full_sweep=_NOW - 25 * _HOUR)
+        watermarks = self._open()
+        self.assertTrue(watermarks.is_full_sweep)
+        self.assertIsNone(watermarks.get_change_window("2"))
+        self._store({"2": _NOW - 10 * _HOUR})
+        self.assertIsNone(self._open(force_full_sweep=True).get_change_window("2"))
+
+    def test_window_never_starts_before_the_change_history(self, _):
+        # The latest watermark whose window starts beyond the change_status history
+        oldest_watermark = _NOW - _MAX_HISTORY + 2 * _HOUR + _SLACK
+        self._store({"2": oldest_watermark, "3": oldest_watermark - 1})
+        watermarks = self._open()
+        since, _ = watermarks.get_change_window("2")
+        self.assertEqual(since, _to_datetime(_NOW - _MAX_HISTORY))
+        self.assertIsNone(watermarks.get_change_window("3"))
+
+    def test_only_the_audited_accounts_advance(self, _):
+        self._store({"2": _NOW - 10 * _HOUR, "3": _NOW - 10 * _HOUR})
+        watermarks = self._open()
+        watermarks.mark_audited("2")
+        watermarks.mark_audited("4")
+        watermarks.save(session_completed=True)
+
+        stored = watermarks.load()
+        self.assertEqual(stored["accounts"], {"2": _NOW, "3": _NOW - 10 * _HOUR, "4": _NOW})
+        # Not a full sweep: the last one is kept
+        self.assertEqual(stored["last_full_sweep"], _NOW - _HOUR)
+
+    def test_interrupted_full_sweep_is_not_counted(self, _):
+        self._store({}, last_full_sweep=_NOW - 25 * _HOUR)
+        watermarks = self._open()
+        watermarks.save()
+        self.assertEqual(watermarks.load()["last_full_sweep"], _NOW - 25 * _HOUR)
+        watermarks.save(session_completed=True)
+        self.assertEqual(watermarks.load()["last_full_sweep"], _NOW)
+
+
+class IncrementalSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self._output_path = tempfile.TemporaryDirectory()
+        self._tree = wide_tree(1, 1, 3)
+        args = main.parse_args(["-id", self._tree.top_id, "-incremental", "-log_level",
+                                "WARNING"])
+        main.configure(args)
+        for path in ("_OUTPUT_PATH", "_STAGING_PATH", "_JOURNAL_PATH", "_CACHE_PATH"):
+            setattr(main, path, f"{self._output_path.name}/{path.strip('_').lower()}/")
+        main.create_results_folder(main._OUTPUT_PATH)  # pylint: disable=protected-access
+        main.gAdsServiceWrapper = GAdsServiceWrapper(
+            self._tree.top_id, client=FakeGoogleAdsClient(self._tree, 20))
+        main.mutatePipeline = MutatePipeline(main.send_bulk_mutate_request,
+                                             args.mutate_concurrency)
+
+    def tearDown(self):
+        main.mutatePipeline.shutdown()
+        main.changeWatermarks = None
+        self._output_path.cleanup()
+
+    def test_failed_account_keeps_its_watermark(self):
+        account_ids = [client_id for client_id, _, _ in
+                       self._tree.clients_with_levels(self._tree.top_id)]
+        failed_account_id = account_ids[1]
+        last_session = time.time() - 10 * _HOUR
+        watermarks = ChangeWatermarks(main._CACHE_PATH,  # pylint: disable=protected-access
+                                      self._tree.top_id)
+        watermarks.get_watermarks_file().parent.mkdir(parents=True, exist_ok=True)
+        with open(watermarks.get_watermarks_file(), 'w', encoding='utf-8') as file_object:
+            json.dump({"last_full_sweep": time.time() - _HOUR,
+                       "accounts": {account_id: last_session for account_id in account_ids}},
+                      file_object)
+        get_changed_ad_groups = main.get_changed_ad_groups
+
+        def fail_one_account(account_id):
+            if account_id == failed_account_id:
+                raise ConnectionError("Fake connection loss")
+            return get_changed_ad_groups(account_id)
+
+        with mock.patch.object(main, "get_changed_ad_groups", side_effect=fail_one_account):
+            main.main([self._tree.top_id])
+
+        stored = watermarks.load()["accounts"]
+        self.assertEqual(stored[failed_account_id], last_session)
+        for account_id in account_ids:
+            if account_id != failed_account_id:
+                self.assertGreater(stored[account_id], last_session)
+
+
+if __name__ == "__main__":
+    unittest.main()
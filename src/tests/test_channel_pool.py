@@ -0,0 +1,146 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the ChannelPool, on stub services and channels. Run from the src folder:
+python3 -m pytest tests"""
+import unittest
+from collections import namedtuple
+
+from channel_pool import ChannelPool
+
+_State = namedtuple("_State", "name")
+
+
+class StubChannel:
+    """A gRPC channel reporting {state} (or nothing if None) to its subscribers"""
+
+    def __init__(self):
+        self.state = "READY"
+
+    def subscribe(self, callback, try_to_connect=False):
+        if self.state is not None:
+            callback(_State(self.state))
+
+    def unsubscribe(self, callback):
+        pass
+
+
+class StubTransport:
+
+    def __init__(self):
+        self.grpc_channel = StubChannel()
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class StubService:
+
+    def __init__(self, name):
+        self.name = name
+        self.transport = StubTransport()
+
+
+class StubClient:
+    """Opens a new channel per get_service call, like a GoogleAdsClient"""
+
+    def __init__(self):
+        self.services = []
+
+    def get_service(self, name):
+        service = StubService(name)
+        self.services.append(service)
+        return service
+
+
+class ChannelPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self._client = StubClient()
+
+    def test_leases_go_to_the_least_loaded_entry(self):
+        pool = ChannelPool(self._client, size=3)
+        with pool.lease() as first, pool.lease() as second:
+            self.assertIsNot(first, second)
+            self.assertEqual(sorted(pool.get_in_flight()), [0, 1, 1])
+            with pool.lease() as third, pool.lease() as fourth:
+                self.assertEqual(len({id(first), id(second), id(third)}), 3)
+                self.assertEqual(sorted(pool.get_in_flight()), [1, 1, 2])
+                self.assertIn(fourth, (first, second, third))
+        self.assertEqual(pool.get_in_flight(), [0, 0, 0])
+
+    def test_idle_entries_are_leased_round_robin(self):
+        pool = ChannelPool(self._client, size=3)
+        leased = []
+        for _ in range(6):
+            with pool.lease() as channels:
+                leased.append(channels)
+        self.assertEqual(leased[:3], leased[3:])
+        self.assertEqual(len({id(channels) for channels in leased}), 3)
+
+    def test_broken_idle_entry_is_recycled(self):
+        pool = ChannelPool(self._client, size=2, health_check_seconds=0.0)
+        broken = pool.default_channels
+        broken.ad_group_ad_service.transport.grpc_channel.state = "TRANSIENT_FAILURE"
+        with pool.lease() as channels:
+            self.assertIsNot(channels, broken)
+            self.assertEqual(pool.get_in_flight(), [1, 0])
+        self.assertIsNot(pool.default_channels, broken)
+        self.assertTrue(broken.ga_service.transport.closed)
+        self.assertTrue(broken.ad_group_ad_service.transport.closed)
+        self.assertEqual(len(self._client.services), 6)
+
+    def test_entry_is_not_checked_while_in_flight(self):
+        pool = ChannelPool(self._client, size=1, health_check_seconds=0.0)
+        with pool.lease() as first:
+            first.ga_service.transport.grpc_channel.state = "SHUTDOWN"
+            with pool.lease() as second:
+                self.assertIs(second, first)
+        self.assertFalse(first.ga_service.transport.closed)
+        # Checked once idle again
+        with pool.lease() as third:
+            self.assertIsNot(third, first)
+        self.assertTrue(first.ga_service.transport.closed)
+
+    def test_healthy_entries_are_kept(self):
+        pool = ChannelPool(self._client, size=1, health_check_seconds=0.0)
+        with pool.lease() as first:
+            pass
+        first.ga_service.transport.grpc_channel.state = "IDLE"
+        with pool.lease() as second:
+            self.assertIs(second, first)
+        self.assertEqual(len(self._client.services), 2)
+
+    def test_recently_used_entries_are_not_checked(self):
+        pool = ChannelPool(self._client, size=1, health_check_seconds=3600.0)
+        pool.default_channels.ga_service.transport.grpc_channel.state = "SHUTDOWN"
+        with pool.lease() as channels:
+            self.assertIs(channels, pool.default_channels)
+        self.assertEqual(len(self._client.services), 2)
+
+    def test_channel_without_state_is_unhealthy(self):
+        pool = ChannelPool(self._client, size=1)
+        channels = pool.default_channels
+        self.assertTrue(channels.is_healthy(timeout_seconds=0.01))
+        channels.ga_service.transport.grpc_channel.state = None
+        self.assertFalse(channels.is_healthy(timeout_seconds=0.01))
+
+    def test_empty_pool_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ChannelPool(self._client, size=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Partial failures of removal chunks sent through the MutatePipeline. Run from the src folder:
+python3 -m pytest tests"""
+import json
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+import main
+from benchmarks.synthetic import wide_tree
+from fakes.google_ads import FakeGoogleAdsClient
+from gads_connector import GAdsServiceWrapper
+from mutate_pipeline import MutatePipeline
+
+_CHUNK_SIZE = 10
+_CHUNKS_IN_FLIGHT = 3
+_ADS_COUNT = 45
+_FIRST_AD_ID = 700000
+# The first and last ad of chunks, and a whole chunk (30-39)
+_FAILING_INDICES = {0, 9, 10, 19, 20, 29} | set(range(30, 40)) | {44}
+
+
+class MutatePipelinePartialFailureTest(unittest.TestCase):
+
+    def setUp(self):
+        self._output_path = tempfile.TemporaryDirectory()
+        self._tree = wide_tree(1, 1, 1)
+        self._account_id = self._tree.children[self._tree.top_id][0]
+        self._failing_ad_ids = {_FIRST_AD_ID + index for index in _FAILING_INDICES}
+        # The latency keeps several chunks in flight
+        self._client = FakeGoogleAdsClient(self._tree, latency_seconds=0.05,
+                                           failing_removals=self._failing_ad_ids)
+        args = main.parse_args(["-id", self._tree.top_id, "-rm", "--mutate_chunks_in_flight",
+                                str(_CHUNKS_IN_FLIGHT), "-log_level", "WARNING"])
+        main.configure(args)
+        for path in ("_OUTPUT_PATH", "_STAGING_PATH", "_JOURNAL_PATH", "_CACHE_PATH"):
+            setattr(main, path, f"{self._output_path.name}/{path.strip('_').lower()}/")
+        main.create_results_folder(main._OUTPUT_PATH)  # pylint: disable=protected-access
+        self._chunk_size = main._CHUNK_SIZE  # pylint: disable=protected-access
+        main._CHUNK_SIZE = _CHUNK_SIZE  # pylint: disable=protected-access
+        main.gAdsServiceWrapper = GAdsServiceWrapper(self._tree.top_id, client=self._client)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._max_in_flight = 0
+        main.mutatePipeline = MutatePipeline(self._send_mutate, _CHUNKS_IN_FLIGHT)
+        main.start_session(self._tree.top_id)
+
+    def tearDown(self):
+        main.mutatePipeline.shutdown()
+        main._CHUNK_SIZE = self._chunk_size  # pylint: disable=protected-access
+        self._output_path.cleanup()
+
+    def _send_mutate(self, account_id, operations):
+        with self._lock:
+            self._in_flight += 1
+            self._max_in_flight = max(self._max_in_flight, self._in_flight)
+        try:
+            return main.send_bulk_mutate_request(account_id, operations)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _read_output(self, table_id):
+        rows = []
+        for file_path in Path(main._OUTPUT_PATH).glob(  # pylint: disable=protected-access
+                f"{table_id}_*.jsonl"):
+            with open(file_path, encoding='utf-8') as file_object:
+                rows.extend(json.loads(line) for line in file_object)
+        return rows
+
+    def test_partial_failures_are_mapped_back_to_their_ads(self):
+        ads_json = [{"account_id": self._account_id, "ad_group_id": 900 + index // _CHUNK_SIZE,
+                     "ad_id": _FIRST_AD_ID + index} for index in range(_ADS_COUNT)]
+        operations = main.build_ad_removal_sync_operations(self._account_id, ads_json)
+
+        removed_count = main.remove_ads(operations, ads_json, self._account_id)
+        main.stop_session()
+
+        self.assertGreater(self._max_in_flight, 1)
+        self.assertEqual(removed_count, _ADS_COUNT - len(_FAILING_INDICES))
+        expected_removed = {ad["ad_id"] for ad in ads_json} - self._failing_ad_ids
+        self.assertEqual(self._client.get_removed_ads(self._account_id), expected_removed)
+        rows = {row["ad_id"]: row for row in self._read_output("AdsToRemove")}
+        self.assertEqual(sorted(rows), [ad["ad_id"] for ad in ads_json])
+        for ad_id, row in rows.items():
+            if ad_id in self._failing_ad_ids:
+                self.assertEqual(row["bowling_status"], "FAILED_TO_REMOVE")
+                # The error is the one of this very ad, not of another ad of the chunk
+                self.assertIn(f"Fake removal failure of ad {ad_id}", row["removal_error"])
+            else:
+                self.assertEqual(row["bowling_status"], "REMOVED")
+                self.assertNotIn("removal_error", row)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the NdjsonSink output files. Run from the src folder: python3 -m pytest tests"""
+import gzip
+import json
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+import main
+from output_sink import NdjsonSink
+
+_THREADS = 8
+_RECORDS_PER_THREAD = 500
+
+
+class NdjsonSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self._output_path = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._output_path.cleanup()
+
+    def _read_lines(self, pattern):
+        """Returns the lines of the matching files by file name"""
+        lines = {}
+        for file_path in sorted(Path(self._output_path.name).glob(pattern)):
+            open_function = gzip.open if file_path.suffix == ".gz" else open
+            with open_function(file_path, 'rt', encoding='utf-8') as file_object:
+                lines[file_path.name] = file_object.read().splitlines()
+        return lines
+
+    def _write_from_threads(self, sink):
+        def write(thread_index):
+            for index in range(_RECORDS_PER_THREAD):
+                sink.write([{"thread": thread_index, "index": index, "text": "x" * index}])
+
+        threads = [threading.Thread(target=write, args=(thread_index,)) for thread_index in
+                   range(_THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        sink.close()
+
+    def _check_records(self, lines):
+        records = [json.loads(line) for file_lines in lines.values() for line in file_lines]
+        self.assertEqual(sorted((record["thread"], record["index"]) for record in records),
+                         [(thread_index, index) for thread_index in range(_THREADS) for index in
+                          range(_RECORDS_PER_THREAD)])
+
+    def test_files_are_created_on_the_first_write(self):
+        sink = NdjsonSink(self._output_path.name, "Ads_1")
+        sink.close()
+        self.assertEqual(self._read_lines("*"), {})
+        sink.write([{"ad_id": 1}])
+        sink.write([])
+        sink.close()
+        self.assertEqual(self._read_lines("*"), {"Ads_1.jsonl": ['{"ad_id": 1}']})
+
+    def test_files_rotate_past_max_file_bytes(self):
+        sink = NdjsonSink(self._output_path.name, "Ads_1", max_file_bytes=1000)
+        for index in range(100):
+            sink.write([{"ad_id": index, "padding": "x" * 80}])
+        sink.close()
+        lines = self._read_lines("Ads_1_*.jsonl")
+        self.assertGreater(len(lines), 1)
+        self.assertEqual([json.loads(line)["ad_id"] for file_lines in lines.values() for line in
+                          file_lines], list(range(100)))
+        # Only the last part may be smaller than max_file_bytes
+        sizes = [len("\n".join(file_lines)) + 1 for file_lines in lines.values()]
+        self.assertTrue(all(size >= 1000 for size in sizes[:-1]))
+        self.assertTrue(all(size < 1000 + 100 for size in sizes))
+        self.assertEqual(sink.records_count, 100)
+
+    def test_threads_write_whole_lines(self):
+        sink = NdjsonSink(self._output_path.name, "Ads_1")
+        self._write_from_threads(sink)
+        lines = self._read_lines("Ads_1*")
+        self.assertEqual(list(lines), ["Ads_1.jsonl"])
+        self._check_records(lines)
+        self.assertEqual(sink.records_count, _THREADS * _RECORDS_PER_THREAD)
+
+    def test_threads_write_whole_lines_across_gzipped_parts(self):
+        sink = NdjsonSink(self._output_path.name, "Ads_1", compress=True,
+                          max_file_bytes=64 * 1024)
+        self._write_from_threads(sink)
+        lines = self._read_lines("Ads_1_*.jsonl.gz")
+        self.assertGreater(len(lines), 1)
+        self._check_records(lines)
+
+
+class SessionOutputSinksTest(unittest.TestCase):
+
+    def setUp(self):
+        self._output_path = tempfile.TemporaryDirectory()
+        main.configure(main.parse_args(["-id", "1", "-log_level", "WARNING"]))
+        main._OUTPUT_PATH = f"{self._output_path.name}/"  # pylint: disable=protected-access
+
+    def tearDown(self):
+        main.stop_output_sinks()
+        self._output_path.cleanup()
+
+    def test_one_file_per_table(self):
+        main.start_output_sinks()
+        table_ids = list(main.outputSinks)
+        self.assertEqual(sorted(table_ids),
+                         sorted(main._TABLE_NAMES))  # pylint: disable=protected-access
+
+        def write(thread_index):
+            for index in range(100):
+                for table_id in table_ids:
+                    main.write_to_file(table_id, [{"thread": thread_index, "index": index}])
+
+        threads = [threading.Thread(target=write, args=(thread_index,)) for thread_index in
+                   range(_THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        main.stop_output_sinks()
+
+        for table_id in table_ids:
+            files = list(Path(self._output_path.name).glob(f"{table_id}_*"))
+            self.assertEqual(len(files), 1, table_id)
+            with open(files[0], encoding='utf-8') as file_object:
+                records = [json.loads(line) for line in file_object]
+            self.assertEqual(len(records), _THREADS * 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
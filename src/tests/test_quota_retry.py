@@ -0,0 +1,84 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A parallel session whose API requests hit quota errors. Run from the src folder:
+python3 -m pytest tests"""
+import json
+import tempfile
+import unittest
+from collections import Counter
+from pathlib import Path
+
+import main
+from benchmarks.synthetic import wide_tree
+from fakes.google_ads import FakeGoogleAdsClient
+from gads_connector import GAdsServiceWrapper
+from mutate_pipeline import MutatePipeline
+
+_ADS_PER_ACCOUNT = 60
+_QUOTA_ERROR_RATE = 0.2
+
+
+class QuotaRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self._output_path = tempfile.TemporaryDirectory()
+        self._tree = wide_tree(2, 2, 3)
+        self._client = FakeGoogleAdsClient(self._tree, _ADS_PER_ACCOUNT,
+                                           quota_error_rate=_QUOTA_ERROR_RATE)
+        self._args = main.parse_args(["-id", self._tree.top_id, "-rm", "-log_level", "WARNING"])
+        main.configure(self._args)
+        for path in ("_OUTPUT_PATH", "_STAGING_PATH", "_JOURNAL_PATH", "_CACHE_PATH"):
+            setattr(main, path, f"{self._output_path.name}/{path.strip('_').lower()}/")
+        main.create_results_folder(main._OUTPUT_PATH)  # pylint: disable=protected-access
+        # Enough retries for the test not to depend on the draws of the fake
+        main.gAdsServiceWrapper = GAdsServiceWrapper(self._tree.top_id, max_retries=10,
+                                                     client=self._client)
+        main.mutatePipeline = MutatePipeline(main.send_bulk_mutate_request,
+                                             self._args.mutate_concurrency)
+
+    def tearDown(self):
+        main.mutatePipeline.shutdown()
+        self._output_path.cleanup()
+
+    def _read_output(self, table_id):
+        rows = []
+        for file_path in Path(main._OUTPUT_PATH).glob(  # pylint: disable=protected-access
+                f"{table_id}_*.jsonl"):
+            with open(file_path, encoding='utf-8') as file_object:
+                rows.extend(json.loads(line) for line in file_object)
+        return rows
+
+    def test_quota_errors_are_retried_without_running_an_account_twice(self):
+        main.main(self._args.top_id)
+        self.assertGreater(main.gAdsServiceWrapper.retry_policy.retries_count, 0)
+
+        # Every account of the tree is audited, the managers included
+        account_ids = [client_id for client_id, _, _ in
+                       self._tree.clients_with_levels(self._tree.top_id)]
+        ads_count = len(account_ids) * _ADS_PER_ACCOUNT
+        ad_rows = self._read_output("AdsToRemove")
+        statuses = Counter(row["bowling_status"] for row in ad_rows)
+        self.assertEqual(statuses, {"SCANNED": ads_count, "REMOVED": ads_count})
+        ad_keys = {(row["account_id"], row["ad_id"], row["bowling_status"]) for row in ad_rows}
+        self.assertEqual(len(ad_keys), len(ad_rows))
+        summaries = self._read_output("PerAccountSummary")
+        self.assertEqual(sorted(summary["account_id"] for summary in summaries),
+                         sorted(account_ids))
+        self.assertTrue(all(summary["ads_to_remove_count"] == _ADS_PER_ACCOUNT for summary in
+                            summaries))
+
+
+if __name__ == "__main__":
+    unittest.main()
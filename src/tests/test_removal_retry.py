@@ -0,0 +1,77 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An account retried in the same run after failing mid-removal. Run from the src folder:
+python3 -m pytest tests"""
+import tempfile
+import unittest
+
+import main
+from benchmarks.synthetic import wide_tree
+from fakes.google_ads import FakeGoogleAdsClient
+from gads_connector import GAdsServiceWrapper
+from mutate_pipeline import MutatePipeline
+
+_ADS_PER_ACCOUNT = 120
+_CHUNK_SIZE = 20
+_FAILED_MUTATE = 3
+
+
+class RemovalRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self._output_path = tempfile.TemporaryDirectory()
+        self._tree = wide_tree(1, 1, 1)
+        self._client = FakeGoogleAdsClient(self._tree, _ADS_PER_ACCOUNT)
+        args = main.parse_args(["-id", self._tree.top_id, "-rm", "--mutate_chunks_in_flight",
+                                "1", "-log_level", "WARNING"])
+        main.configure(args)
+        for path in ("_OUTPUT_PATH", "_STAGING_PATH", "_JOURNAL_PATH", "_CACHE_PATH"):
+            setattr(main, path, f"{self._output_path.name}/{path.strip('_').lower()}/")
+        main.create_results_folder(main._OUTPUT_PATH)  # pylint: disable=protected-access
+        self._chunk_size = main._CHUNK_SIZE  # pylint: disable=protected-access
+        main._CHUNK_SIZE = _CHUNK_SIZE  # pylint: disable=protected-access
+        main.gAdsServiceWrapper = GAdsServiceWrapper(self._tree.top_id, client=self._client)
+        self._mutates_count = 0
+        main.mutatePipeline = MutatePipeline(self._send_mutate_failing_once, 1)
+        main.start_session(self._tree.top_id)
+
+    def tearDown(self):
+        main.stop_session()
+        main.mutatePipeline.shutdown()
+        main._CHUNK_SIZE = self._chunk_size  # pylint: disable=protected-access
+        self._output_path.cleanup()
+
+    def _send_mutate_failing_once(self, account_id, operations):
+        self._mutates_count += 1
+        if self._mutates_count == _FAILED_MUTATE:
+            # Not an API error: fails the account rather than the chunk
+            raise ConnectionError("Fake connection loss")
+        return main.send_bulk_mutate_request(account_id, operations)
+
+    def test_retried_account_counts_the_ads_removed_by_its_failed_attempt(self):
+        account = main.add_session_identifiers_bq_columns(
+            {"account_id": self._tree.children[self._tree.top_id][0],
+             "hierarchy": self._tree.top_id, "top_id": self._tree.top_id})
+        self.assertIsNone(main.audit_account(account))
+        removed_count = len(self._client.get_removed_ads(account["account_id"]))
+        self.assertEqual(removed_count, (_FAILED_MUTATE - 1) * _CHUNK_SIZE)
+
+        self.assertEqual(main.audit_account(account), _ADS_PER_ACCOUNT)
+        self.assertEqual(len(self._client.get_removed_ads(account["account_id"])),
+                         _ADS_PER_ACCOUNT)
+
+
+if __name__ == "__main__":
+    unittest.main()
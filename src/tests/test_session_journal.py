@@ -0,0 +1,162 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the SessionJournal, and of a session resumed from it. Run from the src folder:
+python3 -m pytest tests"""
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+import main
+from benchmarks.synthetic import wide_tree
+from fakes.google_ads import FakeGoogleAdsClient
+from gads_connector import GAdsServiceWrapper
+from mutate_pipeline import MutatePipeline
+from session_journal import SessionJournal, get_journal_file
+
+_SESSION_ID = "journal-test-session"
+_ADS_PER_ACCOUNT = 30
+
+
+class SessionJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self._journal_path = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._journal_path.cleanup()
+
+    def _open(self):
+        return SessionJournal(self._journal_path.name, _SESSION_ID)
+
+    def test_replays_the_recorded_progress(self):
+        journal = self._open()
+        journal.record_accounts("1", [{"account_id": "2"}, {"account_id": "3"}])
+        journal.record_chunk_removed("2", 10)
+        journal.record_chunk_removed("2", 5)
+        journal.record_account_completed("3", 4)
+        journal.close()
+
+        journal = self._open()
+        self.assertEqual(journal.accounts, [{"account_id": "2"}, {"account_id": "3"}])
+        self.assertEqual(journal.get_removed_count("2"), 15)
+        self.assertIsNone(journal.get_completed_count("2"))
+        self.assertEqual(journal.get_completed_count("3"), 4)
+        journal.close()
+
+    def test_line_cut_by_a_crash_is_ignored(self):
+        journal = self._open()
+        journal.record_chunk_removed("2", 10)
+        journal.close()
+        journal_file = get_journal_file(self._journal_path.name, _SESSION_ID)
+        with open(journal_file, 'a', encoding='utf-8') as file_object:
+            file_object.write('{"type": "account", "account_id": "2", "ads_c')
+
+        journal = self._open()
+        self.assertIsNone(journal.get_completed_count("2"))
+        # The next record starts on its own line, so it is not lost with the cut one
+        journal.record_account_completed("2", 12)
+        journal.close()
+
+        journal = self._open()
+        self.assertEqual(journal.get_removed_count("2"), 10)
+        self.assertEqual(journal.get_completed_count("2"), 12)
+        journal.close()
+
+    def test_other_top_id_is_rejected(self):
+        journal = self._open()
+        journal.record_accounts("1", [])
+        journal.close()
+
+        journal = self._open()
+        journal.check_top_id("1")
+        with self.assertRaises(ValueError):
+            journal.check_top_id("9")
+        journal.close()
+
+    def test_completed_session_deletes_its_journal(self):
+        journal = self._open()
+        journal.record_chunk_removed("2", 10)
+        journal.close(session_completed=True)
+        self.assertFalse(get_journal_file(self._journal_path.name, _SESSION_ID).exists())
+
+
+class ResumedSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self._output_path = tempfile.TemporaryDirectory()
+        self._tree = wide_tree(1, 1, 3)
+        self._args = main.parse_args(["-id", self._tree.top_id, "-rm", "-session_id",
+                                      _SESSION_ID, "-log_level", "WARNING"])
+        main.configure(self._args)
+        for path in ("_OUTPUT_PATH", "_STAGING_PATH", "_JOURNAL_PATH", "_CACHE_PATH"):
+            setattr(main, path, f"{self._output_path.name}/{path.strip('_').lower()}/")
+        main.create_results_folder(main._OUTPUT_PATH)  # pylint: disable=protected-access
+        self._client = FakeGoogleAdsClient(self._tree, _ADS_PER_ACCOUNT)
+        main.gAdsServiceWrapper = GAdsServiceWrapper(self._tree.top_id, client=self._client)
+        main.mutatePipeline = MutatePipeline(main.send_bulk_mutate_request,
+                                             self._args.mutate_concurrency)
+
+    def tearDown(self):
+        main.mutatePipeline.shutdown()
+        self._output_path.cleanup()
+
+    def _start_interrupted_session(self, completed_account_id, completed_count):
+        """Journals the discovered accounts and one completed account, like a session stopped
+        after its first account"""
+        main.start_session(self._tree.top_id)
+        main.get_accounts([self._tree.top_id], self._tree.top_id)
+        main.sessionJournal.record_account_completed(completed_account_id, completed_count)
+        main.stop_session()
+
+    def _read_output(self, table_id):
+        rows = []
+        for file_path in Path(main._OUTPUT_PATH).glob(  # pylint: disable=protected-access
+                f"{table_id}_*.jsonl"):
+            with open(file_path, encoding='utf-8') as file_object:
+                rows.extend(json.loads(line) for line in file_object)
+        return rows
+
+    def test_resumed_session_skips_the_completed_accounts(self):
+        completed_account_id = self._tree.children[self._tree.top_id][0]
+        self._start_interrupted_session(completed_account_id, 7)
+
+        main.main([self._tree.top_id])
+
+        account_ids = [client_id for client_id, _, _ in
+                       self._tree.clients_with_levels(self._tree.top_id)]
+        for account_id in account_ids:
+            removed_ads = self._client.get_removed_ads(account_id)
+            self.assertEqual(len(removed_ads),
+                             0 if account_id == completed_account_id else _ADS_PER_ACCOUNT)
+        # The summary of the completed account was written by the interrupted run
+        summaries = [summary["account_id"] for summary in
+                     self._read_output("PerAccountSummary")]
+        self.assertEqual(sorted(summaries),
+                         sorted(set(account_ids) - {completed_account_id}))
+        journal_file = get_journal_file(main._JOURNAL_PATH,  # pylint: disable=protected-access
+                                        _SESSION_ID)
+        self.assertFalse(journal_file.exists())
+
+    def test_session_of_another_top_mcc_is_not_resumed(self):
+        self._start_interrupted_session(self._tree.children[self._tree.top_id][0], 7)
+
+        with self.assertRaises(ValueError):
+            main.main(["999"])
+        self.assertEqual(self._client.get_removed_ads(self._tree.top_id), set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The rollups of a session over several top MCCs, against its detail rows. Run from the src
+folder: python3 -m pytest tests"""
+import json
+import tempfile
+import unittest
+from collections import Counter
+from pathlib import Path
+from unittest import mock
+
+import main
+from benchmarks.synthetic import wide_tree
+from fakes.google_ads import FakeGoogleAdsClient
+from gads_connector import GAdsServiceWrapper
+from mutate_pipeline import MutatePipeline
+
+_ADS_PER_ACCOUNT = 40
+_FAILING_REMOVALS = (500000003, 500000010, 500000011)
+
+
+class SessionRollupTest(unittest.TestCase):
+
+    def setUp(self):
+        self._output_path = tempfile.TemporaryDirectory()
+        tree = wide_tree(2, 2, 2)
+        # The sub-MCCs of the tree are the top MCCs of the session
+        self._top_ids = [child_id for child_id in tree.children[tree.top_id] if
+                         tree.is_manager(child_id)]
+        self._failed_account_id = tree.children[self._top_ids[1]][0]
+        args = main.parse_args(["-id", *self._top_ids, "-rm", "-log_level", "WARNING"])
+        main.configure(args)
+        for path in ("_OUTPUT_PATH", "_STAGING_PATH", "_JOURNAL_PATH", "_CACHE_PATH"):
+            setattr(main, path, f"{self._output_path.name}/{path.strip('_').lower()}/")
+        main.create_results_folder(main._OUTPUT_PATH)  # pylint: disable=protected-access
+        client = FakeGoogleAdsClient(tree, _ADS_PER_ACCOUNT, failing_removals=_FAILING_REMOVALS)
+        main.gAdsServiceWrapper = GAdsServiceWrapper(tree.top_id, client=client)
+        main.mutatePipeline = MutatePipeline(main.send_bulk_mutate_request,
+                                             args.mutate_concurrency)
+
+    def tearDown(self):
+        main.mutatePipeline.shutdown()
+        self._output_path.cleanup()
+
+    def _read_output(self, table_id):
+        rows = []
+        for file_path in Path(main._OUTPUT_PATH).glob(  # pylint: disable=protected-access
+                f"{table_id}_*.jsonl"):
+            with open(file_path, encoding='utf-8') as file_object:
+                rows.extend(json.loads(line) for line in file_object)
+        return rows
+
+    def _run_session(self):
+        get_changed_ad_groups = main.get_changed_ad_groups
+
+        def fail_one_account(account_id):
+            if account_id == self._failed_account_id:
+                raise ConnectionError("Fake connection loss")
+            return get_changed_ad_groups(account_id)
+
+        with mock.patch.object(main, "get_changed_ad_groups", side_effect=fail_one_account):
+            main.main(self._top_ids)
+
+    def test_rollups_sum_the_detail_rows(self):
+        self._run_session()
+
+        top_ids = {row["account_id"]: row["top_id"] for row in self._read_output("AllAccounts")}
+        self.assertEqual(set(top_ids.values()), set(self._top_ids))
+        # The last status of every ad
+        statuses = {}
+        for row in self._read_output("AdsToRemove"):
+            statuses[(row["account_id"], row["ad_group_id"], row["ad_id"])] = \
+                row["bowling_status"]
+        status_counts = {account_id: Counter() for account_id in top_ids}
+        for (account_id, _, _), status in statuses.items():
+            status_counts[account_id][status] += 1
+        self.assertGreater(sum(counts["FAILED_TO_REMOVE"] for counts in status_counts.values()),
+                           0)
+
+        account_rollups = {row["account_id"]: row for row in self._read_output("AccountRollup")}
+        self.assertEqual(sorted(account_rollups), sorted(top_ids))
+        for account_id, rollup in account_rollups.items():
+            counts = status_counts[account_id]
+            self.assertEqual(rollup["top_id"], top_ids[account_id])
+            self.assertEqual(rollup["ads_to_remove"], sum(counts.values()))
+            self.assertEqual(rollup["removed_ads"], counts["REMOVED"])
+            self.assertEqual(rollup["failed_to_remove_ads"], counts["FAILED_TO_REMOVE"])
+            self.assertEqual(rollup["error"] is not None, account_id == self._failed_account_id)
+
+        mcc_rollups = {row["account_id"]: row for row in self._read_output("MccRollup")}
+        mcc_summaries = {row["account_id"]: row for row in self._read_output("PerMccSummary")}
+        self.assertEqual(sorted(mcc_rollups), sorted(self._top_ids))
+        for top_id, mcc_rollup in mcc_rollups.items():
+            account_ids = [account_id for account_id in top_ids if top_ids[account_id] == top_id]
+            counts = sum((status_counts[account_id] for account_id in account_ids), Counter())
+            self.assertEqual(mcc_rollup["total_accounts"], len(account_ids))
+            self.assertEqual(mcc_rollup["total_ads_to_remove"], sum(counts.values()))
+            self.assertEqual(mcc_rollup["total_removed_ads"], counts["REMOVED"])
+            self.assertEqual(mcc_rollup["failed_accounts"],
+                             int(self._failed_account_id in account_ids))
+            self.assertEqual(mcc_rollup["total_accounts"],
+                             mcc_summaries[top_id]["total_sub_accounts"])
+            self.assertEqual(mcc_rollup["total_ads_to_remove"],
+                             mcc_summaries[top_id]["top_mcc_total_ads_to_remove"])
+            self.assertEqual(mcc_rollup["failed_accounts"],
+                             mcc_summaries[top_id]["failed_accounts"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A session replayed from the capture of another session. Run from the src folder:
+python3 -m pytest tests"""
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+import main
+from benchmarks.synthetic import wide_tree
+from fakes.google_ads import FakeGoogleAdsClient
+from gads_connector import GAdsServiceWrapper
+from mutate_pipeline import MutatePipeline
+
+_ADS_PER_ACCOUNT = 50
+# Columns which differ from a session to another
+_SESSION_COLUMNS = ("session_id", "timestamp")
+
+
+class StreamCaptureRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self._output_path = tempfile.TemporaryDirectory()
+        self._tree = wide_tree(1, 2, 2)
+        # Small batches: a capture holds several batches per account
+        self._client = FakeGoogleAdsClient(self._tree, _ADS_PER_ACCOUNT, batch_rows=20)
+
+    def tearDown(self):
+        self._output_path.cleanup()
+
+    def _run_session(self, flag, output_folder, client):
+        """Runs a session writing its output to {output_folder}. Returns its output rows by
+        table"""
+        args = main.parse_args(["-id", self._tree.top_id, flag, "-log_level", "WARNING"])
+        main.configure(args)
+        for path in ("_STAGING_PATH", "_JOURNAL_PATH", "_CACHE_PATH", "_CAPTURE_PATH"):
+            setattr(main, path, f"{self._output_path.name}/{path.strip('_').lower()}/")
+        output_path = f"{self._output_path.name}/{output_folder}/"
+        main._OUTPUT_PATH = output_path  # pylint: disable=protected-access
+        main.create_results_folder(output_path)
+        main.gAdsServiceWrapper = None if client is None else \
+            GAdsServiceWrapper(self._tree.top_id, client=client)
+        main.mutatePipeline = MutatePipeline(main.send_bulk_mutate_request,
+                                             args.mutate_concurrency)
+        try:
+            main.main([self._tree.top_id])
+        finally:
+            main.mutatePipeline.shutdown()
+        rows = {}
+        for file_path in Path(output_path).glob("*.jsonl"):
+            with open(file_path, encoding='utf-8') as file_object:
+                rows.setdefault(file_path.name.split("_")[0], []).extend(
+                    _without_session_columns(json.loads(line)) for line in file_object)
+        return rows
+
+    def test_replay_produces_the_rows_of_the_captured_session(self):
+        captured_rows = self._run_session("-capture", "captured", self._client)
+        requests_count = self._client.requests_count
+        # No API in replay mode
+        replayed_rows = self._run_session("-replay", "replayed", None)
+
+        self.assertEqual(self._client.requests_count, requests_count)
+        account_ids = [client_id for client_id, _, _ in
+                       self._tree.clients_with_levels(self._tree.top_id)]
+        self.assertEqual(len(captured_rows["AdsToRemove"]), len(account_ids) * _ADS_PER_ACCOUNT)
+        for table_id in ("AllAccounts", "AdsToRemove", "PerAccountSummary"):
+            self.assertEqual(_sorted_rows(replayed_rows[table_id]),
+                             _sorted_rows(captured_rows[table_id]), table_id)
+
+
+def _without_session_columns(row):
+    return {key: value for key, value in row.items() if key not in _SESSION_COLUMNS}
+
+
+def _sorted_rows(rows):
+    return sorted(rows, key=lambda row: json.dumps(row, sort_keys=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
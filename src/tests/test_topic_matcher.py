@@ -0,0 +1,80 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of topic_matcher against the substring loop it replaced. Run from the src folder:
+python3 -m pytest tests"""
+import itertools
+import unittest
+
+from benchmarks.topic_matcher_benchmark import legacy_has_included_topic
+from topic_matcher import TopicMatcher, compile_substrings
+
+_TOPICS = ["alcohol", "alcohol_in_ad_text", "gambling_and_games", "Gambling", "GAMBLING",
+           "healthcare_and_medicines", "health", "trademarks_in_ad_text", "adult_content",
+           "a.b", "axb", "c++", "price(usd)", "[draft]", "us$", "^caret", "back\\slash", ""]
+_SUBSTRING_LISTS = [[], ["alcohol"], ["alcohol", "alcohol_in"], ["al", "alcohol", "alc"],
+                    ["health", "healthcare"], ["gambling"], ["Gambling"], ["a.b"], ["c++"],
+                    ["(usd)", "[draft]", "$", "^", "\\s", "|", "*"], ["in_ad_text", "ad"]]
+
+
+class TopicMatcherTest(unittest.TestCase):
+
+    def _assert_same_as_legacy(self, inclusion_substrings, exclusion_substrings, topics_lists):
+        matcher = TopicMatcher(inclusion_substrings, exclusion_substrings)
+        for topics in topics_lists:
+            self.assertEqual(matcher.has_included_topic(topics),
+                             legacy_has_included_topic(topics, inclusion_substrings,
+                                                       exclusion_substrings),
+                             f"{topics} with {inclusion_substrings} / {exclusion_substrings}")
+
+    def test_single_topics_match_like_the_substring_loop(self):
+        for inclusion_substrings, exclusion_substrings in itertools.product(_SUBSTRING_LISTS,
+                                                                            repeat=2):
+            self._assert_same_as_legacy(inclusion_substrings, exclusion_substrings,
+                                        [[topic] for topic in _TOPICS])
+
+    def test_topic_lists_match_like_the_substring_loop(self):
+        topics_lists = [[], ["alcohol", "gambling_and_games"], ["GAMBLING", "a.b"],
+                        ["health", "healthcare_and_medicines", "c++"], ["axb", "us$", ""]]
+        for inclusion_substrings, exclusion_substrings in itertools.product(_SUBSTRING_LISTS,
+                                                                            repeat=2):
+            self._assert_same_as_legacy(inclusion_substrings, exclusion_substrings,
+                                        topics_lists)
+
+    def test_an_empty_topic_list_is_never_relevant(self):
+        self.assertFalse(TopicMatcher([], []).has_included_topic([]))
+        self.assertFalse(TopicMatcher(["alcohol"], ["gambling"]).has_included_topic([]))
+
+    def test_overlapping_substrings_match_their_shortest_prefix(self):
+        regex = compile_substrings(["alcohol_in_ad_text", "alcohol", "alc"])
+        self.assertIsNotNone(regex.search("no_alc"))
+        self.assertIsNone(regex.search("al_cohol"))
+
+    def test_metacharacters_are_literal(self):
+        regex = compile_substrings(["a.b", "c++", "(usd)"])
+        self.assertIsNone(regex.search("axb"))
+        self.assertIsNotNone(regex.search("price(usd)"))
+        self.assertIsNone(regex.search("c+"))
+
+    def test_matching_is_case_sensitive(self):
+        # The topics are lower cased by the AdRecordExtractor, the substrings are used as is
+        matcher = TopicMatcher(["gambling"], ["gambling"])
+        self.assertTrue(matcher.has_included_topic(["gambling_and_games"]))
+        self.assertTrue(matcher.has_included_topic(["GAMBLING"]))  # Not excluded either
+        self.assertFalse(TopicMatcher([], ["gambling"]).has_included_topic(["gambling"]))
+        self.assertTrue(TopicMatcher([], ["gambling"]).has_included_topic(["Gambling"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
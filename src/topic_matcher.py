@@ -0,0 +1,76 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Decides whether an ad's policy topics are relevant, per the lists of topics_substrings.json.
+
+A topic is relevant if it contains one of the inclusion substrings, or none of the exclusion
+substrings; an ad is relevant if one of its topics is. Each list is compiled once into a single
+regex whose alternatives are factored as a trie, so a topic is scanned once in C whatever the
+list size. The same few topic lists repeat across millions of rows, so verdicts are memoized per
+topics tuple.
+"""
+import functools
+import re
+
+_DEFAULT_CACHE_SIZE = 65536
+
+
+def compile_substrings(substrings):
+    """Returns a compiled regex that finds any of substrings, or None for an empty list"""
+    if not substrings:
+        return None
+    trie = {}
+    for substring in substrings:
+        node = trie
+        for char in substring:
+            node = node.setdefault(char, {})
+        node[""] = {}  # End of a substring
+    return re.compile(_trie_to_regex(trie))
+
+
+def _trie_to_regex(node):
+    if "" in node:
+        # A substring ends here; matching it is enough, so longer ones are irrelevant.
+        return ""
+    alternatives = [re.escape(char) + _trie_to_regex(child) for char, child in
+                    sorted(node.items())]
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return "(?:" + "|".join(alternatives) + ")"
+
+
+class TopicMatcher:
+    """A compiled, memoized version of the inclusion / exclusion topic substrings check"""
+
+    def __init__(self, inclusion_substrings, exclusion_substrings,
+                 cache_size=_DEFAULT_CACHE_SIZE):
+        self._inclusion_regex = compile_substrings(inclusion_substrings)
+        self._exclusion_regex = compile_substrings(exclusion_substrings)
+        self._cached_verdict = functools.lru_cache(maxsize=cache_size)(self._verdict)
+
+    def has_included_topic(self, current_topics):
+        """Checks if the topic list contains a critical topic"""
+        return self._cached_verdict(tuple(current_topics))
+
+    def is_included_topic(self, current_topic):
+        """Checks if a given topic is critical"""
+        if self._inclusion_regex is not None and self._inclusion_regex.search(current_topic):
+            return True
+        return self._exclusion_regex is None or not self._exclusion_regex.search(current_topic)
+
+    def _verdict(self, current_topics):
+        for current_topic in current_topics:
+            if self.is_included_topic(current_topic):
+                return True
+        return False